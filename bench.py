@@ -0,0 +1,722 @@
+"""Micro-benchmarks for the bot's hot paths.
+
+Run with ``python bench.py <name>``; ``python bench.py --help`` lists them.
+Nothing here talks to Telegram.
+"""
+import argparse
+import asyncio
+import functools
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+from giveaways import GiveawayBook, Participants
+from metrics import Registry, timed
+from ranking import Leaderboard
+from router import CallbackRouter
+from segments import Segments
+from sharding import Coordinator, ShardLink
+from storage import UserRecord, UserStore
+
+
+def new_record(user_id):
+    return UserRecord(
+        username=f"user{user_id}",
+        first_name=f"User {user_id}",
+        joined_date=int(time.time()),
+        points=100
+    )
+
+
+@functools.cache
+def _bot():
+    """bot.py, imported on first use. It needs python-telegram-bot and exits
+    without a BOT_TOKEN, though nothing here calls Telegram."""
+    os.environ.setdefault('BOT_TOKEN', 'bench')
+    import bot
+    return bot
+
+
+def track(user_id, user):
+    """Index a user in bot.py's rankings and segments, as ``get_user`` does
+    for a new one, so ``settle_game`` can move them."""
+    bot = _bot()
+    bot.rankings.add(user_id, user.points)
+    bot.segments.add(user_id, user)
+
+
+def play_click(user_id, user, bet=10):
+    """One dice click through bot.py's ``settle_game``, without the Telegram I/O."""
+    bot = _bot()
+    return bot.settle_game(user_id, user, bot.DICE, bet)
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2] * 1e6
+    p99 = samples[int(len(samples) * 0.99)] * 1e6
+    mean = statistics.fmean(samples) * 1e6
+    print(f"{label:<28} mean {mean:8.2f}us  p50 {p50:8.2f}us  p99 {p99:8.2f}us")
+
+
+# ==================== STORE ====================
+
+async def _clicks(users, store, clicks, sync_commit=False):
+    ids = list(users)
+    samples = []
+    for i in range(clicks):
+        user_id = random.choice(ids)
+        start = time.perf_counter()
+        user = users[user_id] if store is None else store.get(user_id)
+        play_click(user_id, user)
+        if store is not None:
+            store.mark_dirty(user_id)
+            if sync_commit:
+                store.flush()
+        samples.append(time.perf_counter() - start)
+        if i % 50 == 0:
+            # Give the flush task a chance to run, as real handlers would
+            # while awaiting Telegram.
+            await asyncio.sleep(0)
+    return samples
+
+
+async def bench_store(args):
+    users = {user_id: new_record(user_id) for user_id in range(args.users)}
+    for user_id, record in users.items():
+        track(user_id, record)
+
+    samples = await _clicks(users, None, args.clicks)
+    report("in-memory only", samples)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UserStore(os.path.join(tmp, 'bench.db'))
+        store.open()
+        for user_id, record in users.items():
+            store.create(user_id, record)
+        start = time.perf_counter()
+        store.flush()
+        print(f"initial load of {args.users} users: {time.perf_counter() - start:.2f}s")
+
+        store.start()
+        samples = await _clicks(users, store, args.clicks)
+        report("store, write-behind", samples)
+        await store.close()
+
+        store = UserStore(os.path.join(tmp, 'bench.db'))
+        store.open()
+        samples = await _clicks(users, store, min(args.clicks, 2000), sync_commit=True)
+        report("store, commit per click", samples)
+        await store.close()
+
+
+# ==================== RECORDS ====================
+
+def _legacy_record(user_id, now):
+    """A user as the bot stored it before UserRecord: a 9-key dict."""
+    return {
+        'username': f"user{user_id}",
+        'first_name': f"User {user_id}",
+        'joined_date': now,
+        'points': 100 + user_id % 500,
+        'referrals': 0,
+        'last_checkin': now,
+        'games_played': user_id % 40,
+        'games_won': user_id % 17,
+        'total_winnings': user_id % 3000
+    }
+
+
+def _measure(build, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = build(count)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del table
+    return used
+
+
+def bench_records(args):
+    count = args.users
+
+    def dicts(n):
+        return {uid: _legacy_record(uid, datetime.now()) for uid in range(n)}
+
+    def records(n):
+        now = int(time.time())
+        return {
+            uid: UserRecord(f"user{uid}", f"User {uid}", now, 100 + uid % 500, 0, now,
+                            uid % 40, uid % 17, uid % 3000)
+            for uid in range(n)
+        }
+
+    # Usernames and first names are shared by both layouts, so measure them
+    # once and report the per-record overhead on top of them as well.
+    strings = _measure(lambda n: [(f"user{uid}", f"User {uid}") for uid in range(n)], count)
+    for label, build in (("9-key dict + datetime", dicts), ("UserRecord (__slots__)", records)):
+        used = _measure(build, count)
+        print(f"{label:<24} {used / 2**20:8.1f} MiB total  "
+              f"{used / count:6.1f} B/user  {(used - strings) / count:6.1f} B/user excl. names")
+
+
+# ==================== LEADERBOARD ====================
+
+def _timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_leaderboard(args):
+    points = {uid: random.randint(0, 100_000) for uid in range(args.users)}
+    board = Leaderboard()
+    start = time.perf_counter()
+    board.rebuild(points.items())
+    print(f"build index for {args.users} users: {time.perf_counter() - start:.2f}s")
+
+    full_sort = _timeit(lambda: sorted(points.items(), key=lambda x: x[1], reverse=True)[:10], 3)
+    top = _timeit(lambda: board.top(10), 10_000)
+    print(f"{'top 10 by full sort':<28} {full_sort * 1e6:12.1f}us")
+    print(f"{'top 10 from index':<28} {top * 1e6:12.1f}us")
+
+    ids = list(points)
+    sample = random.sample(ids, 1000)
+    rank = _timeit(lambda: [board.rank(points[uid]) for uid in sample], 100) / len(sample)
+    print(f"{'rank lookup from index':<28} {rank * 1e6:12.1f}us")
+
+    start = time.perf_counter()
+    for _ in range(args.clicks):
+        uid = random.choice(ids)
+        old = points[uid]
+        points[uid] = old + random.randint(-100, 300)
+        board.update(uid, old, points[uid])
+    per_update = (time.perf_counter() - start) / args.clicks
+    print(f"{'index update per change':<28} {per_update * 1e6:12.1f}us")
+
+
+# ==================== GIVEAWAY ====================
+
+async def bench_giveaway(args):
+    joins = args.users
+    # A list is quadratic overall, so only time its first joins
+    list_joins = min(joins, 20_000)
+    entries = []
+    start = time.perf_counter()
+    for user_id in range(list_joins):
+        if user_id not in entries:
+            entries.append(user_id)
+    per_join = (time.perf_counter() - start) / list_joins
+    print(f"{'list, first ' + str(list_joins):<28} {per_join * 1e6:10.2f}us/join")
+
+    participants = Participants()
+    start = time.perf_counter()
+    for user_id in range(joins):
+        participants.add(user_id)
+    per_join = (time.perf_counter() - start) / joins
+    print(f"{'Participants, ' + str(joins):<28} {per_join * 1e6:10.2f}us/join")
+    draw = _timeit(participants.choice, 100_000)
+    print(f"{'draw winner':<28} {draw * 1e6:10.2f}us")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        book = GiveawayBook(path)
+        book.open()
+        book.create('bench', amount=100, end_time=int(time.time()) + 3600, creator_id=1, chat_id=1)
+        book.start()
+        start = time.perf_counter()
+        for user_id in range(joins):
+            book.join('bench', user_id)
+            book.join('bench', user_id)  # Double clicks are rejected
+            if user_id % 1000 == 0:
+                await asyncio.sleep(0)
+        per_join = (time.perf_counter() - start) / joins
+        print(f"{'GiveawayBook, persisted':<28} {per_join * 1e6:10.2f}us/join")
+        await book.close()
+
+        book = GiveawayBook(path)
+        start = time.perf_counter()
+        book.open()
+        print(f"reload {len(book.get('bench').participants)} entries: "
+              f"{time.perf_counter() - start:.2f}s")
+        await book.close()
+
+
+# ==================== SEGMENTS ====================
+
+def bench_segments(args):
+    now = int(time.time())
+    records = [
+        (uid, UserRecord(points=random.randint(0, 3000),
+                         games_played=random.choice((0, 0, 1, 5)),
+                         last_active=now - random.randint(0, 20 * 86400)))
+        for uid in range(args.users)
+    ]
+    index = Segments()
+    start = time.perf_counter()
+    index.rebuild(records)
+    print(f"build segments for {args.users} users: {time.perf_counter() - start:.2f}s")
+
+    week_ago = now - 7 * 86400
+    expression = 'active7d & !never_played | rich'
+
+    def scan():
+        return sum(
+            1 for _, r in records
+            if (r.last_active >= week_ago and r.games_played > 0) or r.points > 1000
+        )
+
+    print(f"{'count by scanning records':<28} {_timeit(scan, 3) * 1e3:10.2f}ms")
+    print(f"{'count from bitmaps':<28} {_timeit(lambda: index.count(expression), 20) * 1e3:10.2f}ms")
+    print(f"{'member ids from bitmaps':<28} {_timeit(lambda: index.members(expression), 3) * 1e3:10.2f}ms")
+
+    ids = [uid for uid, _ in records]
+    start = time.perf_counter()
+    for _ in range(args.clicks):
+        uid = random.choice(ids)
+        index.update_points(uid, random.randint(0, 3000))
+        index.played(uid)
+    per_update = (time.perf_counter() - start) / args.clicks
+    print(f"{'update per game':<28} {per_update * 1e6:10.2f}us")
+
+
+# ==================== MENUS ====================
+
+def _menu_screens():
+    """The /start and dice-result screens built per click, as the handlers
+    did before the keyboards and templates moved to module level in bot.py,
+    and from those module-level ones."""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+    bot = _bot()
+    channel, group = bot.CHANNEL_LINK, bot.GROUP_LINK
+
+    def start_rebuilt(first_name, owner):
+        keyboard = [
+            [InlineKeyboardButton("📢 Join Channel", url=channel)],
+            [InlineKeyboardButton("👥 Join Group", url=group)],
+            [InlineKeyboardButton("🎮 PLAY GAMES 🎮", callback_data='games_menu')],
+            [InlineKeyboardButton("💰 Earn Points", callback_data='earn')],
+            [InlineKeyboardButton("📊 My Stats", callback_data='stats')],
+            [InlineKeyboardButton("🤝 Refer Friends", callback_data='refer')],
+            [InlineKeyboardButton("🏆 Leaderboard", callback_data='leaderboard')],
+            [InlineKeyboardButton("📞 Contact Owner", callback_data='contact_owner')],
+        ]
+        if owner:
+            keyboard.append([InlineKeyboardButton("👑 Owner Panel", callback_data='owner_panel')])
+        text = (
+            f"🎮 **Welcome to GAMELY!** 🎮\n\n"
+            f"Hello {first_name}! 👋\n\n"
+            f"Get ready for the ultimate gaming experience with GAMELY!\n\n"
+            f"**What we offer:**\n"
+            f"• Exclusive gaming content\n"
+            f"• Pro tips and strategies\n"
+            f"• Daily giveaways\n"
+            f"• Gaming community\n"
+            f"• Earn points and rewards\n\n"
+            f"**Our Community:**\n"
+            f"📢 Channel: {channel}\n"
+            f"👥 Group: {group}\n\n"
+            f"#Developed by AAKASH\n\n"
+            f"👇 **Use the buttons below to get started!** 👇"
+        )
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def dice_rebuilt(roll, bet, points, games_played, win_rate):
+        dice_faces = ["⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
+        text = (
+            f"🎲 **DICE ROLL RESULT** 🎲\n\n"
+            f"You rolled: **{dice_faces[roll-1]} {roll}**\n\n"
+            f"✅ You won double!\n\n"
+            f"Bet: **{bet}** points\n"
+            f"Won: **{bet * 2}** points\n"
+            f"New Balance: **{points}** points\n\n"
+            f"Games Played: {games_played}\n"
+            f"Win Rate: {win_rate}%"
+        )
+        keyboard = [
+            [InlineKeyboardButton("🎲 Play Again", callback_data='game_dice')],
+            [InlineKeyboardButton("🔙 Games Menu", callback_data='games_menu')],
+        ]
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def start_cached(first_name, owner):
+        return bot.WELCOME_TEMPLATE.format(first_name=first_name), bot.MAIN_MENU_KEYBOARDS[owner]
+
+    def dice_cached(roll, bet, points, games_played, win_rate):
+        text = bot.DICE_RESULT_TEMPLATE.format(
+            face=bot.DICE_FACES[roll - 1], roll=roll, result_text="✅ You won double!",
+            bet=bet, winnings=bet * 2, points=points, games_played=games_played, win_rate=win_rate
+        )
+        return text, bot.PLAY_AGAIN_KEYBOARDS['dice']
+
+    return {
+        '/start': (lambda: start_rebuilt('Alice', False), lambda: start_cached('Alice', False)),
+        'dice result': (lambda: dice_rebuilt(5, 25, 1234, 12, 50), lambda: dice_cached(5, 25, 1234, 12, 50)),
+    }
+
+
+class _Replies:
+    """Stands in for an update's message and callback query, keeping the
+    last reply instead of sending it."""
+
+    def __init__(self, user):
+        self.from_user = user
+        self.last = None
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def reply_text(self, text, **kwargs):
+        self.last = text
+
+    edit_message_text = reply_text
+
+
+def _menu_handlers():
+    """bot.py's /start and dice handlers, callable without an event loop."""
+    bot = _bot()
+    sender = SimpleNamespace(id=10_000_001, username='alice', first_name='Alice')
+    replies = _Replies(sender)
+    update = SimpleNamespace(effective_user=sender, message=replies, callback_query=replies)
+    user = bot.get_user(sender.id, sender.username, sender.first_name)
+    bot.adjust_points(sender.id, user, 10 ** 9, bot.ADMIN_ADD)  # So no bet is refused
+
+    def call(handler, *args):
+        # Every await in these handlers lands on _Replies, which never
+        # suspends, so one send runs the whole handler
+        coroutine = handler(update, None, *args)
+        try:
+            coroutine.send(None)
+        except StopIteration:
+            return replies.last
+        coroutine.close()
+        raise RuntimeError(f"{handler.__name__} suspended")
+
+    return {
+        '/start': lambda: call(bot.start),
+        'dice result': lambda: call(bot.play_dice, 25),
+    }
+
+
+def _allocated(func):
+    """Bytes allocated while ``func`` runs, whether or not they are kept."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak - before
+
+
+def bench_menus(args):
+    handlers = _menu_handlers()
+    for screen, (rebuilt, cached) in _menu_screens().items():
+        for name, build in (('rebuilt', rebuilt), ('cached', cached), ('handler', handlers[screen])):
+            per_update = _timeit(lambda: [build() for _ in range(args.clicks)], 3) / args.clicks
+            print(f"{screen:<12} {name:<8} {per_update * 1e6:8.2f}us  {_allocated(build):7d} bytes per update")
+
+
+# ==================== ROUTER ====================
+
+# The button data seen in a typical session, most common first
+CALLBACK_DATA = (
+    ['dice_10', 'dice_25', 'coin_10_heads', 'coin_50_tails', 'slots_20', 'slots_100'] * 5
+    + ['games_menu', 'game_dice', 'game_coin', 'back_to_menu', 'stats', 'leaderboard']
+    + ['giveaway_1700000000', 'refer', 'earn', 'owner_panel', 'audience_rich', 'confirm_broadcast']
+)
+
+EXACT_ROUTES = (
+    'owner_panel', 'owner_stats', 'owner_create_giveaway', 'owner_broadcast_panel',
+    'start_broadcast', 'confirm_broadcast', 'owner_addcoins', 'contact_owner',
+    'games_menu', 'game_dice', 'game_coin', 'game_slots', 'game_stats',
+    'leaderboard', 'earn', 'stats', 'refer', 'back_to_menu',
+)
+
+
+def _chain_route(data):
+    """The old if/elif dispatch of button_callback, minus the handlers."""
+    if data == 'owner_panel':
+        return 'owner_panel', ()
+    elif data == 'owner_stats':
+        return 'owner_stats', ()
+    elif data == 'owner_create_giveaway':
+        return 'owner_create_giveaway', ()
+    elif data == 'owner_broadcast_panel':
+        return 'owner_broadcast_panel', ()
+    elif data == 'start_broadcast':
+        return 'start_broadcast', ()
+    elif data.startswith('audience_'):
+        return 'audience', (data.replace('audience_', '', 1),)
+    elif data == 'confirm_broadcast':
+        return 'confirm_broadcast', ()
+    elif data == 'owner_addcoins':
+        return 'owner_addcoins', ()
+    elif data == 'contact_owner':
+        return 'contact_owner', ()
+    elif data.startswith('giveaway_'):
+        return 'giveaway', (data.replace('giveaway_', ''),)
+    elif data.startswith('endgiveaway_'):
+        return 'endgiveaway', (data.replace('endgiveaway_', ''),)
+    elif data == 'games_menu':
+        return 'games_menu', ()
+    elif data == 'game_dice':
+        return 'game_dice', ()
+    elif data == 'game_coin':
+        return 'game_coin', ()
+    elif data == 'game_slots':
+        return 'game_slots', ()
+    elif data == 'game_stats':
+        return 'game_stats', ()
+    elif data.startswith('dice_'):
+        return 'dice', (int(data.split('_')[1]),)
+    elif data.startswith('coin_'):
+        parts = data.split('_')
+        return 'coin', (int(parts[1]), parts[2])
+    elif data.startswith('slots_'):
+        return 'slots', (int(data.split('_')[1]),)
+    elif data == 'leaderboard':
+        return 'leaderboard', ()
+    elif data == 'earn':
+        return 'earn', ()
+    elif data == 'stats':
+        return 'stats', ()
+    elif data == 'refer':
+        return 'refer', ()
+    elif data == 'back_to_menu':
+        return 'back_to_menu', ()
+
+
+def bench_router(args):
+    async def handler(update, context, *args):
+        pass
+
+    router = CallbackRouter()
+    for data in EXACT_ROUTES:
+        router.add(data, handler)
+    router.add_prefix('audience_', handler, r'(\w+)')
+    router.add_prefix('giveaway_', handler, r'(\d{1,20})')
+    router.add_prefix('endgiveaway_', handler, r'(\d{1,20})')
+    router.add_prefix('dice_', handler, r'(\d{1,9})', int)
+    router.add_prefix('coin_', handler, r'(\d{1,9})_(heads|tails)', int, str)
+    router.add_prefix('slots_', handler, r'(\d{1,9})', int)
+
+    clicks = [random.choice(CALLBACK_DATA) for _ in range(args.clicks)]
+
+    def run(route):
+        for data in clicks:
+            route(data)
+
+    for name, route in (('if/elif chain', _chain_route), ('router', router.resolve)):
+        per_click = _timeit(lambda: run(route), 5) / len(clicks)
+        print(f"{name:<16} {per_click * 1e9:8.0f}ns per callback")
+
+    async def dispatch_all():
+        for data in clicks:
+            await router.dispatch(None, None, data)
+
+    start = time.perf_counter()
+    asyncio.run(dispatch_all())
+    per_click = (time.perf_counter() - start) / len(clicks)
+    print(f"{'router + stats':<16} {per_click * 1e9:8.0f}ns per callback (dispatch with timing)")
+
+    try:
+        _chain_route('dice_abc')
+    except ValueError as e:
+        print(f"malformed 'dice_abc': chain raises {type(e).__name__}, router returns {router.resolve('dice_abc')}")
+
+
+# ==================== CONCURRENT UPDATES ====================
+
+async def _run_updates(updates, processor, api_latency, slow_latency):
+    """Feed (user_id, seq, slow) updates through ``processor`` like PTB does.
+
+    The handler is a bet that checks the balance, awaits an API call, then
+    debits - the pattern that double-spends if one user's taps overlap.
+    None as the processor handles updates one by one.
+    """
+    balances = {}
+    last_seen = {}
+    problems = {'out_of_order': 0, 'overdrawn': 0}
+
+    async def handle(update):
+        user_id, seq, slow = update
+        points = balances.setdefault(user_id, 30)
+        await asyncio.sleep(slow_latency if slow else api_latency)
+        # Replies must reach the player in the order they tapped
+        if seq < last_seen.get(user_id, -1):
+            problems['out_of_order'] += 1
+        last_seen[user_id] = seq
+        if points < 10:
+            return
+        balances[user_id] -= 10
+        if balances[user_id] < 0:
+            problems['overdrawn'] += 1
+
+    start = time.perf_counter()
+    if processor is None:
+        for update in updates:
+            await handle(update)
+    else:
+        await asyncio.gather(*(processor.process_update(update, handle(update)) for update in updates))
+    return len(updates) / (time.perf_counter() - start), problems
+
+
+def bench_updates(args):
+    from telegram.ext import SimpleUpdateProcessor
+    from ordering import OrderedUpdateProcessor
+
+    # Players tap in bursts of 1-5; one update in five is a slow edit
+    updates = []
+    seqs = {}
+    users = max(args.users // 1000, 50)
+    while len(updates) < args.clicks // 10:
+        user_id = random.randrange(users)
+        for _ in range(random.randint(1, 5)):
+            seq = seqs[user_id] = seqs.get(user_id, 0) + 1
+            updates.append((user_id, seq, random.random() < 0.2))
+
+    api_latency, slow_latency = 0.02, 0.2
+    runs = [
+        ('sequential', lambda: None, updates[:200]),
+        ('concurrent, unordered', lambda: SimpleUpdateProcessor(64), updates),
+        ('concurrent, per-user order', lambda: OrderedUpdateProcessor(64, key=lambda u: u[0]), updates),
+    ]
+    print(f"{users} users, 20ms replies, 200ms for one update in five")
+    for name, make, batch in runs:
+        rate, problems = asyncio.run(_run_updates(batch, make(), api_latency, slow_latency))
+        print(
+            f"{name:<28} {rate:8.0f} updates/s  "
+            f"{problems['out_of_order']:5d} out of order  {problems['overdrawn']:5d} overdrawn"
+        )
+
+
+# ==================== SHARDS ====================
+
+def _handle_update(data, work):
+    """Stand-in for a handler: a game click plus ``work`` units of CPU."""
+    user_id, user = data['user_id'], data['user']
+    track(user_id, user)
+    play_click(user_id, user)
+    total = 0
+    for i in range(work):
+        total += i * i
+    return total
+
+
+async def _serve_bench_shard(link, work):
+    processed = 0
+
+    def on_update(data):
+        nonlocal processed
+        _handle_update(data, work)
+        processed += 1
+
+    async def ping():
+        return processed
+
+    link.start(on_update=on_update, ops={'ping': ping})
+    await link.stopped.wait()
+
+
+def _bench_worker(index, shards, inbox, outbox, work=5_000):
+    # Module level so spawned worker processes can import it
+    asyncio.run(_serve_bench_shard(ShardLink(index, shards, inbox, outbox), work))
+
+
+async def _run_shards(workers, updates):
+    coordinator = Coordinator(workers, _bench_worker)
+    coordinator.start()
+    # Wait until every worker is up so process start-up is not timed
+    await asyncio.gather(*(coordinator.call_shard(i, 'ping', {}) for i in range(workers)))
+
+    start = time.perf_counter()
+    for user_id in range(updates):
+        coordinator.dispatch(user_id, {'user_id': user_id, 'user': new_record(user_id)})
+    # Workers drain their queue before honouring the stop request
+    await asyncio.to_thread(coordinator.stop)
+    return updates / (time.perf_counter() - start)
+
+
+async def bench_shards(args):
+    counts = [1, 2, 4, os.cpu_count() or 1]
+    for workers in sorted(set(counts)):
+        rate = await _run_shards(workers, args.clicks)
+        print(f"{workers:>2} workers  {rate:10.0f} updates/s")
+
+
+# ==================== METRICS ====================
+
+def bench_metrics(args):
+    registry = Registry()
+    handler_seconds = registry.histogram('handler_seconds', "Handler time", ('handler',))
+    api_seconds = registry.histogram('api_seconds', "Bot API time", ('method', 'status'))
+    games = registry.counter('games_total', "Games", ('game',))
+
+    async def handler(update, context):
+        pass
+
+    metered = timed(handler_seconds, handler, 'handler')
+
+    async def run(callback):
+        start = time.perf_counter()
+        for _ in range(args.clicks):
+            await callback(None, None)
+        return (time.perf_counter() - start) / args.clicks
+
+    bare = asyncio.run(run(handler))
+    with_timing = asyncio.run(run(metered))
+    print(f"{'bare handler':<20} {bare * 1e9:8.0f}ns per call")
+    print(f"{'timed handler':<20} {with_timing * 1e9:8.0f}ns per call (+{(with_timing - bare) * 1e9:.0f}ns)")
+
+    # A busy bot's worth of series: every handler, method and status seen
+    for i in range(40):
+        handler_seconds.observe(random.random(), f"handler{i}")
+    for method in ('sendMessage', 'editMessageText', 'answerCallbackQuery', 'getUpdates'):
+        for status in ('200', '400', '403', '429', 'timeout'):
+            api_seconds.observe(random.random(), method, status)
+    for game in ('dice', 'coin', 'slots'):
+        games.inc(game)
+    per_scrape = _timeit(registry.render, 100)
+    size = len(registry.render().encode())
+    print(f"{'scrape':<20} {per_scrape * 1e3:8.2f}ms for {size} bytes")
+
+
+BENCHMARKS = {
+    'store': (bench_store, "game-click latency with and without the SQLite store"),
+    'records': (bench_records, "memory of user records, dicts vs UserRecord"),
+    'leaderboard': (bench_leaderboard, "top-10, rank and update cost of the sorted index"),
+    'giveaway': (bench_giveaway, "giveaway joins and winner draw, list vs Participants"),
+    'segments': (bench_segments, "audience counts from bitmaps vs scanning users"),
+    'menus': (bench_menus, "menu keyboards and texts built per click vs cached, and the real handlers"),
+    'router': (bench_router, "cost of routing a button callback, if/elif chain vs router"),
+    'updates': (bench_updates, "throughput and ordering of concurrent update processing"),
+    'shards': (bench_shards, "update throughput by number of worker processes"),
+    'metrics': (bench_metrics, "overhead of timing handlers and cost of a metrics scrape"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--clicks', type=int, default=50_000)
+    args = parser.parse_args()
+
+    func, description = BENCHMARKS[args.name]
+    print(f"== {args.name}: {description}")
+    result = func(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,61 @@ import sys
 import random
 import json
 import asyncio
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import shutil
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo
+)
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
 import time
 
+from ledger import (
+    Ledger,
+    OPENING,
+    SIGNUP,
+    BET,
+    BET_LOST,
+    PAYOUT,
+    CHECKIN,
+    REFERRAL,
+    ADMIN_ADD,
+    ADMIN_REMOVE,
+    GIVEAWAY
+)
+from botrequest import MeteredRequest
+from broadcast import Broadcaster, BroadcastJob, BroadcastJobs, Unreachable
+from economy import Economy
+from gamerules import COIN, COIN_SIDES, DICE, SLOTS
+from giveaways import GiveawayBook
+from metadata import BotMetadata
+from metrics import MetricsServer, Registry, timed
+from ordering import OrderedUpdateProcessor
+from ranking import Leaderboard
+from router import CallbackRouter
+from scheduler import DeadlineScheduler
+from segments import Segments, day_number
+from sharding import Coordinator, ShardError, ShardLink, shard_for, shard_path
+from storage import UserRecord, UserStore
+from throttle import Throttle
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -52,31 +95,168 @@ logger.info(f"Channel link: {CHANNEL_LINK}")
 logger.info(f"Group link: {GROUP_LINK}")
 logger.info(f"Owner ID: {OWNER_ID}")
 
-# Store user data
-user_data = {}
+# Webhook Configuration: with WEBHOOK_URL set, Telegram pushes updates to an
+# HTTP server on PORT instead of the bot polling for them
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')  # Public base URL, e.g. https://gamely.up.railway.app
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+# Telegram sends this back with every update; a random one is used if unset
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+PORT = int(os.environ.get('PORT', '8443'))
+
+# Bot API server, e.g. a self-hosted telegram-bot-api or a local test server
+BOT_API_URL = os.environ.get('BOT_API_URL', 'https://api.telegram.org').rstrip('/')
+
+# Updates handled at once. Each user's (or chat's) updates still run one at
+# a time in order, so a slow reply to one player doesn't hold up the others
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '64'))  # 1 handles updates one by one
+
+# Throttling: game taps and group game commands beyond these rates are
+# dropped, so a few users spamming buttons can't use up the flood budget
+THROTTLE_USER_RATE = float(os.environ.get('THROTTLE_USER_RATE', '2'))  # Game actions per second, per user
+THROTTLE_USER_BURST = int(os.environ.get('THROTTLE_USER_BURST', '5'))  # Taps allowed back to back
+THROTTLE_CHAT_RATE = float(os.environ.get('THROTTLE_CHAT_RATE', '5'))  # Group game commands per second, per group
+THROTTLE_CHAT_BURST = int(os.environ.get('THROTTLE_CHAT_BURST', '10'))
+
+# Metrics: Prometheus text at http://METRICS_HOST:METRICS_PORT/metrics. When
+# sharded, the front serves METRICS_PORT and worker N METRICS_PORT + 1 + N
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9464'))  # 0 turns the endpoint off
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')  # 0.0.0.0 to allow scrapes from other hosts
+
+# Sharded mode: with WORKERS > 1, one front process receives updates and
+# hands each to one of WORKERS processes, chosen by user id
+WORKERS = int(os.environ.get('WORKERS', '0'))
+SHARD_CALL_TIMEOUT = float(os.environ.get('SHARD_CALL_TIMEOUT', '10'))  # Seconds to wait for another worker
+
+# Broadcast Configuration
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '25'))  # Messages per second, whole bot
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '32'))  # Sends in flight at once
+BROADCAST_CHECKPOINT_EVERY = int(os.environ.get('BROADCAST_CHECKPOINT_EVERY', '500'))  # Recipients between checkpoints
+BROADCAST_STATUS_INTERVAL = float(os.environ.get('BROADCAST_STATUS_INTERVAL', '5'))  # Seconds between status edits
+BROADCAST_ALBUM_WAIT = float(os.environ.get('BROADCAST_ALBUM_WAIT', '1.5'))  # Seconds to collect album parts
+
+# Storage Configuration
+DB_PATH = os.environ.get('DB_PATH', 'gamely.db')
+SHARDS_MARKER = f"{DB_PATH}.shards"  # Holds the WORKERS the data was split for
+DB_FLUSH_INTERVAL = float(os.environ.get('DB_FLUSH_INTERVAL', '0.25'))  # Seconds between batched commits
+
+# Audience segments for broadcasts
+SEGMENT_RICH_POINTS = int(os.environ.get('SEGMENT_RICH_POINTS', '1000'))  # "rich" means more points than this
+SEGMENT_ACTIVE_DAYS = int(os.environ.get('SEGMENT_ACTIVE_DAYS', '7'))  # Window of the "active7d" segment
+
+# Ledger Configuration
+LEDGER_DIR = os.environ.get('LEDGER_DIR', 'ledger')
+LEDGER_SNAPSHOT_EVERY = int(os.environ.get('LEDGER_SNAPSHOT_EVERY', '100000'))  # Records between snapshots
+LEDGER_KEEP_SEGMENTS = int(os.environ.get('LEDGER_KEEP_SEGMENTS', '10'))  # Rotated logs kept for /ledger
+
+# Store user data (opened in post_init)
+store = UserStore(DB_PATH, flush_interval=DB_FLUSH_INTERVAL)
+
+# Read-only defaults for users not in the store yet; never mutate
+NO_USER = UserRecord()
+
+# Users ordered by points (rebuilt in post_init, updated by adjust_points)
+rankings = Leaderboard()
+
+# Every balance change, as an append-only log (loaded in post_init)
+coin_ledger = Ledger(
+    LEDGER_DIR,
+    flush_interval=DB_FLUSH_INTERVAL,
+    snapshot_every=LEDGER_SNAPSHOT_EVERY,
+    keep_segments=LEDGER_KEEP_SEGMENTS
+)
+
+# Running economy totals for /stats (rebuilt in post_init)
+economy = Economy(coin_ledger)
+
+# Broadcast audience segments as bitmaps (rebuilt in post_init)
+segments = Segments(rich_threshold=SEGMENT_RICH_POINTS, active_days=SEGMENT_ACTIVE_DAYS)
+
+# Presets offered as buttons in the broadcast preview; anything else is set with /audience
+AUDIENCE_PRESETS = {
+    'all': "👥 Everyone",
+    'active7d': "🟢 Active 7d",
+    'rich': f"💰 >{SEGMENT_RICH_POINTS} pts",
+    'never_played': "🆕 Never played",
+}
+
+# Store active giveaways (opened in post_init, kept in the users database)
+active_giveaways = GiveawayBook(DB_PATH, flush_interval=DB_FLUSH_INTERVAL)
+
+# Closes each giveaway at its end time (started in post_init)
+giveaway_deadlines = DeadlineScheduler(lambda giveaway_id: expire_giveaway(giveaway_id))
+
+# Users who blocked the bot or are gone; skipped by broadcasts until they
+# interact again (opened in post_init)
+unreachable_users = Unreachable(DB_PATH, flush_interval=DB_FLUSH_INTERVAL)
+
+# Shared by every broadcast; in sharded mode each worker gets its share of the rate
+broadcaster = Broadcaster(
+    rate=BROADCAST_RATE / max(WORKERS, 1),
+    concurrency=BROADCAST_CONCURRENCY,
+    unreachable=unreachable_users
+)
+
+# Broadcast jobs, saved so a restart resumes them (opened in post_init)
+broadcast_jobs = BroadcastJobs(DB_PATH)
+
+# Running broadcast sends and status updates, cancelled at shutdown
+broadcast_tasks = set()
+
+# The running bot, for shard operations that send messages (set in post_init)
+active_bot = None
+
+# Bot username/id and resolved chat ids, so handlers never call the Bot API
+# just to learn them (filled in post_init, refreshed with /botinfo refresh)
+bot_metadata = BotMetadata(chats=[CHANNEL_USERNAME_DISPLAY])
+
+# Link to the coordinator when running as a shard worker (set in run_worker)
+shard_link = None
+
+# Prometheus metrics (served by metrics_server, started in post_init)
+metrics = Registry()
+handler_seconds = metrics.histogram(
+    'gamely_handler_seconds', "Time spent in each update handler", ('handler',)
+)
+route_seconds = metrics.histogram(
+    'gamely_callback_route_seconds', "Time spent in the handler of each button route", ('route',)
+)
+bot_api_seconds = metrics.histogram(
+    'gamely_bot_api_seconds', "Bot API call latency by method and HTTP status", ('method', 'status')
+)
+games_played_total = metrics.counter('gamely_games_played_total', "Game rounds played", ('game',))
+points_staked_total = metrics.counter('gamely_points_staked_total', "Points bet on games", ('game',))
+points_paid_total = metrics.counter('gamely_points_paid_total', "Points paid out by games", ('game',))
+throttled_total = metrics.counter(
+    'gamely_throttled_total', "Game actions dropped by the user or group throttle", ('scope',)
+)
+metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT)
 
-# Store active giveaways
-active_giveaways = {}
+# Maps button callback data to handlers (routes are added under CALLBACK HANDLER)
+callback_router = CallbackRouter(observer=lambda route, seconds: route_seconds.observe(seconds, route))
+
+# Rate limits for game actions, per user and per group chat
+user_throttle = Throttle(THROTTLE_USER_RATE, THROTTLE_USER_BURST)
+chat_throttle = Throttle(THROTTLE_CHAT_RATE, THROTTLE_CHAT_BURST)
 
 # Game data
 games = {
     'dice': {
         'name': '🎲 Dice Roll',
         'description': 'Roll the dice and win up to 100 points!',
-        'min_bet': 10,
-        'max_bet': 100
+        'min_bet': DICE.min_bet,
+        'max_bet': DICE.max_bet
     },
     'coin': {
         'name': '🪙 Coin Flip',
         'description': 'Heads or Tails? Double your points!',
-        'min_bet': 5,
-        'max_bet': 50
+        'min_bet': COIN.min_bet,
+        'max_bet': COIN.max_bet
     },
     'slots': {
         'name': '🎰 Slot Machine',
         'description': 'Spin and win big jackpots!',
-        'min_bet': 20,
-        'max_bet': 200
+        'min_bet': SLOTS.min_bet,
+        'max_bet': SLOTS.max_bet
     }
 }
 
@@ -92,38 +272,624 @@ PROMO_MESSAGES = [
     "🎲 Exclusive giveaways and contests at GAMELY!",
 ]
 
+# ==================== KEYBOARDS AND TEMPLATES ====================
+# Menus are the same for everyone, so their keyboards are built once here and
+# shared (PTB's objects are immutable). Templates have the static text baked
+# in; handlers only fill in the per-user fields with str.format.
+
+def build_keyboard(rows):
+    """An inline keyboard with one button per row from (text, callback_data) pairs."""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data)] for text, data in rows])
+
+MAIN_MENU_ROWS = [
+    [InlineKeyboardButton("📢 Join Channel", url=CHANNEL_LINK)],
+    [InlineKeyboardButton("👥 Join Group", url=GROUP_LINK)],
+    [InlineKeyboardButton("🎮 PLAY GAMES 🎮", callback_data='games_menu')],
+    [InlineKeyboardButton("💰 Earn Points", callback_data='earn')],
+    [InlineKeyboardButton("📊 My Stats", callback_data='stats')],
+    [InlineKeyboardButton("🤝 Refer Friends", callback_data='refer')],
+    [InlineKeyboardButton("🏆 Leaderboard", callback_data='leaderboard')],
+    [InlineKeyboardButton("📞 Contact Owner", callback_data='contact_owner')],
+]
+
+# Main menu by "is owner", since only the owner gets the panel button
+MAIN_MENU_KEYBOARDS = {
+    False: InlineKeyboardMarkup(MAIN_MENU_ROWS),
+    True: InlineKeyboardMarkup(
+        MAIN_MENU_ROWS + [[InlineKeyboardButton("👑 Owner Panel", callback_data='owner_panel')]]
+    ),
+}
+
+OWNER_PANEL_KEYBOARD = build_keyboard([
+    ("📊 Bot Statistics", 'owner_stats'),
+    ("🎁 Create Giveaway", 'owner_create_giveaway'),
+    ("💰 Add Coins", 'owner_addcoins'),
+    ("📢 Broadcast Message", 'owner_broadcast_panel'),
+    ("🔙 Main Menu", 'back_to_menu'),
+])
+
+GAMES_MENU_KEYBOARD = build_keyboard([
+    ("🎲 Dice Roll", 'game_dice'),
+    ("🪙 Coin Flip", 'game_coin'),
+    ("🎰 Slot Machine", 'game_slots'),
+    ("📊 My Game Stats", 'game_stats'),
+    ("🔙 Main Menu", 'back_to_menu'),
+])
+
+DICE_KEYBOARD = build_keyboard(
+    [(f"💰 Bet {bet} Points", f'dice_{bet}') for bet in DICE.bets]
+    + [("🔙 Back to Games", 'games_menu')]
+)
+
+COIN_KEYBOARD = build_keyboard(
+    [(f"Bet {bet} Points - {side.title()}", f'coin_{bet}_{side}') for bet in COIN.bets for side in COIN_SIDES]
+    + [("🔙 Back to Games", 'games_menu')]
+)
+
+SLOTS_KEYBOARD = build_keyboard(
+    [(f"💰 Bet {bet} Points", f'slots_{bet}') for bet in SLOTS.bets]
+    + [("🔙 Back to Games", 'games_menu')]
+)
+
+# Shown under every game result
+PLAY_AGAIN_KEYBOARDS = {
+    game: build_keyboard([(f"{emoji} Play Again", f'game_{game}'), ("🔙 Games Menu", 'games_menu')])
+    for game, emoji in (('dice', "🎲"), ('coin', "🪙"), ('slots', "🎰"))
+}
+
+WELCOME_TEMPLATE = (
+    f"🎮 **Welcome to GAMELY!** 🎮\n\n"
+    f"Hello {{first_name}}! 👋\n\n"
+    f"Get ready for the ultimate gaming experience with GAMELY!\n\n"
+    f"**What we offer:**\n"
+    f"• Exclusive gaming content\n"
+    f"• Pro tips and strategies\n"
+    f"• Daily giveaways\n"
+    f"• Gaming community\n"
+    f"• Earn points and rewards\n\n"
+    f"**Our Community:**\n"
+    f"📢 Channel: {CHANNEL_LINK}\n"
+    f"👥 Group: {GROUP_LINK}\n\n"
+    f"#Developed by AAKASH\n\n"
+    f"👇 **Use the buttons below to get started!** 👇"
+)
+
+WELCOME_BACK_TEMPLATE = (
+    f"🎮 **Welcome to GAMELY!** 🎮\n\n"
+    f"Welcome back! Your points: **{{points}}**\n\n"
+    f"**Our Community:**\n"
+    f"📢 Channel: {CHANNEL_LINK}\n"
+    f"👥 Group: {GROUP_LINK}\n\n"
+    f"#Developed by AAKASH\n\n"
+    f"Choose an option below:"
+)
+
+GAMES_MENU_TEMPLATE = (
+    "🎮 **GAMES MENU** 🎮\n\n"
+    "Your Points: **{points}** 💰\n\n"
+    "**Available Games:**\n"
+    "🎲 Dice Roll - Win up to 100 points\n"
+    "🪙 Coin Flip - Double your points\n"
+    "🎰 Slot Machine - Win big jackpots\n\n"
+    "**Select a game to play:**"
+)
+
+DICE_TEMPLATE = (
+    "🎲 **DICE ROLL** 🎲\n\n"
+    "Your Points: **{points}**\n\n"
+    "**How to play:**\n"
+    "• Choose your bet amount\n"
+    "• Roll higher than 3 to win!\n"
+    "• Roll 1-3: You lose\n"
+    "• Roll 4-6: You win double!\n"
+    "• Roll 6: You win triple!\n\n"
+    "Select your bet amount:"
+)
+
+COIN_TEMPLATE = (
+    "🪙 **COIN FLIP** 🪙\n\n"
+    "Your Points: **{points}**\n\n"
+    "**How to play:**\n"
+    "• Choose Heads or Tails\n"
+    "• Win double your bet!\n\n"
+    "Make your choice:"
+)
+
+SLOTS_TEMPLATE = (
+    "🎰 **SLOT MACHINE** 🎰\n\n"
+    "Your Points: **{points}**\n\n"
+    "**Winning Combinations:**\n"
+    "🍒🍒🍒 - Win 3x\n"
+    "🍋🍋🍋 - Win 5x\n"
+    "💎💎💎 - Win 10x\n"
+    "7️⃣7️⃣7️⃣ - JACKPOT 20x!\n\n"
+    "Select your bet:"
+)
+
+DICE_RESULT_TEMPLATE = (
+    "🎲 **DICE ROLL RESULT** 🎲\n\n"
+    "You rolled: **{face} {roll}**\n\n"
+    "{result_text}\n\n"
+    "Bet: **{bet}** points\n"
+    "Won: **{winnings}** points\n"
+    "New Balance: **{points}** points\n\n"
+    "Games Played: {games_played}\n"
+    "Win Rate: {win_rate}%"
+)
+
+COIN_RESULT_TEMPLATE = (
+    "🪙 **COIN FLIP RESULT** 🪙\n\n"
+    "Coin landed: **{coin}**\n"
+    "Your choice: **{choice}**\n\n"
+    "{result_text}\n\n"
+    "Bet: **{bet}** points\n"
+    "Won: **{winnings}** points\n"
+    "New Balance: **{points}** points"
+)
+
+SLOTS_RESULT_TEMPLATE = (
+    "🎰 **SLOT MACHINE RESULT** 🎰\n\n"
+    "{reels}\n\n"
+    "{result_text}\n\n"
+    "Bet: **{bet}** points\n"
+    "Won: **{winnings}** points\n"
+    "Multiplier: **{multiplier}x**\n"
+    "New Balance: **{points}** points"
+)
+
+DICE_FACES = ["⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
+
 # ==================== HELPER FUNCTIONS ====================
 
 def is_owner(user_id):
     """Check if user is the bot owner."""
     return user_id == OWNER_ID
 
+def new_user_record(username=None, first_name=None, points=100):
+    """Build a fresh user record."""
+    now = int(time.time())
+    return UserRecord(
+        username=username,
+        first_name=first_name,
+        joined_date=now,
+        points=points,
+        last_active=now
+    )
+
 def get_user(user_id, username=None, first_name=None):
     """Get or create user in database."""
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'username': username,
-            'first_name': first_name,
-            'joined_date': datetime.now(),
-            'points': 100,  # Starting bonus
-            'referrals': 0,
-            'last_checkin': None,
-            'games_played': 0,
-            'games_won': 0,
-            'total_winnings': 0
-        }
-    return user_data[user_id]
+    user = store.get(user_id)
+    if user is None:
+        user = store.create(user_id, new_user_record(username, first_name))
+        coin_ledger.append(user_id, user.points, SIGNUP)  # Starting bonus
+        rankings.add(user_id, user.points)
+        segments.add(user_id, user)
+    elif first_name is not None and (user.username != username or user.first_name != first_name):
+        # Callers with a Telegram user always pass a first name; keep the
+        # username index current when someone renames themselves
+        store.update_identity(user_id, username, first_name)
+    return user
+
+def save_user(user_id):
+    """Queue a changed user record for the next batched database commit."""
+    store.mark_dirty(user_id)
+
+def record_points(user_id, user, old_points, changes):
+    """Record balance changes, as (delta, reason) pairs, in the coin ledger
+    and move the user from ``old_points`` to their new balance in the
+    rankings and segments, once for all of them."""
+    for delta, reason in changes:
+        coin_ledger.append(user_id, delta, reason)
+    rankings.update(user_id, old_points, user.points)
+    segments.update_points(user_id, user.points)
+
+def adjust_points(user_id, user, delta, reason):
+    """Change a user's balance and record it in the coin ledger."""
+    old_points = user.points
+    user.points = old_points + delta
+    record_points(user_id, user, old_points, [(delta, reason)])
+    save_user(user_id)
+
+def settle_game(user_id, user, game, bet):
+    """Play one round of a game: debit the bet, draw, credit the payout and
+    update stats, all in one step.
+    
+    Nothing awaits in between, so no other update can change the user's
+    balance mid-round. Returns (outcome, multiplier, winnings), or None if
+    the user can't afford the bet.
+    """
+    if user.points < bet:
+        return None
+    
+    outcome, multiplier = game.draw()
+    winnings = bet * multiplier
+    old_points = user.points
+    user.points = old_points - bet + winnings
+    
+    if winnings > 0:
+        changes = [(-bet, BET), (winnings, PAYOUT)]
+        user.games_won += 1
+        user.total_winnings += winnings
+    else:
+        changes = [(-bet, BET_LOST)]
+    user.games_played += 1
+    
+    # One index update for the whole round rather than one per balance change
+    record_points(user_id, user, old_points, changes)
+    segments.played(user_id)
+    economy.record_game(winnings)
+    games_played_total.inc(game.name)
+    points_staked_total.inc(game.name, amount=bet)
+    points_paid_total.inc(game.name, amount=winnings)
+    save_user(user_id)
+    return outcome, multiplier, winnings
+
+def restore_balances():
+    """Bring stored balances in line with the coin ledger after a restart.
+    
+    The ledger is the source of truth for points: records written after the
+    last database commit are replayed onto the store, and users the ledger
+    has never seen get an opening balance entry.
+    """
+    balances = coin_ledger.load()
+    corrected = 0
+    
+    for user_id, points in balances.items():
+        user = store.get(user_id)
+        if user is None:
+            user = store.create(user_id, new_user_record(points=points))
+            corrected += 1
+        elif user.points != points:
+            user.points = points
+            save_user(user_id)
+            corrected += 1
+    
+    for user_id, user in store.items():
+        if user_id not in balances:
+            coin_ledger.append(user_id, user.points, OPENING)
+    
+    if corrected:
+        logger.info(f"Restored {corrected} balances from the coin ledger")
+
+async def format_rank(user_id):
+    """Describe a user's leaderboard position, e.g. '#4,213 of 812,000'."""
+    user = store.get(user_id)
+    if user is None:
+        return "Unranked"
+    parts = await on_all_shards('rank', points=user.points)
+    above = sum(part[0] for part in parts)
+    total = sum(part[1] for part in parts)
+    return f"#{above + 1:,} of {total:,}"
 
 def calculate_win_rate(user_id):
     """Calculate user's win rate percentage."""
-    stats = user_data.get(user_id, {})
-    games_played = stats.get('games_played', 0)
-    games_won = stats.get('games_won', 0)
+    stats = store.get(user_id, NO_USER)
+    games_played = stats.games_played
+    games_won = stats.games_won
     
     if games_played == 0:
         return 0
     return round((games_won / games_played) * 100)
 
+# ==================== SHARD OPERATIONS ====================
+# State is partitioned by user id when running sharded (see WORKERS), so
+# anything touching another user's record or all users goes through these
+# operations. In a single process they simply run locally.
+
+async def shard_top(k):
+    """Top ``k`` local users as (user_id, first_name, points, wins)."""
+    return [
+        (uid, store.get(uid).first_name, points, store.get(uid).games_won)
+        for uid, points in rankings.top(k)
+    ]
+
+async def shard_rank(points):
+    """Count local users with more points than ``points``, and all users."""
+    return rankings.rank(points) - 1, len(rankings)
+
+async def shard_stats():
+    return {
+        'users': len(store),
+        'audience': len(store) - len(unreachable_users),
+        'economy': economy.to_dict()
+    }
+
+async def shard_find_username(username):
+    return store.find_by_username(username)
+
+async def shard_credit(user_id, amount, reason, username=None, first_name=None, create=False):
+    """Add points to a user (remove, if negative; never below zero).
+    
+    Returns the user's name and old and new balance, or None if the user
+    does not exist and ``create`` is not set.
+    """
+    if create:
+        user = get_user(user_id, username, first_name)
+    else:
+        user = store.get(user_id)
+        if user is None:
+            return None
+    
+    old_points = user.points
+    adjust_points(user_id, user, max(amount, -old_points), reason)
+    return {
+        'first_name': user.first_name,
+        'username': user.username,
+        'old_points': old_points,
+        'points': user.points
+    }
+
+async def shard_referral(user_id):
+    """Credit a referrer with the referral bonus; returns their new balance,
+    or None if no such user has used the bot."""
+    referrer = store.get(user_id)
+    if referrer is None:
+        return None
+    adjust_points(user_id, referrer, 50, REFERRAL)
+    referrer.referrals += 1
+    save_user(user_id)
+    return referrer.points
+
+async def shard_history(user_id, limit=20):
+    entries = await asyncio.to_thread(coin_ledger.history, user_id, limit)
+    user = store.get(user_id)
+    return entries, (user.points if user is not None else None)
+
+async def shard_broadcast_start(job_id, text, status_chat_id, status_message_id, content='',
+                                audience='all'):
+    """Start sending a broadcast job to every local user in ``audience``."""
+    job = BroadcastJob(job_id, text, content=content, audience=audience)
+    # Only the owner's shard shows progress, so only it keeps the status message
+    if runs_owner_tasks():
+        job.status_chat_id = status_chat_id
+        job.status_message_id = status_message_id
+    broadcast_jobs.add(job)
+    await broadcast_jobs.save(job)
+    start_broadcast_job(job)
+    return True
+
+async def shard_audience(expression):
+    """Count local users in an audience expression, leaving out unreachable ones."""
+    return segments.count(expression, exclude=unreachable_users)
+
+async def shard_refresh_metadata():
+    """Look up the cached Bot API metadata again."""
+    failed = await bot_metadata.refresh(active_bot)
+    return {'metadata': bot_metadata.to_dict(), 'failed': failed}
+
+async def shard_note_activity(user_id, now):
+    """Mark a local user as active: for the active segment, and so a user
+    who comes back can be broadcast to again."""
+    unreachable_users.discard(user_id)
+    
+    user = store.get(user_id)
+    # At most one write per user per day
+    if user is not None and day_number(user.last_active) != day_number(now):
+        user.last_active = now
+        save_user(user_id)
+        segments.touch(user_id, now)
+
+async def shard_broadcast_progress(job_id):
+    job = broadcast_jobs.get(job_id)
+    return job.to_dict() if job is not None else None
+
+SHARD_OPS = {
+    'top': shard_top,
+    'rank': shard_rank,
+    'stats': shard_stats,
+    'find_username': shard_find_username,
+    'credit': shard_credit,
+    'referral': shard_referral,
+    'history': shard_history,
+    'broadcast_start': shard_broadcast_start,
+    'broadcast_progress': shard_broadcast_progress,
+    'audience': shard_audience,
+    'refresh_metadata': shard_refresh_metadata,
+    'note_activity': shard_note_activity,
+}
+
+def runs_owner_tasks():
+    """Whether this process is the one the owner's updates go to."""
+    return shard_link is None or shard_link.owns(OWNER_ID)
+
+async def on_all_shards(op, **kwargs):
+    """Run a shard operation everywhere; returns one result per shard."""
+    if shard_link is None:
+        return [await SHARD_OPS[op](**kwargs)]
+    return await shard_link.call(None, op, kwargs)
+
+async def on_user_shard(owner_id, op, **kwargs):
+    """Run a shard operation on the shard that owns user ``owner_id``.
+    
+    ``owner_id`` only picks the shard; the operation's own arguments
+    (usually including ``user_id``) go in ``kwargs``.
+    """
+    if shard_link is None or shard_link.owns(owner_id):
+        return await SHARD_OPS[op](**kwargs)
+    return await shard_link.call(owner_id, op, kwargs)
+
+async def top_players(k):
+    """The ``k`` richest users across all shards."""
+    parts = await on_all_shards('top', k=k)
+    merged = [entry for part in parts for entry in part]
+    merged.sort(key=lambda entry: (-entry[2], entry[0]))
+    return merged[:k]
+
+async def count_audience(expression='all'):
+    """Users a broadcast to ``expression`` would reach (see segments.py)."""
+    return sum(await on_all_shards('audience', expression=expression))
+
+async def find_user_by_username(username):
+    for user_id in await on_all_shards('find_username', username=username):
+        if user_id is not None:
+            return user_id
+    return None
+
+# ==================== BROADCAST JOBS ====================
+
+def start_broadcast_job(job: BroadcastJob):
+    """Run a job's sends and, on the owner's shard, its status updates."""
+    coroutines = []
+    if not job.finished:
+        coroutines.append(send_broadcast_job(job))
+    if job.status_message_id:
+        coroutines.append(track_broadcast_job(job))
+    for coroutine in coroutines:
+        task = asyncio.create_task(coroutine)
+        broadcast_tasks.add(task)
+        task.add_done_callback(broadcast_tasks.discard)
+
+async def launch_broadcast(text, status_message, content=None, audience='all'):
+    """Start a broadcast on every shard, reporting progress in ``status_message``.
+    
+    ``content`` is given instead of ``text`` for media (see broadcast_sender).
+    """
+    await on_all_shards(
+        'broadcast_start',
+        job_id=int(time.time() * 1000),
+        text=text or '',
+        status_chat_id=status_message.chat_id,
+        status_message_id=status_message.message_id,
+        content=json.dumps(content) if content else '',
+        audience=audience
+    )
+
+# Album parts that can be re-sent by file_id
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio,
+}
+
+def album_item(message):
+    """The (type, file_id, caption) of one album part, or None."""
+    if message.photo:
+        return ('photo', message.photo[-1].file_id, message.caption)
+    for kind in ('video', 'document', 'audio'):
+        media = getattr(message, kind)
+        if media is not None:
+            return (kind, media.file_id, message.caption)
+    return None
+
+def broadcast_sender(job: BroadcastJob):
+    """Build the function that sends a job to one user.
+    
+    Media is never uploaded again: a single message is copied from the
+    owner's chat with copy_message, and an album is re-sent from the
+    file_ids Telegram gave the owner's upload, so each send costs the
+    same however large the media is.
+    """
+    content = json.loads(job.content) if job.content else None
+    
+    if content is None:
+        async def send(user_id):
+            await active_bot.send_message(
+                chat_id=user_id,
+                text=f"📢 **Broadcast from Owner:**\n\n{job.text}",
+                parse_mode='Markdown'
+            )
+    elif content['type'] == 'copy':
+        async def send(user_id):
+            await active_bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=content['from_chat_id'],
+                message_id=content['message_id']
+            )
+    else:
+        media = [
+            INPUT_MEDIA[kind](file_id, caption=caption)
+            for kind, file_id, caption in content['media']
+        ]
+        
+        async def send(user_id):
+            await active_bot.send_media_group(chat_id=user_id, media=media)
+    
+    return send
+
+async def send_broadcast_job(job: BroadcastJob):
+    send = broadcast_sender(job)
+    recipients = segments.members(job.audience, exclude=unreachable_users)
+    await broadcaster.run_job(
+        job, recipients, send, broadcast_jobs,
+        chunk_size=BROADCAST_CHECKPOINT_EVERY
+    )
+    logger.info(
+        f"Broadcast {job.job_id} finished: {job.sent} sent, {job.failed} failed "
+        f"({job.unreachable} unreachable), "
+        f"{job.retried} retries in {job.elapsed:.1f}s ({job.rate:.1f} msg/s)"
+    )
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m {seconds}s"
+
+async def track_broadcast_job(job: BroadcastJob):
+    """Keep the owner's status message up to date until every shard is done."""
+    first_seen = None
+    while True:
+        parts = await on_all_shards('broadcast_progress', job_id=job.job_id)
+        parts = [part for part in parts if part is not None]
+        sent = sum(part['sent'] for part in parts)
+        failed = sum(part['failed'] for part in parts)
+        unreachable = sum(part['unreachable'] for part in parts)
+        remaining = sum(part['remaining'] for part in parts)
+        finished = all(part['finished'] for part in parts)
+        
+        now = time.monotonic()
+        if first_seen is None:
+            first_seen = (now, sent + failed)
+        
+        if finished:
+            elapsed = max((part['elapsed'] for part in parts), default=0.0)
+            rate = sent / elapsed if elapsed > 0 else 0.0
+            text = (
+                f"✅ **Broadcast completed!**\n\n"
+                f"✓ Successfully sent: {sent}\n"
+                f"✗ Failed: {failed}\n"
+                f"🚫 Unreachable (skipped from now on): {unreachable}\n"
+                f"📊 Total users: {sent + failed}\n"
+                f"⏱ {format_duration(elapsed)} ({rate:.1f} msg/s)"
+            )
+            keyboard = [[InlineKeyboardButton("🔙 Back to Broadcast Panel", callback_data='owner_broadcast_panel')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+        else:
+            # Rate measured since this tracker started, so a resumed job
+            # is not credited with sends from before the restart
+            done = sent + failed - first_seen[1]
+            rate = done / (now - first_seen[0]) if now > first_seen[0] else 0.0
+            eta = format_duration(remaining / rate) if rate > 0 else "calculating..."
+            text = (
+                f"📢 **Broadcasting...**\n\n"
+                f"✓ Sent: {sent}\n"
+                f"✗ Failed: {failed}\n"
+                f"⏳ Remaining: {remaining}\n"
+                f"🕒 ETA: {eta}"
+            )
+            reply_markup = None
+        
+        try:
+            await active_bot.edit_message_text(
+                chat_id=job.status_chat_id,
+                message_id=job.status_message_id,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            # Includes "message is not modified" when nothing changed
+            logger.debug(f"Could not update broadcast status: {e}")
+        
+        if finished:
+            break
+        await asyncio.sleep(BROADCAST_STATUS_INTERVAL)
+    
+    job.status_message_id = 0
+    await broadcast_jobs.save(job)
+
 # ==================== OWNER COMMANDS ====================
 
 async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -153,17 +919,17 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Amount must be a number!")
             return
         
-        # Get or create user
-        user = get_user(target_id, target_user.username, target_user.first_name)
-        
-        # Add coins
-        old_points = user['points']
-        user['points'] = old_points + amount
+        # Add coins, creating the user if needed
+        result = await on_user_shard(
+            target_id, 'credit',
+            user_id=target_id, amount=amount, reason=ADMIN_ADD,
+            username=target_user.username, first_name=target_user.first_name, create=True
+        )
         
         await update.message.reply_text(
             f"✅ Added {amount} coins to {target_user.first_name}\n"
-            f"💰 Old balance: {old_points}\n"
-            f"💰 New balance: {user['points']}"
+            f"💰 Old balance: {result['old_points']}\n"
+            f"💰 New balance: {result['points']}"
         )
         
         # Notify the user
@@ -171,7 +937,7 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(
                 chat_id=target_id,
                 text=f"🎁 **You received {amount} coins from the owner!**\n"
-                     f"Your new balance: {user['points']} coins",
+                     f"Your new balance: {result['points']} coins",
                 parse_mode='Markdown'
             )
         except:
@@ -185,13 +951,13 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         amount = int(context.args[0])
         user = get_user(update.effective_user.id, update.effective_user.username, update.effective_user.first_name)
         
-        old_points = user['points']
-        user['points'] = old_points + amount
+        old_points = user.points
+        adjust_points(update.effective_user.id, user, amount, ADMIN_ADD)
         
         await update.message.reply_text(
             f"✅ Added {amount} coins to yourself\n"
             f"💰 Old balance: {old_points}\n"
-            f"💰 New balance: {user['points']}"
+            f"💰 New balance: {user.points}"
         )
         return
     
@@ -225,26 +991,18 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Find user by username (case-insensitive)
-    target_user_id = None
-    target_user_data = None
-    
-    for uid, data in user_data.items():
-        db_username = data.get('username', '')
-        if db_username and db_username.lower() == username:
-            target_user_id = uid
-            target_user_data = data
-            break
+    target_user_id = await find_user_by_username(username)
     
-    if not target_user_id:
+    if target_user_id is None:
         # Check if it might be the owner themselves
         if username == update.effective_user.username.lower():
             user = get_user(update.effective_user.id, update.effective_user.username, update.effective_user.first_name)
-            old_points = user['points']
-            user['points'] = old_points + amount
+            old_points = user.points
+            adjust_points(update.effective_user.id, user, amount, ADMIN_ADD)
             await update.message.reply_text(
                 f"✅ Added {amount} coins to yourself\n"
                 f"💰 Old balance: {old_points}\n"
-                f"💰 New balance: {user['points']}"
+                f"💰 New balance: {user.points}"
             )
             return
         
@@ -255,13 +1013,15 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Add coins
-    old_points = target_user_data.get('points', 0)
-    target_user_data['points'] = old_points + amount
+    result = await on_user_shard(
+        target_user_id, 'credit',
+        user_id=target_user_id, amount=amount, reason=ADMIN_ADD
+    )
     
     await update.message.reply_text(
         f"✅ Added {amount} coins to @{username}\n"
-        f"💰 Old balance: {old_points}\n"
-        f"💰 New balance: {target_user_data['points']}"
+        f"💰 Old balance: {result['old_points']}\n"
+        f"💰 New balance: {result['points']}"
     )
     
     # Notify the user
@@ -269,7 +1029,7 @@ async def owner_addcoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(
             chat_id=target_user_id,
             text=f"🎁 **You received {amount} coins from the owner!**\n"
-                 f"Your new balance: {target_user_data['points']} coins",
+                 f"Your new balance: {result['points']} coins",
             parse_mode='Markdown'
         )
     except:
@@ -296,17 +1056,17 @@ async def owner_removecoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Amount must be a number!")
             return
         
-        if target_id not in user_data:
+        result = await on_user_shard(
+            target_id, 'credit',
+            user_id=target_id, amount=-amount, reason=ADMIN_REMOVE
+        )
+        if result is None:
             await update.message.reply_text("User not found in database!")
             return
         
-        old_points = user_data[target_id].get('points', 0)
-        new_points = max(0, old_points - amount)
-        user_data[target_id]['points'] = new_points
-        
         await update.message.reply_text(
             f"✅ Removed {amount} coins from {target_user.first_name}\n"
-            f"Old: {old_points} → New: {new_points}"
+            f"Old: {result['old_points']} → New: {result['points']}"
         )
         return
     
@@ -322,16 +1082,16 @@ async def owner_removecoins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Amount must be a number!")
         return
     
-    for uid, data in user_data.items():
-        db_username = data.get('username', '')
-        if db_username and db_username.lower() == username:
-            old_points = data.get('points', 0)
-            new_points = max(0, old_points - amount)
-            data['points'] = new_points
-            await update.message.reply_text(f"✅ Removed {amount} coins from @{username}")
-            return
+    target_user_id = await find_user_by_username(username)
+    if target_user_id is None:
+        await update.message.reply_text(f"❌ User @{username} not found!")
+        return
     
-    await update.message.reply_text(f"❌ User @{username} not found!")
+    await on_user_shard(
+        target_user_id, 'credit',
+        user_id=target_user_id, amount=-amount, reason=ADMIN_REMOVE
+    )
+    await update.message.reply_text(f"✅ Removed {amount} coins from @{username}")
 
 async def owner_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Owner command to start a giveaway."""
@@ -358,14 +1118,18 @@ async def owner_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     giveaway_id = str(int(time.time()))
-    end_time = datetime.now() + timedelta(minutes=duration)
-    
-    active_giveaways[giveaway_id] = {
-        'amount': amount,
-        'end_time': end_time,
-        'participants': [],
-        'creator_id': update.effective_user.id
-    }
+    while giveaway_id in active_giveaways:
+        giveaway_id = str(int(giveaway_id) + 1)
+    end_time = int(time.time()) + duration * 60
+    
+    active_giveaways.create(
+        giveaway_id,
+        amount=amount,
+        end_time=end_time,
+        creator_id=update.effective_user.id,
+        chat_id=update.effective_chat.id
+    )
+    giveaway_deadlines.schedule(giveaway_id, end_time)
     
     keyboard = [
         [InlineKeyboardButton("🎁 Join Giveaway", callback_data=f"giveaway_{giveaway_id}")],
@@ -377,7 +1141,7 @@ async def owner_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🎉 **GIVEAWAY!** 🎉\n\n"
         f"Prize: {amount} coins\n"
         f"Duration: {duration} minutes\n"
-        f"Ends: {end_time.strftime('%H:%M:%S')}\n\n"
+        f"Ends: {datetime.fromtimestamp(end_time).strftime('%H:%M:%S')}\n\n"
         f"Click below to enter!"
     )
     
@@ -405,9 +1169,9 @@ async def owner_endgiveaway(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     for gid, giveaway in active_giveaways.items():
         text += f"ID: `{gid}`\n"
-        text += f"Prize: {giveaway['amount']} coins\n"
-        text += f"Participants: {len(giveaway['participants'])}\n"
-        text += f"Ends: {giveaway['end_time'].strftime('%H:%M:%S')}\n\n"
+        text += f"Prize: {giveaway.amount} coins\n"
+        text += f"Participants: {len(giveaway.participants)}\n"
+        text += f"Ends: {datetime.fromtimestamp(giveaway.end_time).strftime('%H:%M:%S')}\n\n"
         
         keyboard.append([InlineKeyboardButton(
             f"End Giveaway {gid[:8]}...", 
@@ -428,29 +1192,51 @@ async def owner_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ This command is only for bot owner!")
         return
     
-    total_users = len(user_data)
-    total_points = sum(data.get('points', 0) for data in user_data.values())
-    total_games = sum(data.get('games_played', 0) for data in user_data.values())
+    parts = await on_all_shards('stats')
+    total_users = sum(part['users'] for part in parts)
+    totals = Economy.combine([part['economy'] for part in parts])
     active_giveaways_count = len(active_giveaways)
     
     # Top users
-    top_users = sorted(user_data.items(), key=lambda x: x[1].get('points', 0), reverse=True)[:5]
+    top_users = await top_players(5)
     
     stats_text = (
         f"📊 **BOT STATISTICS** 📊\n\n"
         f"**General:**\n"
         f"• Total Users: {total_users}\n"
-        f"• Total Points: {total_points}\n"
-        f"• Games Played: {total_games}\n"
+        f"• Total Points: {totals.circulating}\n"
+        f"• Games Played: {totals.games}\n"
+        f"• Games Won: {totals.wins}\n"
+        f"• Total Winnings: {totals.winnings}\n"
         f"• Active Giveaways: {active_giveaways_count}\n\n"
+        f"**Points Minted:**\n"
+    )
+    
+    for source, amount in totals.minted.items():
+        stats_text += f"• {source}: {amount:+d}\n"
+    
+    stats_text += (
+        f"\n**Games:**\n"
+        f"• Staked: {totals.staked}\n"
+        f"• Paid Out: {totals.paid_out}\n"
+        f"• Burned by Losses: {totals.burned}\n"
+        f"• House Net: {totals.house_net:+d}\n\n"
         f"**Top 5 Users:**\n"
     )
     
-    for i, (uid, data) in enumerate(top_users, 1):
-        name = data.get('first_name', 'Unknown')
-        points = data.get('points', 0)
+    for i, (uid, name, points, wins) in enumerate(top_users, 1):
+        name = name or 'Unknown'
         stats_text += f"{i}. {name} - {points} points\n"
     
+    routes = callback_router.stats()[:5]
+    if routes:
+        stats_text += "\n**Busiest Buttons:**\n"
+        for name, route in routes:
+            stats_text += (
+                f"• `{name}`: {route['calls']} presses, "
+                f"{route['average'] * 1000:.1f}ms avg, {route['slowest'] * 1000:.0f}ms max\n"
+            )
+    
     await update.message.reply_text(stats_text, parse_mode='Markdown')
 
 async def owner_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -468,31 +1254,76 @@ async def owner_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     message = ' '.join(context.args)
     
-    await update.message.reply_text(
-        f"📢 Broadcasting to {len(user_data)} users...\n"
+    status_message = await update.message.reply_text(
+        f"📢 Broadcasting to {await count_audience()} users...\n"
         f"Message: {message}"
     )
     
-    success = 0
-    failed = 0
+    await launch_broadcast(message, status_message)
+
+async def owner_botinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner command to show the cached bot metadata.
+    Usage: /botinfo  OR  /botinfo refresh (look everything up again)
+    """
+    if not is_owner(update.effective_user.id):
+        await update.message.reply_text("❌ This command is only for bot owner!")
+        return
     
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"📢 **Broadcast from Owner:**\n\n{message}",
-                parse_mode='Markdown'
-            )
-            success += 1
-            await asyncio.sleep(0.05)  # Small delay to avoid rate limits
-        except:
-            failed += 1
+    failed = []
+    if context.args and context.args[0].lower() == 'refresh':
+        # Every worker keeps its own copy, so refresh them all
+        for part in await on_all_shards('refresh_metadata'):
+            failed.extend(part['failed'])
     
-    await update.message.reply_text(
-        f"✅ Broadcast completed!\n"
-        f"✓ Sent: {success}\n"
-        f"✗ Failed: {failed}"
-    )
+    lines = [
+        "🤖 Bot metadata:",
+        f"• Bot: @{bot_metadata.bot_username} ({bot_metadata.bot_id})",
+    ]
+    for reference in bot_metadata.chats:
+        info = bot_metadata.chat(reference)
+        if info is None:
+            lines.append(f"• {reference}: not resolved")
+        else:
+            lines.append(f"• {reference}: {info.chat_id} ({info.type}, {info.title})")
+    if bot_metadata.refreshed_at:
+        when = datetime.fromtimestamp(bot_metadata.refreshed_at).strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(f"• Refreshed: {when}")
+    if failed:
+        lines.append(f"⚠️ Could not look up: {', '.join(sorted(set(failed)))}")
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def owner_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner command to show a user's recent balance changes.
+    Usage: /ledger user_id  OR  /ledger (reply to user)
+    """
+    if not is_owner(update.effective_user.id):
+        await update.message.reply_text("❌ This command is only for bot owner!")
+        return
+    
+    if update.message.reply_to_message:
+        target_id = update.message.reply_to_message.from_user.id
+    elif context.args and context.args[0].isdigit():
+        target_id = int(context.args[0])
+    else:
+        await update.message.reply_text("Usage: /ledger user_id (or reply to a user)")
+        return
+    
+    entries, balance = await on_user_shard(target_id, 'history', user_id=target_id, limit=20)
+    if not entries:
+        await update.message.reply_text("❌ No ledger entries for this user!")
+        return
+    
+    lines = [f"📒 Ledger for {target_id} (last {len(entries)} entries):", ""]
+    for seq, ts, delta, reason in entries:
+        when = datetime.fromtimestamp(ts).strftime('%m-%d %H:%M:%S')
+        lines.append(f"#{seq} {when} {delta:+d} {reason}")
+    
+    if balance is not None:
+        lines.append("")
+        lines.append(f"Current balance: {balance}")
+    
+    await update.message.reply_text("\n".join(lines))
 
 # ==================== BROADCAST FUNCTIONS ====================
 
@@ -505,10 +1336,15 @@ async def owner_broadcast_panel(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text("❌ Access denied!")
         return
     
+    parts = await on_all_shards('stats')
+    total_users = sum(part['users'] for part in parts)
+    audience = sum(part['audience'] for part in parts)
+    
     text = (
         "📢 **Broadcast Message** 📢\n\n"
         "You can send a message to all bot users.\n\n"
-        f"**Total Users:** {len(user_data)}\n\n"
+        f"**Total Users:** {total_users}\n"
+        f"**Live Audience:** {audience} (blocked or deleted users are skipped)\n\n"
         "**Options:**\n"
         "1️⃣ **Quick Broadcast** - Use `/broadcast your message`\n"
         "2️⃣ **Interactive Broadcast** - Click the button below\n\n"
@@ -543,7 +1379,7 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         "📝 **Send your broadcast message**\n\n"
         "Please type the message you want to send to all users.\n"
-        f"Total recipients: {len(user_data)} users\n\n"
+        f"Total recipients: {await count_audience()} users\n\n"
         "Type your message below (or /cancel to cancel):"
     )
     
@@ -557,7 +1393,7 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def handle_broadcast_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle broadcast message input from owner."""
+    """Handle broadcast message input from owner: text, media or an album."""
     user_id = update.effective_user.id
     
     if not is_owner(user_id):
@@ -567,39 +1403,106 @@ async def handle_broadcast_input(update: Update, context: ContextTypes.DEFAULT_T
     if not context.user_data.get('waiting_for_broadcast'):
         return
     
-    message_text = update.message.text
+    message = update.message
+    message_text = message.text
     
     # Check if user wants to cancel
-    if message_text.lower() == '/cancel':
+    if message_text and message_text.lower() == '/cancel':
         context.user_data['waiting_for_broadcast'] = False
-        await update.message.reply_text("❌ Broadcast cancelled.")
+        await message.reply_text("❌ Broadcast cancelled.")
+        return
+    
+    if message.media_group_id:
+        # An album arrives as one message per part; collect the parts and
+        # show the preview once they stop arriving
+        album = context.user_data.get('broadcast_album')
+        if album is None or album['media_group_id'] != message.media_group_id:
+            album = {'media_group_id': message.media_group_id, 'media': []}
+            context.user_data['broadcast_album'] = album
+            context.application.create_task(preview_album(message, context, album))
+        item = album_item(message)
+        if item is not None:
+            album['media'].append(item)
         return
     
     # Clear the waiting flag
     context.user_data['waiting_for_broadcast'] = False
     
     # Store message in context for confirmation
-    context.user_data['broadcast_message'] = message_text
+    if message_text:
+        context.user_data['broadcast_message'] = message_text
+        context.user_data.pop('broadcast_content', None)
+    else:
+        context.user_data['broadcast_message'] = None
+        context.user_data['broadcast_content'] = {
+            'type': 'copy',
+            'from_chat_id': message.chat_id,
+            'message_id': message.message_id
+        }
+    
+    await send_broadcast_preview(message, context)
+
+async def preview_album(message, context: ContextTypes.DEFAULT_TYPE, album):
+    """Preview an album broadcast once all of its parts have arrived."""
+    await asyncio.sleep(BROADCAST_ALBUM_WAIT)
+    if context.user_data.get('broadcast_album') is not album:
+        return
+    
+    context.user_data.pop('broadcast_album', None)
+    context.user_data['waiting_for_broadcast'] = False
+    context.user_data['broadcast_message'] = None
+    context.user_data['broadcast_content'] = {'type': 'album', 'media': album['media']}
+    
+    await send_broadcast_preview(message, context)
+
+async def broadcast_preview(context: ContextTypes.DEFAULT_TYPE):
+    """Text and buttons asking the owner to confirm their broadcast."""
+    message_text = context.user_data.get('broadcast_message')
+    audience = context.user_data.get('broadcast_audience', 'all')
     
     # Preview and confirm
     keyboard = [
-        [InlineKeyboardButton("✅ Send to All Users", callback_data='confirm_broadcast')],
+        [InlineKeyboardButton("✅ Send Broadcast", callback_data='confirm_broadcast')],
+        [
+            InlineKeyboardButton(("• " if name == audience else "") + label, callback_data=f"audience_{name}")
+            for name, label in list(AUDIENCE_PRESETS.items())[:2]
+        ],
+        [
+            InlineKeyboardButton(("• " if name == audience else "") + label, callback_data=f"audience_{name}")
+            for name, label in list(AUDIENCE_PRESETS.items())[2:]
+        ],
         [InlineKeyboardButton("📝 Edit Message", callback_data='start_broadcast')],
         [InlineKeyboardButton("❌ Cancel", callback_data='owner_broadcast_panel')],
     ]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        f"📢 **Preview your broadcast:**\n\n{message_text}\n\n"
-        f"**Recipients:** {len(user_data)} users\n\n"
-        f"Do you want to send this message?",
+    if message_text:
+        preview = f"📢 **Preview your broadcast:**\n\n{message_text}\n\n"
+    else:
+        preview = "📢 **Preview your broadcast:**\n\nYour message above will be sent as it is.\n\n"
+    
+    text = (
+        preview +
+        f"**Audience:** `{audience}`\n"
+        f"**Recipients:** {await count_audience(audience)} users\n\n"
+        f"Pick an audience below, or combine segments with\n"
+        f"`/audience active7d & !never_played`\n\n"
+        f"Do you want to send this message?"
+    )
+    return text, reply_markup
+
+async def send_broadcast_preview(message, context: ContextTypes.DEFAULT_TYPE):
+    """Ask the owner to confirm the broadcast they just sent."""
+    text, reply_markup = await broadcast_preview(context)
+    await message.reply_text(
+        text,
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
-async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Confirm and send broadcast message."""
+async def choose_audience(update: Update, context: ContextTypes.DEFAULT_TYPE, audience: str):
+    """Switch the pending broadcast to a preset audience."""
     query = update.callback_query
     await query.answer()
     
@@ -607,57 +1510,94 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Access denied!")
         return
     
-    message = context.user_data.get('broadcast_message')
-    if not message:
-        await query.edit_message_text("❌ No message found! Please try again.")
+    if audience not in AUDIENCE_PRESETS:
         return
     
+    context.user_data['broadcast_audience'] = audience
+    text, reply_markup = await broadcast_preview(context)
     await query.edit_message_text(
-        f"📢 Broadcasting to {len(user_data)} users...\n"
-        f"Please wait..."
-    )
-    
-    success = 0
-    failed = 0
-    
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"📢 **Broadcast from Owner:**\n\n{message}",
-                parse_mode='Markdown'
-            )
-            success += 1
-            await asyncio.sleep(0.05)  # Small delay to avoid rate limits
-        except Exception as e:
-            failed += 1
-            logger.error(f"Failed to send broadcast to {user_id}: {e}")
-    
-    # Clear stored message
-    context.user_data.pop('broadcast_message', None)
-    
-    keyboard = [[InlineKeyboardButton("🔙 Back to Broadcast Panel", callback_data='owner_broadcast_panel')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await context.bot.send_message(
-        chat_id=query.from_user.id,
-        text=f"✅ **Broadcast completed!**\n\n"
-             f"✓ Successfully sent: {success}\n"
-             f"✗ Failed: {failed}\n"
-             f"📊 Total users: {len(user_data)}",
+        text,
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
-# ==================== CONTACT OWNER FUNCTIONS ====================
-
-async def contact_owner(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle contact owner command."""
-    user = update.effective_user
+async def owner_audience(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Owner command to pick who the next broadcast goes to.
+    Usage: /audience active7d & !never_played
+    """
+    if not is_owner(update.effective_user.id):
+        await update.message.reply_text("❌ This command is only for bot owner!")
+        return
     
-    # Create contact button
-    keyboard = [
-        [InlineKeyboardButton("📩 Message Owner", url=f"tg://user?id={OWNER_ID}")],
+    if not context.args:
+        current = context.user_data.get('broadcast_audience', 'all')
+        await update.message.reply_text(
+            f"Current audience: {current}\n\n"
+            f"Usage: /audience expression\n"
+            f"Segments: {', '.join(Segments.NAMES)}\n"
+            f"Combine with & (and), | (or), ! (not) and parentheses.\n"
+            f"Example: /audience active7d & !never_played"
+        )
+        return
+    
+    expression = ' '.join(context.args)
+    try:
+        segments.evaluate(expression)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    
+    context.user_data['broadcast_audience'] = expression
+    
+    if context.user_data.get('broadcast_message') or context.user_data.get('broadcast_content'):
+        text, reply_markup = await broadcast_preview(context)
+        await update.message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    else:
+        await update.message.reply_text(
+            f"✅ Next broadcast goes to {expression}: "
+            f"{await count_audience(expression)} users"
+        )
+
+async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Confirm and send broadcast message."""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_owner(query.from_user.id):
+        await query.edit_message_text("❌ Access denied!")
+        return
+    
+    message = context.user_data.get('broadcast_message')
+    content = context.user_data.get('broadcast_content')
+    if not message and not content:
+        await query.edit_message_text("❌ No message found! Please try again.")
+        return
+    
+    audience = context.user_data.get('broadcast_audience', 'all')
+    status_message = await query.edit_message_text(
+        f"📢 Broadcasting to {await count_audience(audience)} users...\n"
+        f"Please wait..."
+    )
+    
+    await launch_broadcast(message, status_message, content=None if message else content, audience=audience)
+    
+    # Clear stored message
+    context.user_data.pop('broadcast_message', None)
+    context.user_data.pop('broadcast_content', None)
+
+# ==================== CONTACT OWNER FUNCTIONS ====================
+
+async def contact_owner(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle contact owner command."""
+    user = update.effective_user
+    
+    # Create contact button
+    keyboard = [
+        [InlineKeyboardButton("📩 Message Owner", url=f"tg://user?id={OWNER_ID}")],
         [InlineKeyboardButton("🔙 Main Menu", callback_data='back_to_menu')],
     ]
     
@@ -721,8 +1661,8 @@ async def group_dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         try:
             bet = int(context.args[0])
-            if bet < 10 or bet > 100:
-                await update.message.reply_text("Bet must be between 10 and 100 points!")
+            if not DICE.allows(bet):
+                await update.message.reply_text(f"Bet must be between {DICE.min_bet} and {DICE.max_bet} points!")
                 return
         except:
             await update.message.reply_text("Usage: /dice [bet amount]")
@@ -731,49 +1671,31 @@ async def group_dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Get user data
     user = get_user(user_id, update.effective_user.username, update.effective_user.first_name)
     
-    if user['points'] < bet:
+    settled = settle_game(user_id, user, DICE, bet)
+    if settled is None:
         await update.message.reply_text(
             f"❌ {update.effective_user.first_name}, you don't have enough points!\n"
-            f"Your points: {user['points']}\n"
+            f"Your points: {user.points}\n"
             f"Required: {bet}"
         )
         return
+    roll, multiplier, winnings = settled
     
-    # Deduct bet
-    user['points'] -= bet
-    user['games_played'] += 1
-    
-    # Roll dice
-    roll = random.randint(1, 6)
-    
-    # Determine winnings
-    if roll <= 3:
-        winnings = 0
+    if multiplier == 0:
         result_text = "❌ Lost!"
-    elif roll <= 5:
-        winnings = bet * 2
+    elif multiplier == 2:
         result_text = "✅ Won double!"
-        user['games_won'] += 1
-        user['total_winnings'] += winnings
     else:
-        winnings = bet * 3
         result_text = "🎉 JACKPOT! Won TRIPLE!"
-        user['games_won'] += 1
-        user['total_winnings'] += winnings
-    
-    if winnings > 0:
-        user['points'] += winnings
-    
-    dice_faces = ["⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
     
     result_message = (
         f"🎲 **Group Dice Game** 🎲\n\n"
         f"Player: {update.effective_user.first_name}\n"
-        f"Rolled: {dice_faces[roll-1]} {roll}\n"
+        f"Rolled: {DICE_FACES[roll-1]} {roll}\n"
         f"{result_text}\n\n"
         f"Bet: {bet}\n"
         f"Won: {winnings}\n"
-        f"New Balance: {user['points']}"
+        f"New Balance: {user.points}"
     )
     
     await update.message.reply_text(result_message, parse_mode='Markdown')
@@ -792,14 +1714,14 @@ async def group_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     choice = context.args[0].lower()
-    if choice not in ['heads', 'tails']:
+    if choice not in COIN_SIDES:
         await update.message.reply_text("Choose 'heads' or 'tails'!")
         return
     
     try:
         bet = int(context.args[1])
-        if bet < 5 or bet > 50:
-            await update.message.reply_text("Bet must be between 5 and 50 points!")
+        if not COIN.allows(bet):
+            await update.message.reply_text(f"Bet must be between {COIN.min_bet} and {COIN.max_bet} points!")
             return
     except:
         await update.message.reply_text("Bet must be a number!")
@@ -807,24 +1729,13 @@ async def group_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user = get_user(user_id, update.effective_user.username, update.effective_user.first_name)
     
-    if user['points'] < bet:
-        await update.message.reply_text(f"❌ You don't have enough points! Your points: {user['points']}")
+    settled = settle_game(user_id, user, COIN, bet)
+    if settled is None:
+        await update.message.reply_text(f"❌ You don't have enough points! Your points: {user.points}")
         return
-    
-    user['points'] -= bet
-    user['games_played'] += 1
-    
-    flip = random.choice(['heads', 'tails'])
-    
-    if choice == flip:
-        winnings = bet * 2
-        user['points'] += winnings
-        user['games_won'] += 1
-        user['total_winnings'] += winnings
-        result = "✅ WIN!"
-    else:
-        winnings = 0
-        result = "❌ Lose!"
+    won, multiplier, winnings = settled
+    flip = choice if won else COIN_SIDES[1 - COIN_SIDES.index(choice)]
+    result = "✅ WIN!" if won else "❌ Lose!"
     
     result_message = (
         f"🪙 **Group Coin Flip** 🪙\n\n"
@@ -834,7 +1745,7 @@ async def group_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{result}\n\n"
         f"Bet: {bet}\n"
         f"Won: {winnings}\n"
-        f"New Balance: {user['points']}"
+        f"New Balance: {user.points}"
     )
     
     await update.message.reply_text(result_message, parse_mode='Markdown')
@@ -852,8 +1763,8 @@ async def group_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         try:
             bet = int(context.args[0])
-            if bet < 20 or bet > 200:
-                await update.message.reply_text("Bet must be between 20 and 200 points!")
+            if not SLOTS.allows(bet):
+                await update.message.reply_text(f"Bet must be between {SLOTS.min_bet} and {SLOTS.max_bet} points!")
                 return
         except:
             await update.message.reply_text("Usage: /slots [bet amount]")
@@ -861,35 +1772,15 @@ async def group_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user = get_user(user_id, update.effective_user.username, update.effective_user.first_name)
     
-    if user['points'] < bet:
-        await update.message.reply_text(f"❌ You don't have enough points! Your points: {user['points']}")
+    settled = settle_game(user_id, user, SLOTS, bet)
+    if settled is None:
+        await update.message.reply_text(f"❌ You don't have enough points! Your points: {user.points}")
         return
-    
-    user['points'] -= bet
-    user['games_played'] += 1
-    
-    symbols = ['🍒', '🍋', '💎', '7️⃣']
-    result = [random.choice(symbols) for _ in range(3)]
-    
-    multiplier = 0
-    if result[0] == result[1] == result[2]:
-        if result[0] == '🍒':
-            multiplier = 3
-        elif result[0] == '🍋':
-            multiplier = 5
-        elif result[0] == '💎':
-            multiplier = 10
-        elif result[0] == '7️⃣':
-            multiplier = 20
+    result, multiplier, winnings = settled
     
     if multiplier > 0:
-        winnings = bet * multiplier
-        user['points'] += winnings
-        user['games_won'] += 1
-        user['total_winnings'] += winnings
         result_text = f"🎉 JACKPOT! {multiplier}x WINNER!"
     else:
-        winnings = 0
         result_text = "❌ Try again!"
     
     result_message = (
@@ -899,7 +1790,7 @@ async def group_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"{result_text}\n\n"
         f"Bet: {bet}\n"
         f"Won: {winnings}\n"
-        f"New Balance: {user['points']}"
+        f"New Balance: {user.points}"
     )
     
     await update.message.reply_text(result_message, parse_mode='Markdown')
@@ -913,9 +1804,10 @@ async def group_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(
         f"💰 **{update.effective_user.first_name}'s Balance** 💰\n\n"
-        f"Points: {user['points']}\n"
-        f"Games Played: {user['games_played']}\n"
-        f"Games Won: {user['games_won']}\n"
+        f"Points: {user.points}\n"
+        f"Rank: {await format_rank(update.effective_user.id)}\n"
+        f"Games Played: {user.games_played}\n"
+        f"Games Won: {user.games_won}\n"
         f"Win Rate: {calculate_win_rate(update.effective_user.id)}%",
         parse_mode='Markdown'
     )
@@ -936,23 +1828,20 @@ async def join_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE, give
         )
         return
     
-    giveaway = active_giveaways[giveaway_id]
+    giveaway = active_giveaways.get(giveaway_id)
     
-    # Check if already joined
-    if user_id in giveaway['participants']:
+    # Add to participants, unless already joined
+    if not active_giveaways.join(giveaway_id, user_id):
         await query.edit_message_text(
             "❌ You've already joined this giveaway!",
             show_alert=True
         )
         return
     
-    # Add to participants
-    giveaway['participants'].append(user_id)
-    
     await query.edit_message_text(
         f"✅ You've successfully joined the giveaway!\n\n"
-        f"Prize: {giveaway['amount']} coins\n"
-        f"Total participants: {len(giveaway['participants'])}\n\n"
+        f"Prize: {giveaway.amount} coins\n"
+        f"Total participants: {len(giveaway.participants)}\n\n"
         f"Good luck! 🍀"
     )
 
@@ -969,54 +1858,86 @@ async def end_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE, givea
         await query.edit_message_text("❌ Giveaway not found!")
         return
     
-    giveaway = active_giveaways[giveaway_id]
+    result_text = await settle_giveaway(giveaway_id)
+    await query.edit_message_text(
+        result_text,
+        parse_mode='Markdown'
+    )
+
+async def expire_giveaway(giveaway_id: str):
+    """Close a giveaway whose end time has passed and announce the result."""
+    giveaway = active_giveaways.get(giveaway_id)
+    if giveaway is None:
+        return
     
-    if not giveaway['participants']:
-        await query.edit_message_text(
+    result_text = await settle_giveaway(giveaway_id)
+    try:
+        await active_bot.send_message(
+            chat_id=giveaway.chat_id,
+            text=result_text,
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.error(f"Failed to announce giveaway {giveaway_id}: {e}")
+
+async def settle_giveaway(giveaway_id: str):
+    """Remove a giveaway, award a random winner and notify them.
+    
+    Returns the announcement text.
+    """
+    # Removed before any await, so a manual end and the deadline can never
+    # both settle the same giveaway
+    giveaway = active_giveaways.remove(giveaway_id)
+    giveaway_deadlines.cancel(giveaway_id)
+    
+    if not giveaway.participants:
+        return (
             "❌ No participants in this giveaway!\n"
             "Giveaway cancelled."
         )
-        del active_giveaways[giveaway_id]
-        return
     
     # Pick random winner
-    winner_id = random.choice(giveaway['participants'])
-    winner_data = user_data.get(winner_id, {})
-    winner_name = winner_data.get('first_name', 'Unknown')
-    winner_username = winner_data.get('username', 'No username')
-    
-    # Award prize
-    if winner_id in user_data:
-        user_data[winner_id]['points'] = user_data[winner_id].get('points', 0) + giveaway['amount']
-    
-    # Announce winner
-    winner_text = (
-        f"🎉 **GIVEAWAY WINNER ANNOUNCEMENT!** 🎉\n\n"
-        f"**Prize:** {giveaway['amount']} coins\n"
-        f"**Total Participants:** {len(giveaway['participants'])}\n\n"
-        f"**Winner:** {winner_name} (@{winner_username})\n\n"
-        f"Congratulations! 🎊"
-    )
+    winner_id = giveaway.participants.choice()
     
-    await query.edit_message_text(
-        winner_text,
-        parse_mode='Markdown'
-    )
+    # Award prize (the winner may live on another shard)
+    try:
+        winner_data = await on_user_shard(
+            winner_id, 'credit',
+            user_id=winner_id, amount=giveaway.amount, reason=GIVEAWAY
+        )
+    except ShardError as e:
+        # The giveaway is already closed, so leave the owner what they need
+        # to pay by hand (a timed-out credit may still land; see /ledger)
+        logger.error(f"Giveaway {giveaway_id}: {giveaway.amount} coins for {winner_id} not credited: {e}")
+        return (
+            f"🎉 **GIVEAWAY WINNER:** `{winner_id}` 🎉\n\n"
+            f"⚠️ The prize of {giveaway.amount} coins could not be credited "
+            f"automatically. The owner will check /ledger and add it."
+        )
+    if winner_data is None:
+        winner_data = {'first_name': None, 'username': None, 'points': 0}
+    winner_name = winner_data['first_name'] or 'Unknown'
+    winner_username = winner_data['username'] or 'No username'
     
     # Notify winner
     try:
-        await context.bot.send_message(
+        await active_bot.send_message(
             chat_id=winner_id,
             text=f"🎉 **Congratulations! You won the giveaway!** 🎉\n\n"
-                 f"You received {giveaway['amount']} coins!\n"
-                 f"Your new balance: {user_data[winner_id]['points']}",
+                 f"You received {giveaway.amount} coins!\n"
+                 f"Your new balance: {winner_data['points']}",
             parse_mode='Markdown'
         )
-    except:
-        pass
+    except Exception as e:
+        logger.error(f"Failed to notify giveaway winner {winner_id}: {e}")
     
-    # Remove giveaway
-    del active_giveaways[giveaway_id]
+    return (
+        f"🎉 **GIVEAWAY WINNER ANNOUNCEMENT!** 🎉\n\n"
+        f"**Prize:** {giveaway.amount} coins\n"
+        f"**Total Participants:** {len(giveaway.participants)}\n\n"
+        f"**Winner:** {winner_name} (@{winner_username})\n\n"
+        f"Congratulations! 🎊"
+    )
 
 # ==================== GAME FUNCTIONS ====================
 
@@ -1028,44 +1949,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Initialize user data
     user = get_user(user_id, user.username, user.first_name)
     
-    # Create welcome message with buttons
-    keyboard = [
-        [InlineKeyboardButton("📢 Join Channel", url=CHANNEL_LINK)],
-        [InlineKeyboardButton("👥 Join Group", url=GROUP_LINK)],
-        [InlineKeyboardButton("🎮 PLAY GAMES 🎮", callback_data='games_menu')],
-        [InlineKeyboardButton("💰 Earn Points", callback_data='earn')],
-        [InlineKeyboardButton("📊 My Stats", callback_data='stats')],
-        [InlineKeyboardButton("🤝 Refer Friends", callback_data='refer')],
-        [InlineKeyboardButton("🏆 Leaderboard", callback_data='leaderboard')],
-        [InlineKeyboardButton("📞 Contact Owner", callback_data='contact_owner')],
-    ]
-    
-    # Add owner button if user is owner
-    if is_owner(user_id):
-        keyboard.append([InlineKeyboardButton("👑 Owner Panel", callback_data='owner_panel')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = (
-        f"🎮 **Welcome to GAMELY!** 🎮\n\n"
-        f"Hello {user['first_name']}! 👋\n\n"
-        f"Get ready for the ultimate gaming experience with GAMELY!\n\n"
-        f"**What we offer:**\n"
-        f"• Exclusive gaming content\n"
-        f"• Pro tips and strategies\n"
-        f"• Daily giveaways\n"
-        f"• Gaming community\n"
-        f"• Earn points and rewards\n\n"
-        f"**Our Community:**\n"
-        f"📢 Channel: {CHANNEL_LINK}\n"
-        f"👥 Group: {GROUP_LINK}\n\n"
-        f"#Developed by AAKASH\n\n"
-        f"👇 **Use the buttons below to get started!** 👇"
-    )
-    
     await update.message.reply_text(
-        welcome_text,
-        reply_markup=reply_markup,
+        WELCOME_TEMPLATE.format(first_name=user.first_name),
+        reply_markup=MAIN_MENU_KEYBOARDS[is_owner(user_id)],
         parse_mode='Markdown'
     )
 
@@ -1078,20 +1964,15 @@ async def owner_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Access denied!")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("📊 Bot Statistics", callback_data='owner_stats')],
-        [InlineKeyboardButton("🎁 Create Giveaway", callback_data='owner_create_giveaway')],
-        [InlineKeyboardButton("💰 Add Coins", callback_data='owner_addcoins')],
-        [InlineKeyboardButton("📢 Broadcast Message", callback_data='owner_broadcast_panel')],
-        [InlineKeyboardButton("🔙 Main Menu", callback_data='back_to_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    parts = await on_all_shards('stats')
+    total_users = sum(part['users'] for part in parts)
+    audience = sum(part['audience'] for part in parts)
     
     await query.edit_message_text(
         "👑 **Owner Control Panel** 👑\n\n"
+        f"👥 Live audience: {audience} of {total_users} users\n\n"
         "Select an option:",
-        reply_markup=reply_markup,
+        reply_markup=OWNER_PANEL_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -1101,31 +1982,11 @@ async def games_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    user_points = user_data.get(user_id, {}).get('points', 0)
-    
-    keyboard = [
-        [InlineKeyboardButton("🎲 Dice Roll", callback_data='game_dice')],
-        [InlineKeyboardButton("🪙 Coin Flip", callback_data='game_coin')],
-        [InlineKeyboardButton("🎰 Slot Machine", callback_data='game_slots')],
-        [InlineKeyboardButton("📊 My Game Stats", callback_data='game_stats')],
-        [InlineKeyboardButton("🔙 Main Menu", callback_data='back_to_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    games_text = (
-        f"🎮 **GAMES MENU** 🎮\n\n"
-        f"Your Points: **{user_points}** 💰\n\n"
-        f"**Available Games:**\n"
-        f"🎲 Dice Roll - Win up to 100 points\n"
-        f"🪙 Coin Flip - Double your points\n"
-        f"🎰 Slot Machine - Win big jackpots\n\n"
-        f"**Select a game to play:**"
-    )
+    user_points = store.get(user_id, NO_USER).points
     
     await query.edit_message_text(
-        games_text,
-        reply_markup=reply_markup,
+        GAMES_MENU_TEMPLATE.format(points=user_points),
+        reply_markup=GAMES_MENU_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -1137,33 +1998,11 @@ async def game_dice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    user_points = user_data.get(user_id, {}).get('points', 0)
-    
-    keyboard = [
-        [InlineKeyboardButton("💰 Bet 10 Points", callback_data='dice_10')],
-        [InlineKeyboardButton("💰 Bet 25 Points", callback_data='dice_25')],
-        [InlineKeyboardButton("💰 Bet 50 Points", callback_data='dice_50')],
-        [InlineKeyboardButton("💰 Bet 100 Points", callback_data='dice_100')],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    dice_text = (
-        f"🎲 **DICE ROLL** 🎲\n\n"
-        f"Your Points: **{user_points}**\n\n"
-        f"**How to play:**\n"
-        f"• Choose your bet amount\n"
-        f"• Roll higher than 3 to win!\n"
-        f"• Roll 1-3: You lose\n"
-        f"• Roll 4-6: You win double!\n"
-        f"• Roll 6: You win triple!\n\n"
-        f"Select your bet amount:"
-    )
+    user_points = store.get(user_id, NO_USER).points
     
     await query.edit_message_text(
-        dice_text,
-        reply_markup=reply_markup,
+        DICE_TEMPLATE.format(points=user_points),
+        reply_markup=DICE_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -1172,70 +2011,48 @@ async def play_dice(update: Update, context: ContextTypes.DEFAULT_TYPE, bet: int
     query = update.callback_query
     await query.answer()
     
+    # Buttons only offer allowed bets, but callback data can be forged
+    if not DICE.allows(bet):
+        await query.edit_message_text(f"❌ Bet must be between {DICE.min_bet} and {DICE.max_bet} points!")
+        return
+    
     user_id = query.from_user.id
     
-    if user_id not in user_data:
-        user_data[user_id] = {'points': 100, 'games_played': 0, 'games_won': 0, 'total_winnings': 0}
+    user = get_user(user_id, query.from_user.username, query.from_user.first_name)
     
-    if user_data[user_id]['points'] < bet:
+    settled = settle_game(user_id, user, DICE, bet)
+    if settled is None:
         await query.edit_message_text(
             f"❌ You don't have enough points!\n"
-            f"Your points: {user_data[user_id]['points']}\n"
+            f"Your points: {user.points}\n"
             f"Required: {bet}\n\n"
             f"Earn more points with /checkin or referrals!",
             parse_mode='Markdown'
         )
         return
+    roll, multiplier, winnings = settled
     
-    # Deduct bet
-    user_data[user_id]['points'] -= bet
-    user_data[user_id]['games_played'] += 1
-    
-    # Roll dice (1-6)
-    roll = random.randint(1, 6)
-    
-    # Determine winnings
-    if roll <= 3:
-        winnings = 0
+    if multiplier == 0:
         result_text = "❌ You lost!"
-        win = False
-    elif roll <= 5:
-        winnings = bet * 2
+    elif multiplier == 2:
         result_text = "✅ You won double!"
-        win = True
     else:
-        winnings = bet * 3
         result_text = "🎉 JACKPOT! You won TRIPLE!"
-        win = True
-    
-    if winnings > 0:
-        user_data[user_id]['points'] += winnings
-        user_data[user_id]['games_won'] += 1
-        user_data[user_id]['total_winnings'] += winnings
-    
-    dice_faces = ["⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
     
-    result_message = (
-        f"🎲 **DICE ROLL RESULT** 🎲\n\n"
-        f"You rolled: **{dice_faces[roll-1]} {roll}**\n\n"
-        f"{result_text}\n\n"
-        f"Bet: **{bet}** points\n"
-        f"Won: **{winnings}** points\n"
-        f"New Balance: **{user_data[user_id]['points']}** points\n\n"
-        f"Games Played: {user_data[user_id]['games_played']}\n"
-        f"Win Rate: {calculate_win_rate(user_id)}%"
+    result_message = DICE_RESULT_TEMPLATE.format(
+        face=DICE_FACES[roll - 1],
+        roll=roll,
+        result_text=result_text,
+        bet=bet,
+        winnings=winnings,
+        points=user.points,
+        games_played=user.games_played,
+        win_rate=calculate_win_rate(user_id)
     )
     
-    keyboard = [
-        [InlineKeyboardButton("🎲 Play Again", callback_data='game_dice')],
-        [InlineKeyboardButton("🔙 Games Menu", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         result_message,
-        reply_markup=reply_markup,
+        reply_markup=PLAY_AGAIN_KEYBOARDS['dice'],
         parse_mode='Markdown'
     )
 
@@ -1245,32 +2062,11 @@ async def game_coin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    user_points = user_data.get(user_id, {}).get('points', 0)
-    
-    keyboard = [
-        [InlineKeyboardButton("Bet 10 Points - Heads", callback_data='coin_10_heads')],
-        [InlineKeyboardButton("Bet 10 Points - Tails", callback_data='coin_10_tails')],
-        [InlineKeyboardButton("Bet 25 Points - Heads", callback_data='coin_25_heads')],
-        [InlineKeyboardButton("Bet 25 Points - Tails", callback_data='coin_25_tails')],
-        [InlineKeyboardButton("Bet 50 Points - Heads", callback_data='coin_50_heads')],
-        [InlineKeyboardButton("Bet 50 Points - Tails", callback_data='coin_50_tails')],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    coin_text = (
-        f"🪙 **COIN FLIP** 🪙\n\n"
-        f"Your Points: **{user_points}**\n\n"
-        f"**How to play:**\n"
-        f"• Choose Heads or Tails\n"
-        f"• Win double your bet!\n\n"
-        f"Make your choice:"
-    )
+    user_points = store.get(user_id, NO_USER).points
     
     await query.edit_message_text(
-        coin_text,
-        reply_markup=reply_markup,
+        COIN_TEMPLATE.format(points=user_points),
+        reply_markup=COIN_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -1279,55 +2075,40 @@ async def play_coin(update: Update, context: ContextTypes.DEFAULT_TYPE, bet: int
     query = update.callback_query
     await query.answer()
     
+    # Buttons only offer allowed bets, but callback data can be forged
+    if not COIN.allows(bet):
+        await query.edit_message_text(f"❌ Bet must be between {COIN.min_bet} and {COIN.max_bet} points!")
+        return
+    
     user_id = query.from_user.id
     
-    if user_id not in user_data:
-        user_data[user_id] = {'points': 100, 'games_played': 0, 'games_won': 0, 'total_winnings': 0}
+    user = get_user(user_id, query.from_user.username, query.from_user.first_name)
     
-    if user_data[user_id]['points'] < bet:
+    settled = settle_game(user_id, user, COIN, bet)
+    if settled is None:
         await query.edit_message_text(
             f"❌ You don't have enough points!\n"
-            f"Your points: {user_data[user_id]['points']}",
+            f"Your points: {user.points}",
             parse_mode='Markdown'
         )
         return
-    
-    user_data[user_id]['points'] -= bet
-    user_data[user_id]['games_played'] += 1
-    
-    flip = random.choice(['Heads', 'Tails'])
-    coin_emoji = "🪙 Heads" if flip == 'Heads' else "🪙 Tails"
-    
-    if choice.lower() == flip.lower():
-        winnings = bet * 2
-        user_data[user_id]['points'] += winnings
-        user_data[user_id]['games_won'] += 1
-        user_data[user_id]['total_winnings'] += winnings
-        result_text = "✅ **YOU WIN!**"
-    else:
-        winnings = 0
-        result_text = "❌ **You lose!**"
-    
-    result_message = (
-        f"🪙 **COIN FLIP RESULT** 🪙\n\n"
-        f"Coin landed: **{coin_emoji}**\n"
-        f"Your choice: **{choice}**\n\n"
-        f"{result_text}\n\n"
-        f"Bet: **{bet}** points\n"
-        f"Won: **{winnings}** points\n"
-        f"New Balance: **{user_data[user_id]['points']}** points"
+    won, multiplier, winnings = settled
+    flip = choice if won else COIN_SIDES[1 - COIN_SIDES.index(choice)]
+    coin_emoji = f"🪙 {flip.title()}"
+    result_text = "✅ **YOU WIN!**" if won else "❌ **You lose!**"
+    
+    result_message = COIN_RESULT_TEMPLATE.format(
+        coin=coin_emoji,
+        choice=choice,
+        result_text=result_text,
+        bet=bet,
+        winnings=winnings,
+        points=user.points
     )
     
-    keyboard = [
-        [InlineKeyboardButton("🪙 Play Again", callback_data='game_coin')],
-        [InlineKeyboardButton("🔙 Games Menu", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         result_message,
-        reply_markup=reply_markup,
+        reply_markup=PLAY_AGAIN_KEYBOARDS['coin'],
         parse_mode='Markdown'
     )
 
@@ -1337,32 +2118,11 @@ async def game_slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    user_points = user_data.get(user_id, {}).get('points', 0)
-    
-    keyboard = [
-        [InlineKeyboardButton("💰 Bet 20 Points", callback_data='slots_20')],
-        [InlineKeyboardButton("💰 Bet 50 Points", callback_data='slots_50')],
-        [InlineKeyboardButton("💰 Bet 100 Points", callback_data='slots_100')],
-        [InlineKeyboardButton("💰 Bet 200 Points", callback_data='slots_200')],
-        [InlineKeyboardButton("🔙 Back to Games", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    slots_text = (
-        f"🎰 **SLOT MACHINE** 🎰\n\n"
-        f"Your Points: **{user_points}**\n\n"
-        f"**Winning Combinations:**\n"
-        f"🍒🍒🍒 - Win 3x\n"
-        f"🍋🍋🍋 - Win 5x\n"
-        f"💎💎💎 - Win 10x\n"
-        f"7️⃣7️⃣7️⃣ - JACKPOT 20x!\n\n"
-        f"Select your bet:"
-    )
+    user_points = store.get(user_id, NO_USER).points
     
     await query.edit_message_text(
-        slots_text,
-        reply_markup=reply_markup,
+        SLOTS_TEMPLATE.format(points=user_points),
+        reply_markup=SLOTS_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -1371,66 +2131,42 @@ async def play_slots(update: Update, context: ContextTypes.DEFAULT_TYPE, bet: in
     query = update.callback_query
     await query.answer()
     
+    # Buttons only offer allowed bets, but callback data can be forged
+    if not SLOTS.allows(bet):
+        await query.edit_message_text(f"❌ Bet must be between {SLOTS.min_bet} and {SLOTS.max_bet} points!")
+        return
+    
     user_id = query.from_user.id
     
-    if user_id not in user_data:
-        user_data[user_id] = {'points': 100, 'games_played': 0, 'games_won': 0, 'total_winnings': 0}
+    user = get_user(user_id, query.from_user.username, query.from_user.first_name)
     
-    if user_data[user_id]['points'] < bet:
+    settled = settle_game(user_id, user, SLOTS, bet)
+    if settled is None:
         await query.edit_message_text(
             f"❌ You don't have enough points!\n"
-            f"Your points: {user_data[user_id]['points']}",
+            f"Your points: {user.points}",
             parse_mode='Markdown'
         )
         return
-    
-    user_data[user_id]['points'] -= bet
-    user_data[user_id]['games_played'] += 1
-    
-    symbols = ['🍒', '🍋', '💎', '7️⃣']
-    result = [random.choice(symbols) for _ in range(3)]
-    
-    multiplier = 0
-    if result[0] == result[1] == result[2]:
-        if result[0] == '🍒':
-            multiplier = 3
-        elif result[0] == '🍋':
-            multiplier = 5
-        elif result[0] == '💎':
-            multiplier = 10
-        elif result[0] == '7️⃣':
-            multiplier = 20
+    result, multiplier, winnings = settled
     
     if multiplier > 0:
-        winnings = bet * multiplier
-        user_data[user_id]['points'] += winnings
-        user_data[user_id]['games_won'] += 1
-        user_data[user_id]['total_winnings'] += winnings
         result_text = f"🎉 **JACKPOT! {multiplier}x WINNER!**"
     else:
-        winnings = 0
         result_text = "❌ **Try again!**"
     
-    result_message = (
-        f"🎰 **SLOT MACHINE RESULT** 🎰\n\n"
-        f"{' | '.join(result)}\n\n"
-        f"{result_text}\n\n"
-        f"Bet: **{bet}** points\n"
-        f"Won: **{winnings}** points\n"
-        f"Multiplier: **{multiplier}x**\n"
-        f"New Balance: **{user_data[user_id]['points']}** points"
+    result_message = SLOTS_RESULT_TEMPLATE.format(
+        reels=' | '.join(result),
+        result_text=result_text,
+        bet=bet,
+        winnings=winnings,
+        multiplier=multiplier,
+        points=user.points
     )
     
-    keyboard = [
-        [InlineKeyboardButton("🎰 Play Again", callback_data='game_slots')],
-        [InlineKeyboardButton("🔙 Games Menu", callback_data='games_menu')],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         result_message,
-        reply_markup=reply_markup,
+        reply_markup=PLAY_AGAIN_KEYBOARDS['slots'],
         parse_mode='Markdown'
     )
 
@@ -1440,13 +2176,13 @@ async def game_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    stats = user_data.get(user_id, {})
+    stats = store.get(user_id, NO_USER)
     
-    games_played = stats.get('games_played', 0)
-    games_won = stats.get('games_won', 0)
+    games_played = stats.games_played
+    games_won = stats.games_won
     win_rate = calculate_win_rate(user_id)
-    total_winnings = stats.get('total_winnings', 0)
-    points = stats.get('points', 0)
+    total_winnings = stats.total_winnings
+    points = stats.points
     
     stats_text = (
         f"📊 **YOUR GAME STATISTICS** 📊\n\n"
@@ -1486,18 +2222,15 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show top players leaderboard."""
     query = update.callback_query
     
-    sorted_users = sorted(user_data.items(), key=lambda x: x[1].get('points', 0), reverse=True)
-    top_users = sorted_users[:10]
+    top_users = await top_players(10)
     
     leaderboard_text = "🏆 **TOP PLAYERS LEADERBOARD** 🏆\n\n"
     
     if not top_users:
         leaderboard_text += "No players yet! Be the first to play!"
     else:
-        for i, (user_id, data) in enumerate(top_users, 1):
-            name = data.get('first_name', 'Anonymous')
-            points = data.get('points', 0)
-            wins = data.get('games_won', 0)
+        for i, (user_id, name, points, wins) in enumerate(top_users, 1):
+            name = name or 'Anonymous'
             
             medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "🎮"
             leaderboard_text += f"{medal} **{i}.** {name}\n"
@@ -1520,130 +2253,83 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all button callbacks."""
     query = update.callback_query
-    data = query.data
-    
-    # Owner panel
-    if data == 'owner_panel':
-        await owner_panel(update, context)
-    elif data == 'owner_stats':
-        await owner_stats(update, context)
-    elif data == 'owner_create_giveaway':
-        await query.edit_message_text(
-            "To create a giveaway, use:\n"
-            "`/giveaway amount minutes`\n\n"
-            "Example: `/giveaway 500 60`\n\n"
-            "Or use the command in chat.",
-            parse_mode='Markdown'
-        )
-    elif data == 'owner_broadcast_panel':
-        await owner_broadcast_panel(update, context)
-    elif data == 'start_broadcast':
-        await start_broadcast(update, context)
-    elif data == 'confirm_broadcast':
-        await confirm_broadcast(update, context)
-    elif data == 'owner_addcoins':
-        await query.edit_message_text(
-            "To add coins to a user, use:\n"
-            "`/addcoins @username amount`\n\n"
-            "Or reply to a user with: `/addcoins amount`\n\n"
-            "Examples:\n"
-            "• `/addcoins @john 100`\n"
-            "• `/addcoins 100` (while replying)",
-            parse_mode='Markdown'
-        )
     
-    # Contact owner
-    elif data == 'contact_owner':
-        await contact_owner_button(update, context)
-    
-    # Giveaway handling
-    elif data.startswith('giveaway_'):
-        giveaway_id = data.replace('giveaway_', '')
-        await join_giveaway(update, context, giveaway_id)
-    elif data.startswith('endgiveaway_'):
-        giveaway_id = data.replace('endgiveaway_', '')
-        await end_giveaway(update, context, giveaway_id)
-    
-    # Games menu
-    elif data == 'games_menu':
-        await games_menu(update, context)
-    elif data == 'game_dice':
-        await game_dice(update, context)
-    elif data == 'game_coin':
-        await game_coin(update, context)
-    elif data == 'game_slots':
-        await game_slots(update, context)
-    elif data == 'game_stats':
-        await game_stats(update, context)
-    
-    # Dice bets
-    elif data.startswith('dice_'):
-        bet = int(data.split('_')[1])
-        await play_dice(update, context, bet)
-    
-    # Coin flip bets
-    elif data.startswith('coin_'):
-        parts = data.split('_')
-        bet = int(parts[1])
-        choice = parts[2]
-        await play_coin(update, context, bet, choice)
-    
-    # Slots bets
-    elif data.startswith('slots_'):
-        bet = int(data.split('_')[1])
-        await play_slots(update, context, bet)
-    
-    # Leaderboard
-    elif data == 'leaderboard':
-        await leaderboard(update, context)
-    
-    # Other menus
-    elif data == 'earn':
-        points = user_data.get(query.from_user.id, {}).get('points', 0)
-        earn_text = (
-            "💰 **Earn Points** 💰\n\n"
-            "**Ways to earn:**\n"
-            "• Invite friends (+50 points each)\n"
-            "• Daily check-in (+10 points)\n"
-            "• Win games (varies)\n"
-            "• Participate in giveaways (BIG prizes!)\n"
-            "• Top players bonus (+500 points)\n\n"
-            f"Your current points: {points}\n\n"
-            "Use /checkin to claim your daily points!"
-        )
-        await query.edit_message_text(earn_text, parse_mode='Markdown')
-        
-    elif data == 'stats':
-        user_stats = user_data.get(query.from_user.id, {})
-        stats_text = (
-            f"📊 **Your Stats** 📊\n\n"
-            f"• Username: @{user_stats.get('username', 'N/A')}\n"
-            f"• Points: {user_stats.get('points', 0)}\n"
-            f"• Referrals: {user_stats.get('referrals', 0)}\n"
-            f"• Games Played: {user_stats.get('games_played', 0)}\n"
-            f"• Games Won: {user_stats.get('games_won', 0)}\n"
-            f"• Win Rate: {calculate_win_rate(query.from_user.id)}%\n"
-            f"• Joined: {user_stats.get('joined_date', datetime.now()).strftime('%Y-%m-%d')}"
-        )
-        await query.edit_message_text(stats_text, parse_mode='Markdown')
-        
-    elif data == 'refer':
-        user_stats = user_data.get(query.from_user.id, {})
-        bot_username = (await context.bot.get_me()).username
-        refer_text = (
-            "🤝 **Refer Friends** 🤝\n\n"
-            f"Share this link to earn points:\n"
-            f"`https://t.me/{bot_username}?start={query.from_user.id}`\n\n"
-            "**Benefits:**\n"
-            "• 50 points per referral\n"
-            "• Bonus for top referrers\n"
-            "• Exclusive rewards\n\n"
-            f"Total referrals: {user_stats.get('referrals', 0)}"
-        )
-        await query.edit_message_text(refer_text, parse_mode='Markdown')
-    
-    elif data == 'back_to_menu':
-        await back_to_menu(update, context)
+    if not await callback_router.dispatch(update, context, query.data):
+        # Unknown or malformed button, e.g. from a message sent by an older version
+        await query.answer("⚠️ This button is no longer available.")
+
+async def owner_create_giveaway_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Explain how to create a giveaway."""
+    await update.callback_query.edit_message_text(
+        "To create a giveaway, use:\n"
+        "`/giveaway amount minutes`\n\n"
+        "Example: `/giveaway 500 60`\n\n"
+        "Or use the command in chat.",
+        parse_mode='Markdown'
+    )
+
+async def owner_addcoins_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Explain how to add coins to a user."""
+    await update.callback_query.edit_message_text(
+        "To add coins to a user, use:\n"
+        "`/addcoins @username amount`\n\n"
+        "Or reply to a user with: `/addcoins amount`\n\n"
+        "Examples:\n"
+        "• `/addcoins @john 100`\n"
+        "• `/addcoins 100` (while replying)",
+        parse_mode='Markdown'
+    )
+
+async def earn_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the ways to earn points."""
+    query = update.callback_query
+    points = store.get(query.from_user.id, NO_USER).points
+    earn_text = (
+        "💰 **Earn Points** 💰\n\n"
+        "**Ways to earn:**\n"
+        "• Invite friends (+50 points each)\n"
+        "• Daily check-in (+10 points)\n"
+        "• Win games (varies)\n"
+        "• Participate in giveaways (BIG prizes!)\n"
+        "• Top players bonus (+500 points)\n\n"
+        f"Your current points: {points}\n\n"
+        "Use /checkin to claim your daily points!"
+    )
+    await query.edit_message_text(earn_text, parse_mode='Markdown')
+
+async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user's own stats."""
+    query = update.callback_query
+    user_stats = store.get(query.from_user.id, NO_USER)
+    joined = datetime.fromtimestamp(user_stats.joined_date) if user_stats.joined_date else datetime.now()
+    stats_text = (
+        f"📊 **Your Stats** 📊\n\n"
+        f"• Username: @{user_stats.username or 'N/A'}\n"
+        f"• Points: {user_stats.points}\n"
+        f"• Rank: {await format_rank(query.from_user.id)}\n"
+        f"• Referrals: {user_stats.referrals}\n"
+        f"• Games Played: {user_stats.games_played}\n"
+        f"• Games Won: {user_stats.games_won}\n"
+        f"• Win Rate: {calculate_win_rate(query.from_user.id)}%\n"
+        f"• Joined: {joined.strftime('%Y-%m-%d')}"
+    )
+    await query.edit_message_text(stats_text, parse_mode='Markdown')
+
+async def refer_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user's referral link."""
+    query = update.callback_query
+    user_stats = store.get(query.from_user.id, NO_USER)
+    refer_text = (
+        "🤝 **Refer Friends** 🤝\n\n"
+        f"Share this link to earn points:\n"
+        f"`{bot_metadata.referral_link(query.from_user.id)}`\n\n"
+        "**Benefits:**\n"
+        "• 50 points per referral\n"
+        "• Bonus for top referrers\n"
+        "• Exclusive rewards\n\n"
+        f"Total referrals: {user_stats.referrals}"
+    )
+    await query.edit_message_text(refer_text, parse_mode='Markdown')
 
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Return to main menu."""
@@ -1652,36 +2338,53 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     user_id = query.from_user.id
     
-    keyboard = [
-        [InlineKeyboardButton("📢 Join Channel", url=CHANNEL_LINK)],
-        [InlineKeyboardButton("👥 Join Group", url=GROUP_LINK)],
-        [InlineKeyboardButton("🎮 PLAY GAMES 🎮", callback_data='games_menu')],
-        [InlineKeyboardButton("💰 Earn Points", callback_data='earn')],
-        [InlineKeyboardButton("📊 My Stats", callback_data='stats')],
-        [InlineKeyboardButton("🤝 Refer Friends", callback_data='refer')],
-        [InlineKeyboardButton("🏆 Leaderboard", callback_data='leaderboard')],
-        [InlineKeyboardButton("📞 Contact Owner", callback_data='contact_owner')],
-    ]
-    
-    if is_owner(user_id):
-        keyboard.append([InlineKeyboardButton("👑 Owner Panel", callback_data='owner_panel')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    user_stats = user_data.get(user_id, {})
+    user_stats = store.get(user_id, NO_USER)
     
     await query.edit_message_text(
-        f"🎮 **Welcome to GAMELY!** 🎮\n\n"
-        f"Welcome back! Your points: **{user_stats.get('points', 0)}**\n\n"
-        f"**Our Community:**\n"
-        f"📢 Channel: {CHANNEL_LINK}\n"
-        f"👥 Group: {GROUP_LINK}\n\n"
-        f"#Developed by AAKASH\n\n"
-        f"Choose an option below:",
-        reply_markup=reply_markup,
+        WELCOME_BACK_TEMPLATE.format(points=user_stats.points),
+        reply_markup=MAIN_MENU_KEYBOARDS[is_owner(user_id)],
         parse_mode='Markdown'
     )
 
+# Callback routes: exact data first, then "prefix_" routes whose rest must
+# match the pattern; the pattern's groups become handler arguments
+
+# Owner panel
+callback_router.add('owner_panel', owner_panel)
+callback_router.add('owner_stats', owner_stats)
+callback_router.add('owner_create_giveaway', owner_create_giveaway_help)
+callback_router.add('owner_broadcast_panel', owner_broadcast_panel)
+callback_router.add('start_broadcast', start_broadcast)
+callback_router.add_prefix('audience_', choose_audience, r'(\w+)')
+callback_router.add('confirm_broadcast', confirm_broadcast)
+callback_router.add('owner_addcoins', owner_addcoins_help)
+
+# Contact owner
+callback_router.add('contact_owner', contact_owner_button)
+
+# Giveaways
+callback_router.add_prefix('giveaway_', join_giveaway, r'(\d{1,20})')
+callback_router.add_prefix('endgiveaway_', end_giveaway, r'(\d{1,20})')
+
+# Games menu
+callback_router.add('games_menu', games_menu)
+callback_router.add('game_dice', game_dice)
+callback_router.add('game_coin', game_coin)
+callback_router.add('game_slots', game_slots)
+callback_router.add('game_stats', game_stats)
+
+# Bets
+callback_router.add_prefix('dice_', play_dice, r'(\d{1,9})', int)
+callback_router.add_prefix('coin_', play_coin, r'(\d{1,9})_(heads|tails)', int, str)
+callback_router.add_prefix('slots_', play_slots, r'(\d{1,9})', int)
+
+# Other menus
+callback_router.add('leaderboard', leaderboard)
+callback_router.add('earn', earn_menu)
+callback_router.add('stats', stats_menu)
+callback_router.add('refer', refer_menu)
+callback_router.add('back_to_menu', back_to_menu)
+
 # ==================== OTHER COMMANDS ====================
 
 async def promo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1710,65 +2413,47 @@ async def promo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def checkin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Daily check-in to earn points."""
-    user = update.effective_user
-    user_id = user.id
-    
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'username': user.username,
-            'first_name': user.first_name,
-            'joined_date': datetime.now(),
-            'points': 100,
-            'referrals': 0,
-            'last_checkin': None,
-            'games_played': 0,
-            'games_won': 0,
-            'total_winnings': 0
-        }
+    user_id = update.effective_user.id
+    user = get_user(user_id, update.effective_user.username, update.effective_user.first_name)
     
-    last_checkin = user_data[user_id].get('last_checkin')
     today = datetime.now().date()
     
-    if last_checkin and last_checkin.date() == today:
+    if user.last_checkin and datetime.fromtimestamp(user.last_checkin).date() == today:
         await update.message.reply_text("❌ You've already checked in today! Come back tomorrow.")
         return
     
-    user_data[user_id]['points'] += 10
-    user_data[user_id]['last_checkin'] = datetime.now()
+    adjust_points(user_id, user, 10, CHECKIN)
+    user.last_checkin = int(time.time())
+    save_user(user_id)
     
     await update.message.reply_text(
         f"✅ Daily check-in successful!\n"
         f"You earned 10 points!\n"
-        f"Total points: {user_data[user_id]['points']}\n\n"
+        f"Total points: {user.points}\n\n"
         f"🎮 Ready to play? Use /start and click PLAY GAMES!"
     )
 
 async def handle_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle referral links."""
-    if context.args and context.args[0].isdigit():
+    """Handle referral links; only a player's first /start pays their referrer."""
+    new_user_id = update.effective_user.id
+    # Updates are handled on the sender's shard, so this is their own record
+    is_new = store.get(new_user_id) is None
+    
+    await start(update, context)
+    
+    if is_new and context.args and context.args[0].isdigit():
         referrer_id = int(context.args[0])
-        new_user_id = update.effective_user.id
         
         if referrer_id != new_user_id:
-            if referrer_id not in user_data:
-                user_data[referrer_id] = {
-                    'points': 100,
-                    'referrals': 0,
-                    'games_played': 0,
-                    'games_won': 0,
-                    'total_winnings': 0
-                }
-            
-            user_data[referrer_id]['points'] += 50
-            user_data[referrer_id]['referrals'] += 1
-            
-            await start(update, context)
+            referrer_points = await on_user_shard(referrer_id, 'referral', user_id=referrer_id)
+            if referrer_points is None:
+                return
             
             try:
                 await context.bot.send_message(
                     chat_id=referrer_id,
                     text=f"🎉 Someone joined using your referral link!\n"
-                         f"You earned 50 points! Total points: {user_data[referrer_id]['points']}\n\n"
+                         f"You earned 50 points! Total points: {referrer_points}\n\n"
                          f"Play games to win more! Use /start"
                 )
             except:
@@ -1776,64 +2461,429 @@ async def handle_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ==================== ERROR HANDLER AND POST INIT ====================
 
+GAME_CALLBACK_PREFIXES = ('dice_', 'coin_', 'slots_')
+GAME_COMMANDS = {'/dice', '/coin', '/slots'}
+
+def is_game_action(update: Update):
+    """Whether an update plays a game: a bet button or a group game command."""
+    if update.callback_query is not None:
+        return (update.callback_query.data or '').startswith(GAME_CALLBACK_PREFIXES)
+    message = update.message
+    if message is None or not message.text or not message.text.startswith('/'):
+        return False
+    command = message.text.split(maxsplit=1)[0].split('@', 1)[0].lower()
+    return command in GAME_COMMANDS
+
+async def throttle_games(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop game actions beyond the user's or the group's rate.
+    
+    Dropped taps get no reply at all; answering them would spend the very
+    flood budget this protects.
+    """
+    if update.effective_user is None or not is_game_action(update):
+        return
+    
+    if not user_throttle.allow(update.effective_user.id):
+        throttled_total.inc('user')
+        raise ApplicationHandlerStop
+    chat = update.effective_chat
+    if chat is not None and chat.type in ('group', 'supergroup') and not chat_throttle.allow(chat.id):
+        throttled_total.inc('chat')
+        raise ApplicationHandlerStop
+
+async def note_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Track who uses the bot, on the shard that owns the user.
+    
+    That is usually this one; giveaway buttons are handled on the owner's
+    shard, so a joining user's activity is passed on to theirs.
+    """
+    if update.effective_user is None:
+        return
+    user_id = update.effective_user.id
+    try:
+        await on_user_shard(user_id, 'note_activity', user_id=user_id, now=int(time.time()))
+    except ShardError as e:
+        logger.warning(f"Activity of {user_id} not recorded: {e}")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Log errors."""
+    """Log errors, and tell the user when another shard didn't come through."""
     logger.error(f"Update {update} caused error {context.error}")
+    if not isinstance(context.error, ShardError) or not isinstance(update, Update):
+        return
+    if update.effective_chat is None:
+        return
+    try:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="⚠️ That didn't go through, please try again in a moment."
+        )
+    except Exception as e:
+        logger.error(f"Failed to report a shard error: {e}")
+
+def observe_api_call(method, status, seconds):
+    """Record one Bot API call made through MeteredRequest."""
+    bot_api_seconds.observe(seconds, method, status)
+
+async def start_metrics(application: Application):
+    """Serve metrics, with gauges for the application's update backlog."""
+    if not METRICS_PORT:
+        return
+    metrics.gauge(
+        'gamely_update_queue_depth', "Updates received but not yet picked up",
+        application.update_queue.qsize
+    )
+    processor = application.update_processor
+    if isinstance(processor, OrderedUpdateProcessor):
+        metrics.gauge(
+            'gamely_updates_waiting', "Updates waiting for a free slot or for their user's earlier updates",
+            lambda: processor.pending - processor.active
+        )
+        metrics.gauge('gamely_updates_in_progress', "Updates being handled right now", lambda: processor.active)
+    try:
+        await metrics_server.start()
+    except OSError as e:
+        logger.warning(f"Metrics not served on port {metrics_server.port}: {e}")
 
 async def post_init(application: Application):
     """Post initialization hook."""
-    bot_info = await application.bot.get_me()
-    logger.info(f"Bot started: @{bot_info.username}")
+    global active_bot
+    active_bot = application.bot
+    
+    store.open()
+    active_giveaways.open()
+    broadcast_jobs.open()
+    unreachable_users.open()
+    restore_balances()
+    rankings.rebuild((uid, data.points) for uid, data in store.items())
+    economy.rebuild(store.values())
+    segments.rebuild(store.items())
+    store.start()
+    active_giveaways.start()
+    unreachable_users.start()
+    coin_ledger.start()
+    
+    # Pick up giveaways that were running before a restart; any that ended
+    # while the bot was down are settled straight away
+    for giveaway in active_giveaways.values():
+        giveaway_deadlines.schedule(giveaway.giveaway_id, giveaway.end_time)
+    giveaway_deadlines.start()
+    
+    # Resume broadcasts interrupted by a restart from their last checkpoint
+    for job in list(broadcast_jobs.values()):
+        start_broadcast_job(job)
+    
+    failed = await bot_metadata.refresh(application.bot)
+    if failed:
+        logger.warning(f"Chats not resolved, using their usernames: {', '.join(failed)}")
+    await start_metrics(application)
+    logger.info(f"Bot started: @{bot_metadata.bot_username}")
+
+async def post_shutdown(application: Application):
+    """Flush pending ledger and user records before exit.
+    
+    Every store is closed even if one before it fails, so one bad write
+    doesn't lose the others' last batch.
+    """
+    await metrics_server.close()
+    await giveaway_deadlines.close()
+    for task in list(broadcast_tasks):
+        task.cancel()
+    await asyncio.gather(*broadcast_tasks, return_exceptions=True)
+    for resource in (broadcast_jobs, unreachable_users, coin_ledger, active_giveaways, store):
+        try:
+            await resource.close()
+        except Exception as e:
+            logger.error(f"Failed to close {type(resource).__name__}: {e}")
 
 # ==================== MAIN FUNCTION ====================
 
+def new_builder(updater=True):
+    """An application builder for BOT_API_URL whose Bot API calls are timed."""
+    # Same pool sizes as PTB's own defaults
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{BOT_API_URL}/bot")
+        .base_file_url(f"{BOT_API_URL}/file/bot")
+        .request(MeteredRequest(observe_api_call, connection_pool_size=256))
+    )
+    if updater:
+        return builder.get_updates_request(MeteredRequest(observe_api_call, connection_pool_size=1))
+    return builder.updater(None)
+
+def time_handlers(application: Application):
+    """Time every registered handler, labelled with its callback's name."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(handler_seconds, handler.callback, handler.callback.__name__)
+
+def build_application(updater=True):
+    """Create the application with every handler registered."""
+    builder = new_builder(updater).post_init(post_init).post_shutdown(post_shutdown)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(OrderedUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
+    
+    # Run before every other handler, each in its own group. Throttling
+    # happens in the front process when sharded, which sees whole groups
+    if shard_link is None:
+        application.add_handler(TypeHandler(Update, throttle_games), group=-2)
+    application.add_handler(TypeHandler(Update, note_activity), group=-1)
+    
+    # Private chat commands; a referral link is "/start <referrer id>", so
+    # it has to be matched before the plain /start
+    application.add_handler(CommandHandler("start", handle_referral, filters.Regex(r'^/start \d+$')))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("promo", promo))
+    application.add_handler(CommandHandler("checkin", checkin))
+    application.add_handler(CommandHandler("leaderboard", leaderboard))
+    application.add_handler(CommandHandler("contact", contact_owner))
+    
+    # Group game commands
+    application.add_handler(CommandHandler("dice", group_dice))
+    application.add_handler(CommandHandler("coin", group_coin))
+    application.add_handler(CommandHandler("slots", group_slots))
+    application.add_handler(CommandHandler("balance", group_balance))
+    
+    # Owner commands
+    application.add_handler(CommandHandler("addcoins", owner_addcoins))
+    application.add_handler(CommandHandler("removecoins", owner_removecoins))
+    application.add_handler(CommandHandler("giveaway", owner_giveaway))
+    application.add_handler(CommandHandler("endgiveaway", owner_endgiveaway))
+    application.add_handler(CommandHandler("stats", owner_stats))
+    application.add_handler(CommandHandler("broadcast", owner_broadcast))
+    application.add_handler(CommandHandler("ledger", owner_ledger))
+    application.add_handler(CommandHandler("audience", owner_audience))
+    application.add_handler(CommandHandler("botinfo", owner_botinfo))
+    
+    # Add callback query handler
+    application.add_handler(CallbackQueryHandler(button_callback))
+    
+    # Add message handler for broadcast input
+    application.add_handler(MessageHandler(~filters.COMMAND & ~filters.StatusUpdate.ALL, handle_broadcast_input))
+    
+    # Add error handler
+    application.add_error_handler(error_handler)
+    
+    time_handlers(application)
+    return application
+
+# ==================== SHARDED MODE ====================
+
+def shard_key(update: Update):
+    """Pick the id whose shard should handle an update.
+    
+    Giveaways and the broadcast flow live in the owner's process, so joins
+    and ends of a giveaway go to the owner's shard; everything else goes to
+    the shard of the user who sent it.
+    """
+    query = update.callback_query
+    if query is not None and query.data and query.data.startswith(('giveaway_', 'endgiveaway_')):
+        return OWNER_ID
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return 0
+
+def run_worker(index, shards, inbox, outbox):
+    """Entry point of a shard worker process."""
+    store.path = shard_path(DB_PATH, index)
+    active_giveaways.path = store.path
+    broadcast_jobs.path = store.path
+    unreachable_users.path = store.path
+    coin_ledger.directory = shard_path(LEDGER_DIR, index)
+    metrics_server.port = METRICS_PORT + 1 + index
+    # A second longer than the coordinator waits, so its timeout reports first
+    link = ShardLink(index, shards, inbox, outbox, timeout=SHARD_CALL_TIMEOUT + 1)
+    asyncio.run(serve_shard(link))
+
+async def serve_shard(link):
+    """Process updates handed over by the coordinator until told to stop."""
+    global shard_link
+    shard_link = link
+    
+    application = build_application(updater=False)
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    
+    def on_update(data):
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+    
+    link.start(on_update=on_update, ops=SHARD_OPS)
+    logger.info(f"Shard {link.index} of {link.shards} ready")
+    try:
+        await link.stopped.wait()
+    finally:
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+
+def partition_data(shards):
+    """Split the single-process database and coin ledger between shards.
+    
+    Runs the first time the bot starts sharded. Each shard gets a copy of
+    DB_PATH with only its own users, and a ledger that opens with their
+    balances. Giveaways stay with the owner's shard. Every shard resumes
+    pending broadcast jobs for its users, with their progress counted on
+    the owner's. The unsharded files are left untouched.
+    
+    Shard files are written under a ``.partial`` name and moved into place
+    once all of them exist, and SHARDS_MARKER is written last. A split
+    that was cut short is started over.
+    """
+    if split_shards() == shards:
+        return
+    shard_files = [shard_path(DB_PATH, index) for index in range(shards)]
+    shard_files += [shard_path(LEDGER_DIR, index) for index in range(shards)]
+    present = [path for path in shard_files if os.path.exists(path)]
+    if present:
+        raise RuntimeError(
+            f"{', '.join(present)} exist but {SHARDS_MARKER} doesn't, so it isn't known what they "
+            f"hold. If they are a complete split for WORKERS={shards}, write {shards} to "
+            f"{SHARDS_MARKER}; otherwise remove them to split {DB_PATH} again"
+        )
+    for path in shard_files:
+        for leftover in (f"{path}.partial", f"{path}.partial-wal", f"{path}.partial-shm"):
+            remove_path(leftover)
+    
+    old_ledger = Ledger(LEDGER_DIR)
+    has_ledger = os.path.exists(old_ledger.snapshot_path) or os.path.exists(old_ledger.log_path)
+    if os.path.exists(DB_PATH) or has_ledger:
+        logger.info(f"Splitting {DB_PATH} and {LEDGER_DIR} between {shards} shards")
+        split_data(shards, has_ledger)
+    for path in shard_files:
+        if os.path.exists(f"{path}.partial"):
+            os.replace(f"{path}.partial", path)
+    with open(f"{SHARDS_MARKER}.tmp", 'w') as f:
+        f.write(f"{shards}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{SHARDS_MARKER}.tmp", SHARDS_MARKER)
+
+def split_data(shards, has_ledger):
+    """Write each shard's part of DB_PATH and LEDGER_DIR under ``.partial`` names."""
+    # The ledger is ahead of the database if the bot stopped before a commit
+    balances = Ledger(LEDGER_DIR).read_balances() if has_ledger else {}
+    owner_shard = shard_for(OWNER_ID, shards)
+    for index in range(shards):
+        if os.path.exists(DB_PATH):
+            with closing(sqlite3.connect(DB_PATH)) as source, \
+                    closing(sqlite3.connect(f"{shard_path(DB_PATH, index)}.partial")) as target:
+                source.backup(target)
+                tables = {name for (name,) in target.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                with target:
+                    for table in ('users', 'unreachable'):
+                        if table in tables:
+                            target.execute(f"DELETE FROM {table} WHERE user_id % ? != ?", (shards, index))
+                    if index != owner_shard:
+                        for table in ('giveaway_entries', 'giveaways'):
+                            if table in tables:
+                                target.execute(f"DELETE FROM {table}")
+                        if 'broadcast_jobs' in tables:
+                            columns = {row[1] for row in target.execute("PRAGMA table_info(broadcast_jobs)")}
+                            progress = [
+                                name for name in ('sent', 'failed', 'retried', 'elapsed', 'unreachable',
+                                                  'status_chat_id', 'status_message_id')
+                                if name in columns
+                            ]
+                            target.execute(f"UPDATE broadcast_jobs SET {', '.join(f'{name} = 0' for name in progress)}")
+        if has_ledger:
+            Ledger(f"{shard_path(LEDGER_DIR, index)}.partial").seed(
+                {uid: points for uid, points in balances.items() if shard_for(uid, shards) == index}
+            )
+
+def split_shards():
+    """The WORKERS the data was split for, or 0 if it never was."""
+    try:
+        with open(SHARDS_MARKER) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+def remove_path(path):
+    """Delete a file or directory tree, if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def check_shard_layout(workers):
+    """Refuse to start with a WORKERS the data isn't split for.
+    
+    A user's shard is their id modulo the worker count, so any other
+    count would look users up on shards without their records, and
+    running unsharded would reopen DB_PATH as it was before the split.
+    """
+    shards = workers if workers > 1 else 0
+    split = split_shards()
+    if split and split != shards:
+        raise RuntimeError(
+            f"The data is split between {split} workers ({SHARDS_MARKER}), but WORKERS={workers}. "
+            f"Start with WORKERS={split}; changing the number of workers isn't supported"
+        )
+
+def run_front(workers):
+    """Receive updates and hand each one to the worker that owns it."""
+    partition_data(workers)
+    coordinator = Coordinator(workers, run_worker, timeout=SHARD_CALL_TIMEOUT)
+    
+    async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        coordinator.dispatch(shard_key(update), update.to_dict())
+    
+    async def start_workers(application: Application):
+        coordinator.start()
+        await start_metrics(application)
+    
+    async def stop_workers(application: Application):
+        await metrics_server.close()
+        await asyncio.to_thread(coordinator.stop)
+    
+    application = new_builder().post_init(start_workers).post_shutdown(stop_workers).build()
+    application.add_handler(TypeHandler(Update, throttle_games), group=-1)
+    application.add_handler(TypeHandler(Update, forward_update))
+    application.add_error_handler(error_handler)
+    time_handlers(application)
+    
+    logger.info(f"🤖 GAMELY Bot is starting with {workers} workers...")
+    receive_updates(application)
+
+def receive_updates(application: Application):
+    """Run the application until stopped, by webhook if WEBHOOK_URL is set
+    and by long polling otherwise."""
+    if not WEBHOOK_URL:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        return
+    
+    # PTB's webhook server checks the secret token on every request, answers
+    # Telegram as soon as the update is queued and leaves the handling to
+    # the application
+    webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+    logger.info(f"Receiving updates by webhook at {webhook_url} (port {PORT})")
+    application.run_webhook(
+        listen='0.0.0.0',
+        port=PORT,
+        url_path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        webhook_url=webhook_url,
+        allowed_updates=Update.ALL_TYPES
+    )
+
 def main():
     """Start the bot."""
     try:
         logger.info(f"Starting GAMELY Bot with token: {BOT_TOKEN[:10]}...")
+        check_shard_layout(WORKERS)
         
-        application = (
-            Application.builder()
-            .token(BOT_TOKEN)
-            .post_init(post_init)
-            .build()
-        )
-        
-        # Private chat commands
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("promo", promo))
-        application.add_handler(CommandHandler("checkin", checkin))
-        application.add_handler(CommandHandler("leaderboard", leaderboard))
-        application.add_handler(CommandHandler("contact", contact_owner))
-        
-        # Group game commands
-        application.add_handler(CommandHandler("dice", group_dice))
-        application.add_handler(CommandHandler("coin", group_coin))
-        application.add_handler(CommandHandler("slots", group_slots))
-        application.add_handler(CommandHandler("balance", group_balance))
-        
-        # Owner commands
-        application.add_handler(CommandHandler("addcoins", owner_addcoins))
-        application.add_handler(CommandHandler("removecoins", owner_removecoins))
-        application.add_handler(CommandHandler("giveaway", owner_giveaway))
-        application.add_handler(CommandHandler("endgiveaway", owner_endgiveaway))
-        application.add_handler(CommandHandler("stats", owner_stats))
-        application.add_handler(CommandHandler("broadcast", owner_broadcast))
-        
-        # Add callback query handler
-        application.add_handler(CallbackQueryHandler(button_callback))
-        
-        # Add message handler for broadcast input
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_input))
-        
-        # Add message handler for referral links
-        application.add_handler(MessageHandler(filters.Regex(r'^/start \d+$'), handle_referral))
+        if WORKERS > 1:
+            run_front(WORKERS)
+            return
         
-        # Add error handler
-        application.add_error_handler(error_handler)
+        application = build_application()
         
         logger.info("🤖 GAMELY Bot is starting...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        receive_updates(application)
         
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
@@ -0,0 +1,41 @@
+import time
+
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+
+def api_method(url):
+    """The Bot API method a request URL calls, e.g. ``sendMessage``.
+
+    File downloads are all ``file``, so their paths (and the bot token in
+    every URL) never end up in a metric label.
+    """
+    if '/file/bot' in url:
+        return 'file'
+    return url.rsplit('/', 1)[-1]
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that reports every Bot API call to
+    ``observe(method, status, seconds)``.
+
+    ``status`` is the HTTP status code as text, or ``timeout``/``network``
+    when no response came back at all.
+    """
+
+    def __init__(self, observe, **kwargs):
+        super().__init__(**kwargs)
+        self.observe = observe
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        status = 'network'
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        except TimedOut:
+            status = 'timeout'
+            raise
+        finally:
+            self.observe(api_method(url), status, time.perf_counter() - started)
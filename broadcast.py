@@ -0,0 +1,413 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from writebehind import WriteBehind, in_thread
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows ``rate`` operations per second, in bursts of up to ``capacity``.
+
+    ``pause`` stops everyone drawing from the bucket for a while, which is
+    how a flood-control reply from Telegram slows every sender at once.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token. Waiters are served first come, first served."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                elapsed = max(0, now - self._updated)
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hand out no tokens for ``seconds``, then restart from empty."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+
+def is_unreachable(error):
+    """Whether a send error means the chat will not accept messages until
+    the user comes back: blocked bot, deactivated account, unknown chat."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and 'chat not found' in str(error).lower()
+
+
+class Unreachable(WriteBehind):
+    """Users broadcasts cannot reach, skipped until they use the bot again.
+
+    A set of user ids in memory and a one-column table on disk, written in
+    the background like ``UserStore``.
+    """
+
+    write_errors = (sqlite3.Error,)
+    description = 'unreachable users'
+
+    def __init__(self, path, flush_interval=0.25):
+        super().__init__(flush_interval)
+        self.path = path
+        self._users = set()
+        self._added = set()
+        self._removed = set()
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS unreachable (user_id INTEGER PRIMARY KEY) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._users = {row[0] for row in self._conn.execute("SELECT user_id FROM unreachable")}
+        logger.info(f"Loaded {len(self._users)} unreachable users from {self.path}")
+
+    async def close(self):
+        """Stop the flush task and write out anything still pending."""
+        await super().close()
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    def add(self, user_id):
+        if user_id not in self._users:
+            self._users.add(user_id)
+            self._added.add(user_id)
+            self._removed.discard(user_id)
+
+    def discard(self, user_id):
+        if user_id in self._users:
+            self._users.discard(user_id)
+            self._removed.add(user_id)
+            self._added.discard(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def _has_pending(self):
+        return bool(self._added or self._removed)
+
+    def _take_pending(self):
+        added, removed = self._added, self._removed
+        self._added, self._removed = set(), set()
+        return added, removed
+
+    def _restore_pending(self, pending):
+        # Changes made since are newer and win
+        added, removed = pending
+        self._added |= added - self._removed
+        self._removed |= removed - self._added
+
+    def _write(self, pending):
+        added, removed = pending
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO unreachable VALUES (?)", ((uid,) for uid in added)
+            )
+            self._conn.executemany(
+                "DELETE FROM unreachable WHERE user_id = ?", ((uid,) for uid in removed)
+            )
+
+
+class BroadcastReport:
+    """Outcome of one broadcast. ``unreachable`` counts the failures that
+    were users who blocked the bot or are gone."""
+
+    def __init__(self, sent=0, failed=0, retried=0, elapsed=0.0, unreachable=0):
+        self.sent = sent
+        self.failed = failed
+        self.retried = retried
+        self.elapsed = elapsed
+        self.unreachable = unreachable
+
+    @property
+    def rate(self):
+        """Messages delivered per second."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'elapsed': self.elapsed,
+            'unreachable': self.unreachable,
+        }
+
+    @classmethod
+    def combine(cls, parts):
+        """Merge ``to_dict`` results of broadcasts that ran side by side."""
+        return cls(
+            sent=sum(part['sent'] for part in parts),
+            failed=sum(part['failed'] for part in parts),
+            retried=sum(part['retried'] for part in parts),
+            elapsed=max((part['elapsed'] for part in parts), default=0.0),
+            unreachable=sum(part['unreachable'] for part in parts)
+        )
+
+
+# Columns of a saved broadcast job, in table order
+JOB_COLUMNS = (
+    'job_id',
+    'text',
+    'cursor',
+    'sent',
+    'failed',
+    'retried',
+    'elapsed',
+    'finished',
+    'status_chat_id',
+    'status_message_id',
+    'unreachable',
+    'content',
+    'audience',
+)
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    retried INTEGER NOT NULL DEFAULT 0,
+    elapsed REAL NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    status_chat_id INTEGER NOT NULL DEFAULT 0,
+    status_message_id INTEGER NOT NULL DEFAULT 0,
+    unreachable INTEGER NOT NULL DEFAULT 0,
+    content TEXT NOT NULL DEFAULT '',
+    audience TEXT NOT NULL DEFAULT 'all'
+)
+"""
+
+# Columns added after the table was first released, with their definitions
+JOBS_ADDED_COLUMNS = {
+    'unreachable': "INTEGER NOT NULL DEFAULT 0",
+    'content': "TEXT NOT NULL DEFAULT ''",
+    'audience': "TEXT NOT NULL DEFAULT 'all'",
+}
+
+
+class BroadcastJob(BroadcastReport):
+    """A broadcast that survives restarts.
+
+    Recipients are sent to in ascending user id order; ``cursor`` is the
+    highest id known to be done, so a resumed job starts just above it.
+    ``finished`` is the epoch time the last chunk completed, 0 while
+    running. ``status_message_id`` is the owner's progress message, cleared
+    once the final result has been shown there.
+
+    ``content`` describes what to send, as JSON, for broadcasts that are not
+    plain ``text``; its meaning is up to the caller, as is that of
+    ``audience``, which says who the job is for.
+    """
+
+    def __init__(self, job_id, text, cursor=0, sent=0, failed=0, retried=0, elapsed=0.0,
+                 finished=0, status_chat_id=0, status_message_id=0, unreachable=0, content='',
+                 audience='all'):
+        super().__init__(sent, failed, retried, elapsed, unreachable)
+        self.job_id = job_id
+        self.text = text
+        self.content = content
+        self.audience = audience
+        self.cursor = cursor
+        self.finished = finished
+        self.status_chat_id = status_chat_id
+        self.status_message_id = status_message_id
+        self.remaining = 0  # Recipients above the cursor; known once running
+
+    def to_dict(self):
+        progress = super().to_dict()
+        progress['remaining'] = self.remaining
+        progress['finished'] = self.finished
+        return progress
+
+    def row(self):
+        return tuple(getattr(self, name) for name in JOB_COLUMNS)
+
+
+class BroadcastJobs:
+    """Broadcast jobs saved in SQLite, checkpointed as they progress."""
+
+    def __init__(self, path):
+        self.path = path
+        self._jobs = {}
+        self._conn = None
+        self._lock = None
+
+    def open(self):
+        """Open the database and load jobs that still need attention."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(JOBS_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(broadcast_jobs)")}
+        for name, definition in JOBS_ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE broadcast_jobs ADD COLUMN {name} {definition}")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+        # Recently finished jobs are kept so progress reports that span
+        # several shards still add up after a restart
+        cursor = self._conn.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs "
+            f"WHERE finished = 0 OR status_message_id != 0 OR finished > ?",
+            (int(time.time()) - 86400,)
+        )
+        for row in cursor:
+            self._jobs[row[0]] = BroadcastJob(*row)
+        logger.info(f"Loaded {len(self._jobs)} broadcast jobs from {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            async with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def values(self):
+        return self._jobs.values()
+
+    def add(self, job):
+        self._jobs[job.job_id] = job
+
+    def _write(self, row):
+        with self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO broadcast_jobs ({', '.join(JOB_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+                row
+            )
+
+    async def save(self, job):
+        """Write a job's current state; the row is taken before awaiting."""
+        row = job.row()
+        # close() waits on the lock to close the connection
+        async with self._lock:
+            await in_thread(self._write, row)
+
+
+class Broadcaster:
+    """Sends one message to many chats concurrently, within a rate limit.
+
+    Up to ``concurrency`` sends are in flight at once, all drawing from one
+    token bucket, so every broadcast running in the process shares the
+    same budget. A ``RetryAfter`` pauses the bucket for the time Telegram
+    asks; network errors are retried with exponential backoff. Blocked
+    users and bad chats fail at once without retrying, and users who can
+    no longer be reached are added to ``unreachable``.
+    """
+
+    def __init__(self, rate=25, concurrency=32, max_attempts=5, unreachable=None):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.unreachable = unreachable
+
+    async def run(self, chat_ids, send, report=None):
+        """Call ``send(chat_id)`` for every chat.
+
+        Counts are added to ``report`` as sends complete (a new
+        BroadcastReport if not given), which is returned.
+        """
+        if report is None:
+            report = BroadcastReport()
+        start = time.monotonic()
+        pending = iter(chat_ids)
+
+        async def worker():
+            # All workers share one iterator, so each chat is sent once
+            for chat_id in pending:
+                if await self._deliver(chat_id, send, report):
+                    report.sent += 1
+                else:
+                    report.failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        report.elapsed += time.monotonic() - start
+        return report
+
+    async def run_job(self, job, recipients, send, jobs, chunk_size=500):
+        """Send a job to ``recipients`` above its cursor, checkpointing it
+        after every ``chunk_size`` recipients.
+
+        After a restart at most one chunk is sent twice.
+        """
+        pending = sorted(user_id for user_id in recipients if user_id > job.cursor)
+        job.remaining = len(pending)
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            await self.run(chunk, send, report=job)
+            job.cursor = chunk[-1]
+            job.remaining -= len(chunk)
+            await jobs.save(job)
+        job.finished = int(time.time())
+        await jobs.save(job)
+        return job
+
+    async def _deliver(self, chat_id, send, report):
+        backoff = 1
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # BadRequest is a NetworkError subclass, but retrying won't help
+                if is_unreachable(e):
+                    report.unreachable += 1
+                    if self.unreachable is not None:
+                        self.unreachable.add(chat_id)
+                    logger.info(f"Broadcast recipient {chat_id} is unreachable: {e}")
+                else:
+                    logger.error(f"Failed to send broadcast to {chat_id}: {e}")
+                return False
+            except NetworkError as e:
+                if attempt == self.max_attempts:
+                    break
+                logger.warning(f"Network error sending to {chat_id}, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff *= 2
+            except TelegramError as e:
+                logger.error(f"Failed to send broadcast to {chat_id}: {e}")
+                return False
+            report.retried += 1
+        logger.error(f"Giving up on broadcast to {chat_id} after {self.max_attempts} attempts")
+        return False
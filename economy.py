@@ -0,0 +1,108 @@
+from ledger import (
+    SIGNUP,
+    BET,
+    BET_LOST,
+    PAYOUT,
+    CHECKIN,
+    REFERRAL,
+    ADMIN_ADD,
+    ADMIN_REMOVE,
+    GIVEAWAY
+)
+
+
+class Economy:
+    """Running totals of the coin economy, kept current as things happen.
+
+    Point flows come straight from the ledger's per-reason totals; game
+    counters are counted here. Every figure is O(1) to read, so /stats
+    never has to walk the user store.
+    """
+
+    def __init__(self, ledger):
+        self._ledger = ledger
+        self.games = 0
+        self.wins = 0
+        self.winnings = 0
+
+    def rebuild(self, records):
+        """Recount the game totals from every user record."""
+        self.games = self.wins = self.winnings = 0
+        for record in records:
+            self.games += record.games_played
+            self.wins += record.games_won
+            self.winnings += record.total_winnings
+
+    def record_game(self, winnings):
+        """Count one settled game; ``winnings`` is 0 for a loss."""
+        self.games += 1
+        if winnings > 0:
+            self.wins += 1
+            self.winnings += winnings
+
+    @property
+    def flows(self):
+        """Net points moved by each ledger reason, indexed by reason."""
+        return self._ledger.totals
+
+    @property
+    def circulating(self):
+        """Points currently held by all users together."""
+        return sum(self.flows)
+
+    @property
+    def staked(self):
+        return -(self.flows[BET] + self.flows[BET_LOST])
+
+    @property
+    def paid_out(self):
+        return self.flows[PAYOUT]
+
+    @property
+    def burned(self):
+        """Points burned by losses: stakes of rounds that paid nothing."""
+        return -self.flows[BET_LOST]
+
+    @property
+    def house_net(self):
+        """Everything staked minus everything paid out. Negative when the
+        games have paid out more than they took in (dice does, on average)."""
+        return self.staked - self.paid_out
+
+    @property
+    def minted(self):
+        """Points created outside games, by source."""
+        return {
+            'Signup bonuses': self.flows[SIGNUP],
+            'Check-ins': self.flows[CHECKIN],
+            'Referrals': self.flows[REFERRAL],
+            'Giveaways': self.flows[GIVEAWAY],
+            'Owner added': self.flows[ADMIN_ADD],
+            'Owner removed': self.flows[ADMIN_REMOVE],
+        }
+
+    def to_dict(self):
+        """Plain-data form, for merging totals from several shards."""
+        return {
+            'games': self.games,
+            'wins': self.wins,
+            'winnings': self.winnings,
+            'flows': list(self.flows),
+        }
+
+    @classmethod
+    def combine(cls, parts):
+        """Build one Economy from several ``to_dict`` results."""
+        combined = cls(_FixedFlows([sum(column) for column in zip(*(part['flows'] for part in parts))]))
+        for part in parts:
+            combined.games += part['games']
+            combined.wins += part['wins']
+            combined.winnings += part['winnings']
+        return combined
+
+
+class _FixedFlows:
+    """Stands in for a ledger when the flow totals are already known."""
+
+    def __init__(self, totals):
+        self.totals = totals
@@ -0,0 +1,69 @@
+"""Payout rules of the games, shared by the bot and the simulator.
+
+Each game is a table of equally likely outcomes and the multiplier of the
+bet each one pays (0 loses the bet, 2 pays it back twice). The bot draws
+an outcome and pays bet * multiplier; ``simulation.py`` samples the same
+tables, so a change here changes both.
+"""
+import itertools
+import random
+
+
+class Game:
+    """One game: its outcomes, what each pays, and the allowed bets."""
+
+    __slots__ = ('name', 'outcomes', 'multipliers', 'min_bet', 'max_bet', 'bets')
+
+    def __init__(self, name, payouts, min_bet, max_bet, bets):
+        self.name = name
+        self.outcomes = tuple(payouts)
+        self.multipliers = tuple(payouts[outcome] for outcome in self.outcomes)
+        self.min_bet = min_bet
+        self.max_bet = max_bet
+        self.bets = bets  # Offered as buttons in private chat
+
+    def draw(self, rng=random):
+        """A random outcome and its multiplier."""
+        index = rng.randrange(len(self.outcomes))
+        return self.outcomes[index], self.multipliers[index]
+
+    def multiplier(self, outcome):
+        return self.multipliers[self.outcomes.index(outcome)]
+
+    @property
+    def rtp(self):
+        """Return to player: the average multiplier, exactly."""
+        return sum(self.multipliers) / len(self.multipliers)
+
+    def allows(self, bet):
+        return self.min_bet <= bet <= self.max_bet
+
+
+# Roll 1-3 loses, 4-5 pays double, 6 pays triple
+DICE = Game(
+    'dice',
+    {1: 0, 2: 0, 3: 0, 4: 2, 5: 2, 6: 3},
+    min_bet=10, max_bet=100, bets=(10, 25, 50, 100)
+)
+
+# The outcome is whether the coin lands on the side the player called
+COIN_SIDES = ('heads', 'tails')
+COIN = Game(
+    'coin',
+    {True: 2, False: 0},
+    min_bet=5, max_bet=50, bets=(10, 25, 50)
+)
+
+# Three reels of four symbols; three of a kind pays by symbol
+SLOT_SYMBOLS = ('🍒', '🍋', '💎', '7️⃣')
+SLOT_PAYOUTS = {'🍒': 3, '🍋': 5, '💎': 10, '7️⃣': 20}
+SLOTS = Game(
+    'slots',
+    {
+        reels: SLOT_PAYOUTS[reels[0]] if reels[0] == reels[1] == reels[2] else 0
+        for reels in itertools.product(SLOT_SYMBOLS, repeat=3)
+    },
+    min_bet=20, max_bet=200, bets=(20, 50, 100, 200)
+)
+
+GAMES = {game.name: game for game in (DICE, COIN, SLOTS)}
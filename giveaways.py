@@ -0,0 +1,194 @@
+import logging
+import random
+import sqlite3
+
+from writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS giveaways (
+    giveaway_id TEXT PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    creator_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS giveaway_entries (
+    giveaway_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (giveaway_id, user_id)
+) WITHOUT ROWID;
+"""
+
+
+class Participants:
+    """Giveaway entrants.
+
+    A set answers "already joined?" in O(1) and a list in join order lets a
+    winner be drawn uniformly in O(1); entries are never removed, so the two
+    never disagree.
+    """
+
+    __slots__ = ('_members', '_order')
+
+    def __init__(self, user_ids=()):
+        self._members = set()
+        self._order = []
+        for user_id in user_ids:
+            self.add(user_id)
+
+    def add(self, user_id):
+        """Add a user; returns False if they had already joined."""
+        if user_id in self._members:
+            return False
+        self._members.add(user_id)
+        self._order.append(user_id)
+        return True
+
+    def choice(self, rng=random):
+        return rng.choice(self._order)
+
+    def __contains__(self, user_id):
+        return user_id in self._members
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+
+class Giveaway:
+    """One running giveaway; ``end_time`` is in epoch seconds."""
+
+    __slots__ = ('giveaway_id', 'amount', 'end_time', 'creator_id', 'chat_id', 'participants')
+
+    def __init__(self, giveaway_id, amount, end_time, creator_id, chat_id, participants=None):
+        self.giveaway_id = giveaway_id
+        self.amount = amount
+        self.end_time = end_time
+        self.creator_id = creator_id
+        self.chat_id = chat_id
+        self.participants = participants if participants is not None else Participants()
+
+
+class GiveawayBook(WriteBehind):
+    """Running giveaways kept in memory and persisted to SQLite.
+
+    Works like ``UserStore``: handlers change giveaways in memory and a
+    background task writes new giveaways, joins and removals every
+    ``flush_interval`` seconds in one transaction.
+    """
+
+    write_errors = (sqlite3.Error,)
+    description = 'giveaway changes'
+
+    def __init__(self, path, flush_interval=0.25):
+        super().__init__(flush_interval)
+        self.path = path
+        self._giveaways = {}
+        self._created = []
+        self._joined = []
+        self._removed = []
+        self._conn = None
+
+    # ---------- lifecycle ----------
+
+    def open(self):
+        """Open the database and load every running giveaway."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        for row in self._conn.execute(
+            "SELECT giveaway_id, amount, end_time, creator_id, chat_id FROM giveaways"
+        ):
+            self._giveaways[row[0]] = Giveaway(*row)
+        for giveaway_id, user_id in self._conn.execute(
+            "SELECT giveaway_id, user_id FROM giveaway_entries"
+        ):
+            giveaway = self._giveaways.get(giveaway_id)
+            if giveaway is not None:
+                giveaway.participants.add(user_id)
+
+        logger.info(f"Loaded {len(self._giveaways)} giveaways from {self.path}")
+
+    async def close(self):
+        """Stop the flush task and write out anything still pending."""
+        await super().close()
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    # ---------- giveaways ----------
+
+    def create(self, giveaway_id, amount, end_time, creator_id, chat_id):
+        giveaway = Giveaway(giveaway_id, amount, end_time, creator_id, chat_id)
+        self._giveaways[giveaway_id] = giveaway
+        self._created.append((giveaway_id, amount, end_time, creator_id, chat_id))
+        return giveaway
+
+    def join(self, giveaway_id, user_id):
+        """Enter a user; returns False if they had already joined."""
+        if not self._giveaways[giveaway_id].participants.add(user_id):
+            return False
+        self._joined.append((giveaway_id, user_id))
+        return True
+
+    def remove(self, giveaway_id):
+        """Forget a finished giveaway and its entries."""
+        giveaway = self._giveaways.pop(giveaway_id)
+        self._removed.append((giveaway_id,))
+        return giveaway
+
+    def get(self, giveaway_id, default=None):
+        return self._giveaways.get(giveaway_id, default)
+
+    def __contains__(self, giveaway_id):
+        return giveaway_id in self._giveaways
+
+    def __len__(self):
+        return len(self._giveaways)
+
+    def __iter__(self):
+        return iter(self._giveaways)
+
+    def values(self):
+        return self._giveaways.values()
+
+    def items(self):
+        return self._giveaways.items()
+
+    # ---------- persistence ----------
+
+    def _take_pending(self):
+        pending = (self._created, self._joined, self._removed)
+        self._created, self._joined, self._removed = [], [], []
+        return pending
+
+    def _restore_pending(self, pending):
+        created, joined, removed = pending
+        self._created[:0] = created
+        self._joined[:0] = joined
+        self._removed[:0] = removed
+
+    def _write(self, pending):
+        # Applied in this order, a giveaway created and removed within one
+        # flush leaves nothing behind
+        created, joined, removed = pending
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO giveaways VALUES (?, ?, ?, ?, ?)", created
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO giveaway_entries VALUES (?, ?)", joined
+            )
+            self._conn.executemany("DELETE FROM giveaways WHERE giveaway_id = ?", removed)
+            self._conn.executemany("DELETE FROM giveaway_entries WHERE giveaway_id = ?", removed)
+
+    def _has_pending(self):
+        return bool(self._created or self._joined or self._removed)
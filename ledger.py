@@ -0,0 +1,297 @@
+import asyncio
+import glob
+import logging
+import os
+import struct
+import time
+
+from writebehind import WriteBehind, in_thread
+
+logger = logging.getLogger(__name__)
+
+# Reasons a balance can change; stored as one byte per record
+OPENING = 0       # Balance carried over from before the ledger existed
+SIGNUP = 1
+BET = 2
+PAYOUT = 3
+CHECKIN = 4
+REFERRAL = 5
+ADMIN_ADD = 6
+ADMIN_REMOVE = 7
+GIVEAWAY = 8
+BET_LOST = 9      # Stake of a round that paid nothing
+
+REASON_NAMES = {
+    OPENING: 'opening',
+    SIGNUP: 'signup',
+    BET: 'bet',
+    PAYOUT: 'payout',
+    CHECKIN: 'checkin',
+    REFERRAL: 'referral',
+    ADMIN_ADD: 'admin_add',
+    ADMIN_REMOVE: 'admin_remove',
+    GIVEAWAY: 'giveaway',
+    BET_LOST: 'bet_lost',
+}
+
+# seq, unix time, user id, delta, reason
+RECORD = struct.Struct('<QIqqB')
+
+# Per-reason running totals are stored in fixed slots, with room to grow
+REASON_SLOTS = 16
+
+# magic, seq, number of balances; followed by the per-reason totals and
+# then (user id, balance) pairs. GLS1 snapshots predate the totals block.
+SNAPSHOT_HEADER = struct.Struct('<4sQQ')
+SNAPSHOT_TOTALS = struct.Struct(f'<{REASON_SLOTS}q')
+SNAPSHOT_ENTRY = struct.Struct('<qq')
+SNAPSHOT_MAGIC = b'GLS2'
+SNAPSHOT_MAGIC_V1 = b'GLS1'
+
+
+def _read_records(path):
+    """Yield (seq, ts, user_id, delta, reason) from a log file.
+
+    A torn record at the end of the file (crash mid-write) is ignored.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    usable = len(data) - len(data) % RECORD.size
+    yield from RECORD.iter_unpack(memoryview(data)[:usable])
+
+
+class Ledger(WriteBehind):
+    """Append-only log of every balance change, with snapshot compaction.
+
+    ``append`` only encodes the record into a memory buffer; a background
+    task writes the buffer out every ``flush_interval`` seconds. Once
+    ``snapshot_every`` records have been written, the writer thread replays
+    the previous snapshot and the log into a new snapshot and rotates the
+    log, so a restart only has to read the snapshot plus a bounded tail.
+    The newest ``keep_segments`` rotated logs are kept for looking up a
+    user's history.
+
+    ``totals`` holds the net amount moved by each reason since the ledger
+    began; it is saved with every snapshot so it survives restarts.
+    """
+
+    description = 'ledger records'
+
+    def __init__(self, directory, flush_interval=0.25,
+                 snapshot_every=100_000, keep_segments=10):
+        super().__init__(flush_interval)
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.keep_segments = keep_segments
+        self.seq = 0
+        self.totals = [0] * REASON_SLOTS
+        self._pending = bytearray()
+        self._since_snapshot = 0
+        self._log = None
+
+    @property
+    def log_path(self):
+        return os.path.join(self.directory, 'ledger.log')
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, 'ledger.snapshot')
+
+    # ---------- lifecycle ----------
+
+    def load(self):
+        """Rebuild balances from the latest snapshot and the log tail.
+
+        Returns a dict of user id -> balance as of the last written record.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.perf_counter()
+        balances, totals, snapshot_seq, seq, replayed = self._replay()
+        self.seq = seq
+        self.totals = totals
+        self._since_snapshot = replayed
+
+        # Drop any torn record so new appends start on a record boundary
+        self._open_log()
+        size = self._log.tell()
+        if size % RECORD.size:
+            self._log.truncate(size - size % RECORD.size)
+
+        logger.info(
+            f"Ledger loaded: snapshot at seq {snapshot_seq}, replayed {replayed} records "
+            f"for {len(balances)} balances in {time.perf_counter() - start:.2f}s"
+        )
+        return balances
+
+    def _open_log(self):
+        # Unbuffered, so a failed write leaves nothing behind to retry later
+        self._log = open(self.log_path, 'ab', buffering=0)
+
+    def read_balances(self):
+        """Balances as of the last written record, without opening the log."""
+        return self._replay()[0]
+
+    def seed(self, balances):
+        """Start this (empty) ledger from opening balances, e.g. a shard's
+        share of an existing ledger."""
+        os.makedirs(self.directory, exist_ok=True)
+        totals = [0] * REASON_SLOTS
+        totals[OPENING] = sum(balances.values())
+        self._write_snapshot(0, totals, list(balances.items()))
+
+    def _replay(self):
+        """(balances, totals, snapshot seq, last seq, records replayed)."""
+        balances = {}
+        totals = [0] * REASON_SLOTS
+        snapshot_seq = 0
+
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = f.read()
+            magic, snapshot_seq, count = SNAPSHOT_HEADER.unpack_from(data)
+            offset = SNAPSHOT_HEADER.size
+            if magic == SNAPSHOT_MAGIC:
+                totals = list(SNAPSHOT_TOTALS.unpack_from(data, offset))
+                offset += SNAPSHOT_TOTALS.size
+            elif magic != SNAPSHOT_MAGIC_V1:
+                raise ValueError(f"bad snapshot magic {magic!r}")
+            body = memoryview(data)[offset:offset + count * SNAPSHOT_ENTRY.size]
+            balances = dict(SNAPSHOT_ENTRY.iter_unpack(body))
+            if magic == SNAPSHOT_MAGIC_V1:
+                # No flow history before this snapshot; count it as opening
+                totals[OPENING] = sum(balances.values())
+        except FileNotFoundError:
+            pass
+
+        last_seq = snapshot_seq
+        replayed = 0
+        for seq, _, user_id, delta, reason in _read_records(self.log_path):
+            # Covered by the snapshot, or a record written twice
+            if seq <= last_seq:
+                continue
+            balances[user_id] = balances.get(user_id, 0) + delta
+            totals[reason] += delta
+            last_seq = seq
+            replayed += 1
+        return balances, totals, snapshot_seq, last_seq, replayed
+
+    async def close(self):
+        """Stop the write task and write out anything still pending."""
+        await super().close()
+        if self._log is not None:
+            self.flush()
+            self._log.close()
+            self._log = None
+
+    # ---------- recording ----------
+
+    def append(self, user_id, delta, reason):
+        """Record a balance change. Never blocks on disk."""
+        self.seq += 1
+        self.totals[reason] += delta
+        self._pending += RECORD.pack(self.seq, int(time.time()), user_id, delta, reason)
+
+    def _has_pending(self):
+        return bool(self._pending)
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, bytearray()
+        return pending
+
+    def _restore_pending(self, pending):
+        self._pending[:0] = pending
+
+    def _write(self, data):
+        if not data:
+            return
+        if self._log.closed:
+            # A compaction could not reopen the log; try again here, so a
+            # failure is an OSError that is retried like any other
+            self._open_log()
+        # Appends always land at the end, whatever the file position says
+        start = os.fstat(self._log.fileno()).st_size
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[self._log.write(view):]
+            os.fsync(self._log.fileno())
+        except OSError:
+            # Cut off whatever did reach the file, so the retry writes each
+            # record exactly once
+            self._log.truncate(start)
+            raise
+        self._since_snapshot += len(data) // RECORD.size
+
+    def _write_snapshot(self, seq, totals, balances):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, seq, len(balances)))
+            f.write(SNAPSHOT_TOTALS.pack(*totals))
+            f.write(b''.join(SNAPSHOT_ENTRY.pack(uid, points) for uid, points in balances))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _compact(self):
+        """Save the balances as of the last written record and rotate the
+        log they cover. Only the flusher writes the log, so while it waits
+        for this the file holds exactly the records up to its cut."""
+        balances, totals, _, seq, _ = self._replay()
+        balances = list(balances.items())
+        self._write_snapshot(seq, totals, balances)
+
+        # From here on the snapshot covers every record in the log, so if
+        # rotating fails, appending to the same log is still safe: replay
+        # skips what the snapshot already holds
+        self._log.close()
+        try:
+            if self.keep_segments > 0:
+                os.replace(self.log_path, os.path.join(self.directory, f"ledger-{seq:020d}.log"))
+            else:
+                os.remove(self.log_path)
+        finally:
+            self._open_log()
+        self._since_snapshot = 0
+        logger.info(f"Ledger snapshot written at seq {seq} ({len(balances)} balances)")
+
+        if self.keep_segments > 0:
+            for old in self._segments()[:-self.keep_segments]:
+                try:
+                    os.remove(old)
+                except OSError as e:
+                    # Only history lookups read old segments
+                    logger.warning(f"Could not remove old ledger segment {old}: {e}")
+
+    async def _run_flusher(self):
+        # Only this task writes the log, so a compaction never overlaps a
+        # write
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._has_pending() or not await self._flush_in_thread():
+                continue
+            if self._since_snapshot >= self.snapshot_every:
+                try:
+                    await in_thread(self._compact)
+                except OSError as e:
+                    logger.error(f"Ledger snapshot failed: {e}")
+
+    # ---------- queries ----------
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'ledger-*.log')))
+
+    def history(self, user_id, limit=20):
+        """Return the user's most recent records, oldest first.
+
+        Covers the retained rotated logs plus the current one. Each entry is
+        a (seq, timestamp, delta, reason name) tuple.
+        """
+        entries = []
+        for path in self._segments() + [self.log_path]:
+            for seq, ts, uid, delta, reason in _read_records(path):
+                if uid == user_id:
+                    entries.append((seq, ts, delta, REASON_NAMES.get(reason, str(reason))))
+        return entries[-limit:]
@@ -0,0 +1,804 @@
+"""End-to-end load tests of the bot against a local fake Bot API server.
+
+Run with ``python loadtest.py <name>``; ``python loadtest.py --help`` lists
+them. The bot runs unchanged as a ``bot.py`` subprocess pointed at the fake
+server through ``BOT_API_URL``, so nothing here talks to Telegram.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_TOKEN = '123456:LOADTEST'
+BOT_USER = {
+    'id': 123456,
+    'is_bot': True,
+    'first_name': 'Gamely',
+    'username': 'gamely_loadtest_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+FIRST_USER_ID = 10_000_000
+OWNER_ID = 9_999_999
+GROUP_CHAT = {'id': -1002000000001, 'type': 'supergroup', 'title': 'Load test'}
+# Group games are spread over several groups, as in real traffic
+GAME_GROUPS = [
+    {'id': -1002000000100 - n, 'type': 'supergroup', 'title': f"Players {n}"} for n in range(20)
+]
+
+
+def percentiles(samples):
+    """p50/p95/p99 of a list of latencies, in milliseconds."""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request; returns (method, path, headers, body) or None at EOF."""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', '0')))
+    return method, target, headers, body
+
+
+def write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"\r\n".encode() + body
+    )
+
+
+def parse_parameters(headers, body):
+    """Bot API parameters from a JSON or form-encoded request body.
+
+    PTB sends form fields whose values are JSON unless they are plain
+    strings, so each value is decoded as JSON where possible.
+    """
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if not content_type.startswith('application/x-www-form-urlencoded'):
+        return {}  # Multipart uploads; the files are not needed here
+    params = {}
+    for name, value in parse_qsl(body.decode(), keep_blank_values=True):
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+class FakeBotAPI:
+    """Just enough of the Bot API to run the bot against.
+
+    Updates are fed in with ``push``. They are handed out by ``getUpdates``
+    like Telegram does, or POSTed to the webhook once the bot has called
+    ``setWebhook``. The bot's first response to an update marks its end:
+    the answer to a button press, the reply quoting a group message, or the
+    first message to a private chat. Every other Bot API call takes
+    ``latency`` seconds (plus up to ``jitter``), like a real round trip.
+    """
+
+    def __init__(self, webhook_connections=40, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.port = None
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_set = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.calls = 0
+        self.errors = 0
+        self.giveaway_ids = []  # From the join buttons the bot has sent
+        self.messages = []  # (chat_id, text) of every message sent or edited
+        self._server = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._queue = []  # Updates waiting for getUpdates
+        self._arrived = asyncio.Condition()
+        self._webhook_slots = asyncio.Semaphore(webhook_connections)
+        self._waiting = {}  # Reply key -> (push time, future)
+        self._connections = {}  # Handler task -> its writer
+        self._closing = False
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """Stop serving. Long polls return empty and open connections are
+        closed, so every handler ends by itself rather than being cancelled
+        when the loop shuts down."""
+        self._server.close()
+        self._closing = True
+        async with self._arrived:
+            self._arrived.notify_all()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    # ---------- updates ----------
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+
+    def message_update(self, user_id, text='/start', chat=None):
+        """A message from ``user_id`` as Telegram would send it; private
+        unless ``chat`` is given."""
+        user = self.user(user_id)
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': chat or {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback_update(self, user_id, data, chat=None):
+        """A press of a button with ``data`` under one of the bot's messages."""
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': chat or {'id': user_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': "🎮",
+        }
+        query = {
+            'id': str(next(self._update_ids) * 7919),
+            'from': self.user(user_id),
+            'chat_instance': str(message['chat']['id']),
+            'message': message,
+            'data': data,
+        }
+        return {'update_id': next(self._update_ids), 'callback_query': query}
+
+    @staticmethod
+    def _reply_key(update):
+        if 'callback_query' in update:
+            return ('callback', update['callback_query']['id'])
+        message = update['message']
+        if message['chat']['type'] == 'private':
+            return ('chat', message['chat']['id'])
+        return ('reply', message['chat']['id'], message['message_id'])
+
+    async def push(self, update, timeout=None):
+        """Deliver an update and wait for the bot's response to it.
+
+        Returns the seconds from delivery to response, or None if there was
+        none within ``timeout`` (e.g. a throttled tap).
+        """
+        key = self._reply_key(update)
+        reply = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        self._waiting[key] = (started, reply)
+        if self.webhook_url:
+            await self._post_webhook(update)
+        else:
+            async with self._arrived:
+                self._queue.append(update)
+                self._arrived.notify_all()
+        try:
+            return await asyncio.wait_for(reply, timeout)
+        except asyncio.TimeoutError:
+            self._waiting.pop(key, None)
+            return None
+
+    async def _post_webhook(self, update):
+        url = urlsplit(self.webhook_url)
+        body = json.dumps(update).encode()
+        async with self._webhook_slots:
+            reader, writer = await asyncio.open_connection(url.hostname, url.port)
+            try:
+                writer.write(
+                    f"POST {url.path or '/'} HTTP/1.1\r\n"
+                    f"Host: {url.netloc}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {self.webhook_secret or ''}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: close\r\n"
+                    f"\r\n".encode() + body
+                )
+                await writer.drain()
+                status = (await reader.readline()).decode('latin-1')
+                if ' 200 ' not in status:
+                    self.errors += 1
+            finally:
+                writer.close()
+
+    def _replied(self, *keys):
+        for key in keys:
+            waiting = self._waiting.pop(key, None)
+            if waiting is not None:
+                started, reply = waiting
+                if not reply.done():
+                    reply.set_result(time.perf_counter() - started)
+                return
+
+    # ---------- Bot API ----------
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while not self._closing:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                _, target, headers, body = request
+                method = target.rsplit('/', 1)[-1].split('?')[0]
+                params = parse_parameters(headers, body)
+                self.calls += 1
+                result = await self._call(method.lower(), params)
+                write_response(writer, '200 OK', {'ok': True, 'result': result})
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _call(self, method, params):
+        if method != 'getupdates' and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if method == 'getme':
+            return BOT_USER
+        if method == 'getupdates':
+            return await self._get_updates(params)
+        if method == 'setwebhook':
+            self.webhook_url = params.get('url') or None
+            self.webhook_secret = params.get('secret_token')
+            self.webhook_set.set()
+            return True
+        if method == 'deletewebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getwebhookinfo':
+            return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'getchat':
+            username = str(params.get('chat_id', '')).lstrip('@')
+            return {'id': -1001000000001, 'type': 'channel', 'title': username, 'username': username}
+        if method == 'getchatmember':
+            user = {'id': int(params.get('user_id', 0)), 'is_bot': False, 'first_name': 'Member'}
+            return {'status': 'member', 'user': user}
+        if method == 'answercallbackquery':
+            self._replied(('callback', str(params.get('callback_query_id'))))
+            return True
+        if method.startswith(('send', 'copy', 'forward', 'edit')):
+            chat_id = params.get('chat_id')
+            if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+                chat_id = int(chat_id)
+            reply_to = params.get('reply_to_message_id') or (params.get('reply_parameters') or {}).get('message_id')
+            self._replied(('reply', chat_id, reply_to), ('chat', chat_id))
+            self.messages.append((chat_id, params.get('text') or params.get('caption') or ''))
+            self._note_giveaway(params.get('reply_markup'))
+            chat_type = 'private' if isinstance(chat_id, int) and chat_id > 0 else 'supergroup'
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': chat_type},
+                'text': params.get('text', ''),
+            }
+        return True
+
+    def _note_giveaway(self, markup):
+        if not isinstance(markup, dict):
+            return
+        for row in markup.get('inline_keyboard', ()):
+            for button in row:
+                data = button.get('callback_data') or ''
+                if data.startswith('giveaway_'):
+                    self.giveaway_ids.append(data[len('giveaway_'):])
+
+    async def _get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        async with self._arrived:
+            self._queue = [u for u in self._queue if u['update_id'] >= offset]
+            if not self._queue and timeout:
+                try:
+                    await asyncio.wait_for(
+                        self._arrived.wait_for(lambda: self._queue or self._closing), timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            updates = self._queue[:int(params.get('limit') or 100)]
+        return updates
+
+
+# ==================== BOT PROCESS ====================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_bot(api, directory, webhook=False, extra_env=None, log=None):
+    """Run bot.py against the fake API; returns the subprocess. Its output
+    goes to the file ``log`` if given, and is discarded otherwise."""
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': BOT_TOKEN,
+        'BOT_API_URL': api.url,
+        'DB_PATH': os.path.join(directory, 'loadtest.db'),
+        'LEDGER_DIR': os.path.join(directory, 'ledger'),
+        'WEBHOOK_URL': '',
+        'WORKERS': '0',
+        'OWNER_ID': str(OWNER_ID),
+    })
+    if webhook:
+        port = free_port()
+        env.update({'WEBHOOK_URL': f"http://127.0.0.1:{port}", 'PORT': str(port)})
+    env.update(extra_env or {})
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen(
+        [sys.executable, os.path.join(here, 'bot.py')],
+        cwd=directory,
+        env=env,
+        stdout=log or subprocess.DEVNULL,
+        stderr=subprocess.STDOUT if log else subprocess.DEVNULL
+    )
+
+
+async def stop_bot(process):
+    process.terminate()
+    try:
+        await asyncio.to_thread(process.wait, 15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_until_ready(api, process, webhook, timeout=30):
+    """Wait until the bot is polling or its webhook server answers."""
+    deadline = time.monotonic() + timeout
+    ready = api.webhook_set if webhook else api.polling
+    while not ready.is_set():
+        if process.poll() is not None:
+            raise RuntimeError(f"bot.py exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("bot.py did not start in time")
+        await asyncio.sleep(0.05)
+    if webhook:
+        # setWebhook is called just before the server starts listening
+        url = urlsplit(api.webhook_url)
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(url.hostname, url.port)
+                writer.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Webhook server did not start in time")
+                await asyncio.sleep(0.05)
+
+
+async def measure(api, count, rate, first_user_id):
+    """Push ``count`` /start updates from new users at ``rate`` per second.
+
+    Returns the per-update latencies and the elapsed wall time.
+    """
+    interval = 1 / rate if rate else 0
+    started = time.perf_counter()
+    pushes = []
+    for n in range(count):
+        user_id = first_user_id + n
+        pushes.append(asyncio.create_task(api.push(api.message_update(user_id))))
+        if interval:
+            await asyncio.sleep(max(0.0, started + (n + 1) * interval - time.perf_counter()))
+    latencies = await asyncio.gather(*pushes)
+    return list(latencies), time.perf_counter() - started
+
+
+# ==================== TRAFFIC ====================
+
+# What players do, and how often relative to each other
+TRAFFIC_MIX = {
+    'start': 10,
+    'game_tap': 45,
+    'checkin': 10,
+    'group_dice': 20,
+    'giveaway_join': 15,
+}
+
+GAME_TAPS = ('dice_10', 'dice_25', 'coin_10_heads', 'coin_25_tails', 'slots_20')
+
+
+def make_update(api, kind, user_id, rng=random):
+    """One update of the given kind from ``user_id``."""
+    if kind == 'start':
+        return api.message_update(user_id, '/start')
+    if kind == 'game_tap':
+        return api.callback_update(user_id, rng.choice(GAME_TAPS))
+    if kind == 'checkin':
+        return api.message_update(user_id, '/checkin')
+    if kind == 'group_dice':
+        return api.message_update(user_id, f"/dice {rng.choice((10, 20, 50))}", chat=rng.choice(GAME_GROUPS))
+    if kind == 'giveaway_join':
+        return api.callback_update(user_id, f"giveaway_{rng.choice(api.giveaway_ids)}", chat=GROUP_CHAT)
+    raise ValueError(f"Unknown update kind {kind!r}")
+
+
+async def generate(api, rate, duration, users, timeout=10.0, mix=TRAFFIC_MIX, seed=None):
+    """Send a mix of updates at ``rate`` per second for ``duration`` seconds.
+
+    Players act one update at a time, as people waiting for the bot do: a
+    player with an update in flight is not picked again until it's
+    answered. The player idle the longest goes next, so all ``users``
+    take turns rather than the few most recently answered. Returns
+    {kind: [latency or None, ...]} and the seconds spent sending.
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    players = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+    rng.shuffle(players)
+    idle = collections.deque(players)
+    results = {kind: [] for kind in kinds}
+    pending = set()
+
+    async def act(kind, user_id):
+        try:
+            results[kind].append(await api.push(make_update(api, kind, user_id, rng), timeout))
+        finally:
+            idle.append(user_id)
+
+    interval = 1 / rate
+    started = time.perf_counter()
+    total = int(rate * duration)
+    for n in range(total):
+        if idle:
+            kind = rng.choices(kinds, weights)[0]
+            if kind == 'giveaway_join' and not api.giveaway_ids:
+                kind = 'start'
+            task = asyncio.create_task(act(kind, idle.popleft()))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.sleep(max(0.0, started + (n + 1) * interval - time.perf_counter()))
+    sending = time.perf_counter() - started
+    if pending:
+        await asyncio.wait(pending)
+    return results, sending
+
+
+# ==================== SMOKE TEST ====================
+
+async def sent_to(api, chat_id, text, since, timeout=10.0):
+    """Wait for a message containing ``text`` to ``chat_id``, among those
+    sent after the first ``since``; returns whether one came."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if any(chat == chat_id and text in sent for chat, sent in api.messages[since:]):
+            return True
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+
+
+async def smoke_checks(api):
+    """Owner commands, referrals, giveaways, a forged bet and a few dice
+    rounds, each checked by what the bot sends back; yields (check, passed)."""
+    player, referred, newcomer = FIRST_USER_ID, FIRST_USER_ID + 1, FIRST_USER_ID + 2
+    ghost = 424242  # Never uses the bot
+    owner_chat = {'id': OWNER_ID, 'type': 'private', 'first_name': 'Owner'}
+
+    async def check(update, chat_id, text):
+        since = len(api.messages)
+        await api.push(update, 10)
+        return await sent_to(api, chat_id, text, since)
+
+    yield '/start', await check(api.message_update(player, '/start'), player, "Welcome to GAMELY")
+    yield '/addcoins @user', await check(
+        api.message_update(OWNER_ID, f"/addcoins @user{player} 77", owner_chat), OWNER_ID, "New balance: 177"
+    )
+    yield '/removecoins @user', await check(
+        api.message_update(OWNER_ID, f"/removecoins @user{player} 7", owner_chat), OWNER_ID, "Removed 7"
+    )
+    await asyncio.sleep(0.5)  # /ledger reads what has been written out (every DB_FLUSH_INTERVAL)
+    yield '/ledger', await check(
+        api.message_update(OWNER_ID, f"/ledger {player}", owner_chat), OWNER_ID, "Current balance: 170"
+    )
+
+    since = len(api.messages)
+    welcomed = await check(api.message_update(referred, f"/start {player}"), referred, "Welcome to GAMELY")
+    yield 'referral welcome', welcomed
+    yield 'referrer credited', await sent_to(api, player, "You earned 50 points", since)
+    since = len(api.messages)
+    await check(api.message_update(referred, f"/start {player}"), referred, "Welcome to GAMELY")
+    yield 'repeat referral not paid', not await sent_to(api, player, "You earned", since, timeout=0.5)
+    await check(api.message_update(newcomer, f"/start {ghost}"), newcomer, "Welcome to GAMELY")
+    await asyncio.sleep(0.5)
+    yield 'unknown referrer not created', await check(
+        api.message_update(OWNER_ID, f"/ledger {ghost}", owner_chat), OWNER_ID, "No ledger entries"
+    )
+
+    # The join button comes in a second message, after the confirmation
+    if not await check(api.message_update(OWNER_ID, '/giveaway 500 10', chat=GROUP_CHAT), GROUP_CHAT['id'], "enter"):
+        yield '/giveaway', False
+        return
+    giveaway_id = api.giveaway_ids[-1]
+    yield 'join giveaway', await check(
+        api.callback_update(player, f"giveaway_{giveaway_id}", chat=GROUP_CHAT), GROUP_CHAT['id'], "joined"
+    )
+    since = len(api.messages)
+    ended = await check(
+        api.callback_update(OWNER_ID, f"endgiveaway_{giveaway_id}", chat=GROUP_CHAT), GROUP_CHAT['id'], "WINNER"
+    )
+    yield 'end giveaway', ended
+    yield 'winner paid', await sent_to(api, player, "new balance: 720", since)
+    yield 'forged bet refused', await check(api.callback_update(player, 'dice_0'), player, "Bet must be between")
+
+    # Only the newcomer plays, within THROTTLE_USER_BURST: every lost stake is burned
+    rounds = []
+    for _ in range(5):
+        since = len(api.messages)
+        await check(api.callback_update(newcomer, 'dice_10'), newcomer, "DICE ROLL RESULT")
+        rounds += [text for chat, text in api.messages[since:] if chat == newcomer and "DICE ROLL RESULT" in text]
+    losses = sum("You lost" in text for text in rounds)
+    if not await check(api.message_update(OWNER_ID, '/stats', owner_chat), OWNER_ID, "Burned by Losses"):
+        yield '/stats', False
+        return
+    stats = next(text for chat, text in reversed(api.messages) if chat == OWNER_ID and "Burned by Losses" in text)
+    figures = {name: int(value) for name, value in re.findall(r"• ([A-Za-z ]+): ([+-]?\d+)", stats)}
+    yield 'losses burned', (
+        len(rounds) == 5 and figures['Staked'] == 50 and figures['Burned by Losses'] == 10 * losses
+        and figures['House Net'] == figures['Staked'] - figures['Paid Out']
+    )
+
+
+async def run_smoke(args):
+    workers = args.workers or 0
+    api = await FakeBotAPI().start()
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory, open(os.path.join(directory, 'bot.log'), 'w+') as log:
+        process = start_bot(api, directory, extra_env={'WORKERS': str(workers)}, log=log)
+        try:
+            await wait_until_ready(api, process, webhook=False)
+            async for name, passed in smoke_checks(api):
+                failed += not passed
+                print(f"{'ok' if passed else 'FAILED':>6}  {name}")
+        finally:
+            await stop_bot(process)
+            await api.close()
+        if failed:
+            log.seek(0)
+            print("Bot log (last 40 lines):")
+            print(''.join(log.readlines()[-40:]), end='')
+    print(f"{failed} of the checks failed" if failed else "all checks passed")
+    if failed:
+        sys.exit(1)
+
+
+# ==================== LEDGER ====================
+
+def _failing(func, when):
+    """``func``, but raising OSError for calls whose first argument ``when``
+    accepts."""
+    def wrapper(path, *args, **kwargs):
+        if when(str(path)):
+            raise OSError(f"injected failure for {path}")
+        return func(path, *args, **kwargs)
+    return wrapper
+
+
+class _TornLog:
+    """A ledger log whose second write stores one record and then fails,
+    like a disk filling up mid-write."""
+
+    def __init__(self, log, record_size):
+        self._log = log
+        self._record_size = record_size
+        self._writes = 0
+
+    def write(self, data):
+        self._writes += 1
+        if self._writes == 2:
+            self._log.write(data[:self._record_size])
+            raise OSError("injected failure mid-write")
+        return self._log.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._log, name)
+
+
+async def _ledger_run(directory, fault=None, **options):
+    """Append to a ledger across many flushes and compactions, with
+    ``fault(ledger)`` applied halfway; returns whether it reloads to the
+    balances that were appended."""
+    from ledger import ADMIN_ADD, Ledger
+
+    ledger = Ledger(directory, flush_interval=0.005, snapshot_every=20, **options)
+    ledger.load()
+    ledger.start()
+    expected = collections.Counter()
+    undo = None
+    for i in range(300):
+        user_id = i % 7
+        ledger.append(user_id, i, ADMIN_ADD)
+        expected[user_id] += i
+        if i == 150 and fault is not None:
+            undo = fault(ledger)
+        if i % 10 == 0:
+            await asyncio.sleep(0.01)
+    if undo is not None:
+        undo()
+    await ledger.close()
+    return dict(Ledger(directory).load()) == dict(expected)
+
+
+async def ledger_checks():
+    """Replay and compaction of the coin ledger, including its failure
+    paths; yields (check, passed)."""
+    import ledger as ledger_module
+
+    def patched(name, when):
+        def fault(ledger):
+            real = getattr(ledger_module.os, name)
+            setattr(ledger_module.os, name, _failing(real, when))
+            return lambda: setattr(ledger_module.os, name, real)
+        return fault
+
+    def torn_write(ledger):
+        ledger._log = _TornLog(ledger._log, ledger_module.RECORD.size)
+
+    checks = [
+        ('compaction', None, {}),
+        ('no kept segments', None, {'keep_segments': 0}),
+        ('old segment not removed', patched('remove', lambda path: 'ledger-' in path), {'keep_segments': 1}),
+        ('log not rotated', patched('replace', lambda path: path.endswith('ledger.log')), {}),
+        ('torn write', torn_write, {}),
+    ]
+    for name, fault, options in checks:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                passed = await _ledger_run(directory, fault, **options)
+            except Exception as e:
+                print(f"        {name}: {e!r}")
+                passed = False
+        yield name, passed
+
+
+async def run_ledger(args):
+    failed = 0
+    async for name, passed in ledger_checks():
+        failed += not passed
+        print(f"{'ok' if passed else 'FAILED':>6}  {name}")
+    print(f"{failed} of the checks failed" if failed else "all checks passed")
+    if failed:
+        sys.exit(1)
+
+
+# ==================== LOAD TESTS ====================
+
+async def run_latency(args):
+    modes = ['polling', 'webhook'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        webhook = mode == 'webhook'
+        api = await FakeBotAPI().start()
+        with tempfile.TemporaryDirectory() as directory:
+            process = start_bot(api, directory, webhook=webhook)
+            try:
+                await wait_until_ready(api, process, webhook)
+                await measure(api, args.warmup, args.rate, FIRST_USER_ID)
+                latencies, elapsed = await asyncio.wait_for(
+                    measure(api, args.updates, args.rate, FIRST_USER_ID + args.warmup),
+                    timeout=args.updates / max(args.rate, 1) + 60
+                )
+            finally:
+                await stop_bot(process)
+                await api.close()
+        p50, p95, p99 = percentiles(latencies)
+        print(
+            f"{mode:>8}: {len(latencies)} updates in {elapsed:.1f}s  "
+            f"p50 {p50:.1f}ms  p95 {p95:.1f}ms  p99 {p99:.1f}ms"
+        )
+
+
+async def run_throughput(args):
+    mode = 'polling' if args.mode == 'both' else args.mode
+    webhook = mode == 'webhook'
+    api = await FakeBotAPI(latency=args.api_latency, jitter=args.api_latency / 2).start()
+    with tempfile.TemporaryDirectory() as directory:
+        process = start_bot(api, directory, webhook=webhook, extra_env={
+            'CONCURRENT_UPDATES': str(args.concurrency),
+        })
+        try:
+            await wait_until_ready(api, process, webhook)
+            # The owner opens a giveaway in the group for players to join
+            await api.push(api.message_update(OWNER_ID, '/giveaway 1000 600', chat=GROUP_CHAT), 30)
+            await measure(api, args.warmup, args.rate, FIRST_USER_ID + args.users)
+            results, sending = await generate(api, args.rate, args.duration, args.users, seed=args.seed)
+        finally:
+            await stop_bot(process)
+            await api.close()
+
+    print(
+        f"{mode}, {args.concurrency} concurrent updates, Bot API {args.api_latency * 1000:.0f}ms, "
+        f"target {args.rate:.0f} updates/s for {args.duration:.0f}s, {args.users} players"
+    )
+    print(f"{'kind':<14} {'sent':>6} {'answered':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    answered_all = []
+    for kind, latencies in results.items():
+        answered = [latency for latency in latencies if latency is not None]
+        answered_all.extend(answered)
+        if not latencies:
+            continue
+        p50, p95, p99 = percentiles(answered) if answered else (0.0, 0.0, 0.0)
+        print(f"{kind:<14} {len(latencies):6d} {len(answered):9d} {p50:6.1f}ms {p95:6.1f}ms {p99:6.1f}ms")
+    sent = sum(len(latencies) for latencies in results.values())
+    p50, p95, p99 = percentiles(answered_all) if answered_all else (0.0, 0.0, 0.0)
+    print(f"{'all':<14} {sent:6d} {len(answered_all):9d} {p50:6.1f}ms {p95:6.1f}ms {p99:6.1f}ms")
+    print(
+        f"sent {sent / sending:.0f} updates/s, answered {len(answered_all) / sending:.0f}/s "
+        f"over the {sending:.1f}s of sending; {api.calls} Bot API calls"
+    )
+
+
+LOADTESTS = {
+    'latency': (run_latency, "update-to-reply latency, long polling vs webhook"),
+    'throughput': (run_throughput, "sustained updates/s and latency under a realistic mix"),
+    'smoke': (run_smoke, "owner commands, referrals and giveaways end to end"),
+    'ledger': (run_ledger, "coin ledger replay and compaction, including failed writes and rotations"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('name', choices=sorted(LOADTESTS))
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'both'], default='both')
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=50, help="updates per second")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help="seconds of traffic (throughput)")
+    parser.add_argument('--users', type=int, default=5000, help="distinct players (throughput)")
+    parser.add_argument('--api-latency', type=float, default=0.03, help="seconds per Bot API call (throughput)")
+    parser.add_argument('--concurrency', type=int, default=64, help="CONCURRENT_UPDATES for the bot (throughput)")
+    parser.add_argument('--workers', type=int, default=0, help="WORKERS for the bot (smoke)")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    func, description = LOADTESTS[args.name]
+    print(f"== {args.name}: {description}")
+    asyncio.run(func(args))
+
+
+if __name__ == '__main__':
+    main()
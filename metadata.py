@@ -0,0 +1,86 @@
+import logging
+import time
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+class ChatInfo:
+    """What the bot knows about a chat it looked up by username."""
+
+    __slots__ = ('chat_id', 'title', 'username', 'type')
+
+    def __init__(self, chat_id, title=None, username=None, type=None):
+        self.chat_id = chat_id
+        self.title = title
+        self.username = username
+        self.type = type
+
+    def to_dict(self):
+        return {'chat_id': self.chat_id, 'title': self.title, 'username': self.username, 'type': self.type}
+
+
+class BotMetadata:
+    """Bot API facts that rarely change, looked up once and kept in memory.
+
+    ``refresh`` asks the Bot API for the bot's own user and for every chat
+    in ``chats`` (usernames like ``@channel``); handlers read the cached
+    values instead of calling ``get_me``/``get_chat`` on every update. A
+    lookup that fails keeps the previous value, so a refresh never makes
+    the cache worse.
+    """
+
+    def __init__(self, chats=()):
+        self.chats = list(chats)
+        self.bot_id = None
+        self.bot_username = None
+        self.bot_name = None
+        self.refreshed_at = None  # Epoch seconds of the last full refresh
+        self._chats = {}          # Username as configured -> ChatInfo
+
+    async def refresh(self, bot):
+        """Look everything up again; returns the chats that could not be resolved."""
+        me = await bot.get_me()
+        self.bot_id = me.id
+        self.bot_username = me.username
+        self.bot_name = me.first_name
+
+        failed = []
+        for reference in self.chats:
+            try:
+                chat = await bot.get_chat(reference)
+            except TelegramError as e:
+                logger.warning(f"Could not look up chat {reference}: {e}")
+                failed.append(reference)
+                continue
+            self._chats[reference] = ChatInfo(chat.id, chat.title, chat.username, chat.type)
+
+        self.refreshed_at = int(time.time())
+        return failed
+
+    def chat(self, reference):
+        """Cached ChatInfo for a configured chat, or None if never resolved."""
+        return self._chats.get(reference)
+
+    def chat_id(self, reference):
+        """Chat id for a configured chat; falls back to the reference itself,
+        which the Bot API also accepts for public chats."""
+        info = self._chats.get(reference)
+        return info.chat_id if info is not None else reference
+
+    @property
+    def bot_link(self):
+        return f"https://t.me/{self.bot_username}"
+
+    def referral_link(self, user_id):
+        return f"{self.bot_link}?start={user_id}"
+
+    def to_dict(self):
+        return {
+            'bot_id': self.bot_id,
+            'bot_username': self.bot_username,
+            'bot_name': self.bot_name,
+            'refreshed_at': self.refreshed_at,
+            'chats': {reference: info.to_dict() for reference, info in self._chats.items()},
+        }
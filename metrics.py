@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from a cached reply to a slow Bot API round trip
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A total that only goes up, one per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # Label values -> total
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _label_text(self.labels, labels), value
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, plus their sum.
+
+    ``observe`` is a bisect and three additions, cheap enough for every
+    update; cumulative bucket counts are only worked out when scraped.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # Label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series is not None else 0
+
+    def samples(self):
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = (('le', _number(float(bound))),)
+                yield f"{self.name}_bucket", _label_text(self.labels, labels, le), cumulative
+            yield f"{self.name}_sum", _label_text(self.labels, labels), series[-1]
+            yield f"{self.name}_count", _label_text(self.labels, labels), cumulative
+
+
+def timed(histogram, callback, *labels):
+    """Wrap an async callback so every call's duration goes to ``histogram``,
+    whether it returns or raises."""
+    observe = histogram.observe
+    clock = time.perf_counter
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = clock()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            observe(clock() - started, *labels)
+
+    return wrapper
+
+
+class Gauge:
+    """A value read from ``func`` when scraped, e.g. a queue's length."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {e}")
+            return
+        yield self.name, '', value
+
+
+class Registry:
+    """Named metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, func):
+        """Register (or replace) a gauge; its function is called on every scrape."""
+        self._metrics.pop(name, None)
+        return self._add(Gauge(name, help, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` from a registry over plain HTTP."""
+
+    def __init__(self, registry, host='127.0.0.1', port=9464, timeout=5):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.timeout = timeout  # Seconds a client gets to send its request
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"Metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(self._read_request(reader), self.timeout)
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n"
+                f"\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass  # Headers aren't needed
+        return request_line
@@ -0,0 +1,118 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class KeyedLocks:
+    """One FIFO lock per key, kept only while someone holds or waits for it.
+
+    ``async with locks(key):`` runs callers with the same key one at a time
+    in the order they arrived; different keys don't wait for each other.
+    Memory is bounded by the number of keys currently in use.
+    """
+
+    def __init__(self):
+        self._locks = {}  # Key -> [lock, holders and waiters]
+
+    def __call__(self, key):
+        return _KeyedLock(self, key)
+
+    def __len__(self):
+        return len(self._locks)
+
+    def waiting(self):
+        """Callers queued behind another caller with the same key."""
+        return sum(users - 1 for _, users in self._locks.values())
+
+    async def acquire(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+
+    def release(self, key):
+        entry = self._locks[key]
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+
+class _KeyedLock:
+    __slots__ = ('_locks', '_key')
+
+    def __init__(self, locks, key):
+        self._locks = locks
+        self._key = key
+
+    async def __aenter__(self):
+        await self._locks.acquire(self._key)
+
+    async def __aexit__(self, *exc_info):
+        self._locks.release(self._key)
+
+
+def update_key(update):
+    """Updates with the same key are handled in order: the user's id, or the
+    chat's for updates without a user (e.g. channel posts)."""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+    return None
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Handles up to ``max_concurrent_updates`` updates at once, but never two
+    from the same user (or chat) at the same time.
+
+    A user's updates run one after another in arrival order, so two quick
+    taps on a bet button are settled one after the other against the
+    balance the first one left. An update waits for its user's turn before
+    taking one of the concurrency slots, so a user with a backlog can't
+    crowd out everybody else. ``key`` maps an update to its ordering key
+    (None for no ordering). ``pending`` counts updates handed over and not
+    yet finished, ``active`` those of them being handled right now.
+    """
+
+    def __init__(self, max_concurrent_updates, key=update_key):
+        super().__init__(max_concurrent_updates)
+        self.key = key
+        self.locks = KeyedLocks()
+        self.pending = 0
+        self.active = 0
+
+    async def process_update(self, update, coroutine):
+        self.pending += 1
+        try:
+            key = self.key(update)
+            if key is None:
+                await super().process_update(update, coroutine)
+                return
+            async with self.locks(key):
+                await super().process_update(update, coroutine)
+        finally:
+            self.pending -= 1
+
+    async def do_process_update(self, update, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
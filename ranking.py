@@ -0,0 +1,39 @@
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """Users ordered by points, kept sorted as balances change.
+
+    Entries are ``(-points, user_id)`` so the richest users come first and
+    ties break by user id. Updates are O(log N) and reading the top K is
+    O(K + log N), so no handler ever has to sort every user.
+    """
+
+    def __init__(self):
+        self._entries = SortedList()
+
+    def rebuild(self, balances):
+        """Replace the contents with ``(user_id, points)`` pairs."""
+        self._entries = SortedList((-points, user_id) for user_id, points in balances)
+
+    def add(self, user_id, points):
+        self._entries.add((-points, user_id))
+
+    def update(self, user_id, old_points, new_points):
+        """Move a user after their balance changed from old to new."""
+        if old_points != new_points:
+            self._entries.remove((-old_points, user_id))
+            self._entries.add((-new_points, user_id))
+
+    def rank(self, points):
+        """Return the 1-based rank of a balance; tied users share a rank."""
+        # (-points,) sorts before every (-points, user_id) entry, so this
+        # counts the users with strictly more points.
+        return self._entries.bisect_left((-points,)) + 1
+
+    def top(self, k):
+        """Return the ``k`` richest users as ``(user_id, points)`` pairs."""
+        return [(user_id, -neg_points) for neg_points, user_id in self._entries.islice(0, k)]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Calls ``callback(key)`` once the deadline set for ``key`` has passed.
+
+    Deadlines sit in a heap watched by a single task that sleeps until the
+    earliest one, so thousands of pending deadlines cost one timer.
+    Rescheduling or cancelling a key leaves its old heap entry behind; stale
+    entries are skipped when they reach the top. Deadlines scheduled before
+    ``start`` (e.g. reloaded after a restart) fire as soon as it runs if
+    they are already overdue.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._heap = []
+        self._deadlines = {}  # Key -> current deadline, epoch seconds
+        self._running = set()
+        self._wake = None
+        self._task = None
+
+    def schedule(self, key, when):
+        """Set (or move) the deadline for ``key``."""
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, key))
+        if self._wake is not None and self._heap[0] == (when, key):
+            self._wake.set()
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def start(self):
+        """Start watching deadlines on the running event loop."""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop firing deadlines and wait for callbacks already running."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._running:
+            await asyncio.wait(self._running)
+
+    async def _fire(self, key):
+        try:
+            await self._callback(key)
+        except Exception:
+            logger.exception(f"Deadline callback for {key!r} failed")
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) != when:
+                    continue  # Cancelled or moved
+                del self._deadlines[key]
+                task = asyncio.create_task(self._fire(key))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
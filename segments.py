@@ -0,0 +1,235 @@
+import re
+import time
+
+SECONDS_PER_DAY = 86400
+
+
+def day_number(timestamp):
+    """Days since the epoch (UTC) for an epoch-seconds timestamp."""
+    return int(timestamp) // SECONDS_PER_DAY
+
+
+class Bitmap:
+    """A growable set of small integers, one bit each."""
+
+    __slots__ = ('_bits',)
+
+    def __init__(self):
+        self._bits = bytearray()
+
+    def add(self, row):
+        index = row >> 3
+        if index >= len(self._bits):
+            self._bits.extend(bytes(index + 1 - len(self._bits)))
+        self._bits[index] |= 1 << (row & 7)
+
+    def discard(self, row):
+        index = row >> 3
+        if index < len(self._bits):
+            self._bits[index] &= ~(1 << (row & 7)) & 0xFF
+
+    def __contains__(self, row):
+        index = row >> 3
+        return index < len(self._bits) and bool(self._bits[index] >> (row & 7) & 1)
+
+    def to_int(self):
+        """The bitmap as one integer (bit n = row n), for fast AND/OR/NOT."""
+        return int.from_bytes(self._bits, 'little')
+
+
+def _rows(mask):
+    """Yield the set bit positions of an integer, lowest first."""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield (index << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+_TOKEN = re.compile(r'\s*(?:(?P<name>[a-z_][a-z0-9_]*)|(?P<op>[&|!()]))', re.IGNORECASE)
+_WORD_OPS = {'and': '&', 'or': '|', 'not': '!'}
+
+
+class Segments:
+    """Audience segments kept as bitmaps over a dense row index.
+
+    Every user gets the next row number the first time they are seen, so a
+    segment is a bitmap with one bit per user. Segments are updated as
+    users change and combined with Python integer AND/OR/NOT, which costs
+    a few milliseconds even for a million users.
+
+    Built-in segments:
+        all           every user
+        active7d      interacted with the bot in the last ``active_days`` days
+        rich          more than ``rich_threshold`` points
+        never_played  has not placed a bet yet
+
+    "Active" is tracked with one bitmap per day; the window is the OR of
+    the most recent ``active_days`` of them.
+    """
+
+    NAMES = ('all', 'active7d', 'rich', 'never_played')
+
+    def __init__(self, rich_threshold=1000, active_days=7):
+        self.rich_threshold = rich_threshold
+        self.active_days = active_days
+        self._rows = {}   # User id -> row
+        self._ids = []    # Row -> user id
+        self._all = Bitmap()
+        self._rich = Bitmap()
+        self._never_played = Bitmap()
+        self._active = {}  # Day number -> Bitmap of users active that day
+
+    def rebuild(self, records):
+        """Index (user_id, UserRecord) pairs from scratch."""
+        self.__init__(self.rich_threshold, self.active_days)
+        for user_id, record in records:
+            self.add(user_id, record)
+
+    def add(self, user_id, record):
+        """Index a user, or re-index one already known."""
+        row = self._rows.get(user_id)
+        if row is None:
+            row = len(self._ids)
+            self._rows[user_id] = row
+            self._ids.append(user_id)
+            self._all.add(row)
+        self.update_points(user_id, record.points)
+        if record.games_played == 0:
+            self._never_played.add(row)
+        else:
+            self._never_played.discard(row)
+        if record.last_active:
+            self.touch(user_id, record.last_active)
+
+    def update_points(self, user_id, points):
+        row = self._rows.get(user_id)
+        if row is None:
+            return
+        if points > self.rich_threshold:
+            self._rich.add(row)
+        else:
+            self._rich.discard(row)
+
+    def played(self, user_id):
+        row = self._rows.get(user_id)
+        if row is not None:
+            self._never_played.discard(row)
+
+    def touch(self, user_id, timestamp):
+        """Record that a user was active at ``timestamp``."""
+        row = self._rows.get(user_id)
+        if row is None:
+            return
+        day = day_number(timestamp)
+        if day <= day_number(time.time()) - self.active_days:
+            return
+        bitmap = self._active.get(day)
+        if bitmap is None:
+            bitmap = self._active[day] = Bitmap()
+            # A new day has started; forget days that left the window
+            for old in [d for d in self._active if d <= day - self.active_days]:
+                del self._active[old]
+        bitmap.add(row)
+
+    # ---------- queries ----------
+
+    def _mask(self, name):
+        if name == 'all':
+            return self._all.to_int()
+        if name == 'rich':
+            return self._rich.to_int()
+        if name == 'never_played':
+            return self._never_played.to_int()
+        if name == 'active7d':
+            first_day = day_number(time.time()) - self.active_days + 1
+            mask = 0
+            for day, bitmap in self._active.items():
+                if day >= first_day:
+                    mask |= bitmap.to_int()
+            return mask
+        raise ValueError(f"Unknown segment '{name}'. Known: {', '.join(self.NAMES)}")
+
+    def evaluate(self, expression, exclude=()):
+        """Evaluate e.g. ``active7d & !never_played | rich`` to a row mask.
+
+        ``!`` binds tighter than ``&``, which binds tighter than ``|``;
+        ``not``, ``and`` and ``or`` may be written instead. Users in
+        ``exclude`` are left out of the result.
+        """
+        tokens = _tokenize(expression)
+        everyone = self._all.to_int()
+        masks = {}
+
+        def mask(name):
+            if name not in masks:
+                masks[name] = self._mask(name)
+            return masks[name]
+
+        def parse_or():
+            value = parse_and()
+            while tokens and tokens[0] == '|':
+                tokens.pop(0)
+                value |= parse_and()
+            return value
+
+        def parse_and():
+            value = parse_not()
+            while tokens and tokens[0] == '&':
+                tokens.pop(0)
+                value &= parse_not()
+            return value
+
+        def parse_not():
+            if not tokens:
+                raise ValueError("Audience expression ends too early")
+            token = tokens.pop(0)
+            if token == '!':
+                return everyone & ~parse_not()
+            if token == '(':
+                value = parse_or()
+                if not tokens or tokens.pop(0) != ')':
+                    raise ValueError("Missing ')' in audience expression")
+                return value
+            if token in ('&', '|', ')'):
+                raise ValueError(f"Unexpected '{token}' in audience expression")
+            return mask(token)
+
+        value = parse_or()
+        if tokens:
+            raise ValueError(f"Unexpected '{tokens[0]}' in audience expression")
+
+        excluded = Bitmap()
+        for user_id in exclude:
+            row = self._rows.get(user_id)
+            if row is not None:
+                excluded.add(row)
+        return value & ~excluded.to_int()
+
+    def count(self, expression, exclude=()):
+        return self.evaluate(expression, exclude).bit_count()
+
+    def members(self, expression, exclude=()):
+        """User ids matching an expression."""
+        ids = self._ids
+        return [ids[row] for row in _rows(self.evaluate(expression, exclude))]
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise ValueError(f"Can't read audience expression at '{expression[position:]}'")
+        position = match.end()
+        if match.group('op'):
+            tokens.append(match.group('op'))
+        else:
+            name = match.group('name').lower()
+            tokens.append(_WORD_OPS.get(name, name))
+    if not tokens:
+        raise ValueError("Empty audience expression")
+    return tokens
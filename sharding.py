@@ -0,0 +1,223 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(key, shards):
+    """Return the shard that owns a user (or chat) id."""
+    return key % shards
+
+
+def shard_path(path, index):
+    """Give each shard its own copy of a data file or directory."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-shard{index}{ext}"
+
+
+class ShardError(Exception):
+    """A shard operation raised on the shard that ran it."""
+
+
+class ShardTimeout(ShardError):
+    """A shard operation got no reply in time, e.g. its worker died."""
+
+
+class _Pending:
+    """Futures waiting for replies, keyed by call id."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._futures = {}
+
+    def new(self):
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._futures[call_id] = future
+        return call_id, future
+
+    async def wait(self, call_id, future, timeout):
+        """The reply to a call, or ShardTimeout after ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._futures.pop(call_id, None)
+            raise ShardTimeout(f"no reply within {timeout}s") from None
+
+    def resolve(self, call_id, ok, result):
+        future = self._futures.pop(call_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(ShardError(result))
+
+
+def _read_queue(queue, loop, handle):
+    """Pump messages from a multiprocessing queue onto the event loop."""
+    while True:
+        message = queue.get()
+        try:
+            loop.call_soon_threadsafe(handle, message)
+        except RuntimeError:  # The loop has closed, so nobody is listening
+            return
+        if message is None:
+            return
+
+
+class ShardLink:
+    """A worker process's connection to the coordinator.
+
+    Messages arriving in ``inbox``:
+        ('update', data)              an update to process locally
+        ('call', call_id, op, kwargs) run a local shard operation
+        ('reply', call_id, ok, value) answer to one of our own calls
+        None                          shut down
+
+    A call that gets no reply within ``timeout`` seconds raises ShardTimeout.
+    """
+
+    def __init__(self, index, shards, inbox, outbox, timeout=10):
+        self.index = index
+        self.shards = shards
+        self.timeout = timeout
+        self._inbox = inbox
+        self._outbox = outbox
+        self._pending = _Pending()
+        self._on_update = None
+        self._ops = None
+        self.stopped = None
+
+    def owns(self, key):
+        return shard_for(key, self.shards) == self.index
+
+    def start(self, on_update, ops):
+        """Start receiving; ``ops`` maps operation names to coroutines."""
+        self._on_update = on_update
+        self._ops = ops
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        threading.Thread(
+            target=_read_queue,
+            args=(self._inbox, loop, self._handle),
+            name=f"shard-{self.index}-inbox",
+            daemon=True
+        ).start()
+
+    def _handle(self, message):
+        if message is None:
+            self.stopped.set()
+        elif message[0] == 'update':
+            self._on_update(message[1])
+        elif message[0] == 'call':
+            asyncio.create_task(self._serve(*message[1:]))
+        elif message[0] == 'reply':
+            self._pending.resolve(*message[1:])
+
+    async def _serve(self, call_id, op, kwargs):
+        try:
+            result = await self._ops[op](**kwargs)
+        except Exception as e:
+            logger.exception(f"Shard op {op} failed")
+            self._outbox.put(('reply', call_id, False, f"{type(e).__name__}: {e}"))
+        else:
+            self._outbox.put(('reply', call_id, True, result))
+
+    async def call(self, target, op, kwargs):
+        """Run ``op`` on the shard owning user ``target``, or on every
+        shard when ``target`` is None (returns a list, one per shard)."""
+        call_id, future = self._pending.new()
+        self._outbox.put(('call', self.index, call_id, target, op, kwargs))
+        return await self._pending.wait(call_id, future, self.timeout)
+
+
+class Coordinator:
+    """Front-process side of sharded mode.
+
+    Starts one worker process per shard, hands each incoming update to the
+    shard that owns it, and routes shard operations between workers, so a
+    worker only ever talks to the coordinator.
+
+    Messages arriving in the shared ``outbox``:
+        ('call', from_shard, call_id, target, op, kwargs)
+        ('reply', call_id, ok, value)
+
+    A shard that doesn't reply within ``timeout`` seconds fails the call
+    with ShardTimeout instead of holding up its caller.
+    """
+
+    def __init__(self, shards, worker_target, timeout=10):
+        context = multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.timeout = timeout
+        self._inboxes = [context.Queue() for _ in range(shards)]
+        self._outbox = context.Queue()
+        self._pending = _Pending()
+        self._processes = [
+            context.Process(
+                target=worker_target,
+                args=(index, shards, self._inboxes[index], self._outbox),
+                name=f"shard-{index}",
+                daemon=True
+            )
+            for index in range(shards)
+        ]
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+        loop = asyncio.get_running_loop()
+        threading.Thread(
+            target=_read_queue,
+            args=(self._outbox, loop, self._handle),
+            name="coordinator-outbox",
+            daemon=True
+        ).start()
+        logger.info(f"Started {self.shards} shard workers")
+
+    def stop(self, timeout=30):
+        """Ask every worker to finish its work and wait for them to exit."""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not exit, terminating")
+                process.terminate()
+        self._outbox.put(None)
+
+    def dispatch(self, key, data):
+        """Send an update to the shard owning ``key``."""
+        self._inboxes[shard_for(key, self.shards)].put(('update', data))
+
+    def _handle(self, message):
+        if message is None:
+            return
+        if message[0] == 'call':
+            asyncio.create_task(self._route(*message[1:]))
+        elif message[0] == 'reply':
+            self._pending.resolve(*message[1:])
+
+    async def call_shard(self, index, op, kwargs):
+        """Run ``op`` on one shard from the front process."""
+        call_id, future = self._pending.new()
+        self._inboxes[index].put(('call', call_id, op, kwargs))
+        return await self._pending.wait(call_id, future, self.timeout)
+
+    async def _route(self, from_shard, call_id, target, op, kwargs):
+        try:
+            if target is None:
+                result = list(await asyncio.gather(
+                    *(self.call_shard(index, op, kwargs) for index in range(self.shards))
+                ))
+            else:
+                result = await self.call_shard(shard_for(target, self.shards), op, kwargs)
+        except ShardError as e:
+            self._inboxes[from_shard].put(('reply', call_id, False, str(e)))
+        else:
+            self._inboxes[from_shard].put(('reply', call_id, True, result))
@@ -0,0 +1,154 @@
+"""Monte Carlo simulation of the games' payouts, for tuning bets and limits.
+
+Run with ``python simulation.py``; ``python simulation.py --help`` lists
+the options. Rounds are sampled in NumPy batches straight from the payout
+tables in ``gamerules.py``, so the numbers describe the rules the bot
+actually plays by. NumPy is only needed here, not by the bot.
+"""
+import argparse
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Only the simulator needs NumPy
+    np = None
+
+from gamerules import GAMES
+
+RUIN_CHECKPOINTS = (10, 25, 50, 100, 250, 500, 1000)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The simulator needs NumPy: pip install numpy")
+
+
+def sample_multipliers(game, size, rng):
+    """``size`` random round multipliers of a game (its outcomes are equally likely)."""
+    table = np.asarray(game.multipliers, dtype=np.int64)
+    return table[rng.integers(0, len(table), size=size)]
+
+
+class GameReport:
+    """Simulated results of one game at one bet size."""
+
+    def __init__(self, game, bet, rounds, rtp, variance, ruin):
+        self.game = game
+        self.bet = bet
+        self.rounds = rounds
+        self.rtp = rtp            # Paid out / staked
+        self.variance = variance  # Of the net result of one round, in points squared
+        self.ruin = ruin          # Round -> share of players broke by then
+
+    @property
+    def edge(self):
+        """House edge; negative means the game pays out more than it takes."""
+        return 1 - self.rtp
+
+    @property
+    def minted_per_round(self):
+        """Points created (or destroyed, if negative) per round on average."""
+        return (self.rtp - 1) * self.bet
+
+    def to_dict(self):
+        return {
+            'game': self.game.name,
+            'bet': self.bet,
+            'rounds': self.rounds,
+            'rtp': self.rtp,
+            'exact_rtp': self.game.rtp,
+            'edge': self.edge,
+            'variance': self.variance,
+            'stdev': self.variance ** 0.5,
+            'minted_per_round': self.minted_per_round,
+            'ruin': dict(self.ruin),
+        }
+
+
+def simulate_rtp(game, bet, rounds, rng, batch_size=1_000_000):
+    """RTP and per-round variance of the net result over ``rounds`` rounds.
+
+    Rounds are drawn ``batch_size`` at a time and only running sums are
+    kept, so memory stays flat however many rounds are asked for.
+    """
+    _require_numpy()
+    total = 0
+    total_squares = 0
+    done = 0
+    while done < rounds:
+        size = min(batch_size, rounds - done)
+        net = (sample_multipliers(game, size, rng) - 1) * bet
+        total += int(net.sum())
+        total_squares += int((net * net).sum())
+        done += size
+    mean = total / rounds
+    variance = total_squares / rounds - mean * mean
+    return 1 + mean / bet, variance
+
+
+def simulate_ruin(game, bet, bankroll, players, rng, checkpoints=RUIN_CHECKPOINTS, batch_size=10_000):
+    """Share of players who can no longer afford ``bet`` by each checkpoint.
+
+    Every player starts with ``bankroll`` points and bets ``bet`` each round
+    until their balance drops below it. A batch of players is one matrix of
+    rounds; a running sum gives every balance after every round at once.
+    """
+    _require_numpy()
+    if bankroll < bet:
+        return [(checkpoint, 1.0) for checkpoint in checkpoints]
+    horizon = max(checkpoints)
+    ruined_by = np.zeros(horizon, dtype=np.int64)  # Players first broke in round i
+    done = 0
+    while done < players:
+        size = min(batch_size, players - done)
+        net = (sample_multipliers(game, (size, horizon), rng) - 1) * bet
+        balances = bankroll + np.cumsum(net, axis=1)
+        broke = balances < bet
+        # A player who is broke stops playing, so only their first broke round counts
+        has_gone_broke = broke.any(axis=1)
+        first_round = broke.argmax(axis=1)[has_gone_broke]
+        ruined_by += np.bincount(first_round, minlength=horizon)
+        done += size
+    curve = np.cumsum(ruined_by) / players
+    return [(checkpoint, float(curve[checkpoint - 1])) for checkpoint in checkpoints]
+
+
+def simulate(game, bet, rounds=1_000_000, bankroll=100, players=10_000, seed=None):
+    """Simulate one game at one bet size; returns a GameReport."""
+    _require_numpy()
+    rng = np.random.default_rng(seed)
+    rtp, variance = simulate_rtp(game, bet, rounds, rng)
+    ruin = simulate_ruin(game, bet, bankroll, players, rng)
+    return GameReport(game, bet, rounds, rtp, variance, ruin)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--game', action='append', choices=sorted(GAMES), help="game to simulate (default: all)")
+    parser.add_argument('--rounds', type=int, default=1_000_000, help="rounds per game and bet for RTP")
+    parser.add_argument('--bankroll', type=int, default=100, help="starting points for ruin curves")
+    parser.add_argument('--players', type=int, default=10_000, help="players simulated for ruin curves")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    if np is None:
+        parser.error("the simulator needs NumPy: pip install numpy")
+
+    header = " ".join(f"{f'@{c}':>6}" for c in RUIN_CHECKPOINTS)
+    print(f"Ruin: share of players starting with {args.bankroll} points who are broke by round N")
+    for name in args.game or sorted(GAMES):
+        game = GAMES[name]
+        print(f"== {name}: exact RTP {game.rtp:.4f}, bets {game.min_bet}-{game.max_bet}")
+        print(f"{'bet':>5} {'RTP':>7} {'edge':>7} {'stdev':>8} {'mint/rnd':>9}  {header}")
+        for bet in sorted(set(game.bets) | {game.min_bet, game.max_bet}):
+            start = time.perf_counter()
+            report = simulate(game, bet, args.rounds, args.bankroll, args.players, args.seed)
+            ruin = " ".join(f"{share:6.1%}" for _, share in report.ruin)
+            print(
+                f"{bet:>5} {report.rtp:7.4f} {report.edge:+7.2%} {report.variance ** 0.5:8.1f} "
+                f"{report.minted_per_round:+9.2f}  {ruin}"
+                f"  ({time.perf_counter() - start:.1f}s)"
+            )
+
+
+if __name__ == '__main__':
+    main()
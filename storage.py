@@ -0,0 +1,223 @@
+import logging
+import operator
+import sqlite3
+
+from writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+# Column order used for the table, the write-behind rows and UserRecord
+USER_COLUMNS = (
+    'username',
+    'first_name',
+    'joined_date',
+    'points',
+    'referrals',
+    'last_checkin',
+    'games_played',
+    'games_won',
+    'total_winnings',
+    'last_active',
+)
+
+_record_row = operator.attrgetter(*USER_COLUMNS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    joined_date INTEGER NOT NULL DEFAULT 0,
+    points INTEGER NOT NULL DEFAULT 0,
+    referrals INTEGER NOT NULL DEFAULT 0,
+    last_checkin INTEGER NOT NULL DEFAULT 0,
+    games_played INTEGER NOT NULL DEFAULT 0,
+    games_won INTEGER NOT NULL DEFAULT 0,
+    total_winnings INTEGER NOT NULL DEFAULT 0,
+    last_active INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Columns added after the table was first released, with their definitions
+ADDED_COLUMNS = {
+    'last_active': "INTEGER NOT NULL DEFAULT 0",
+}
+
+UPSERT_SQL = (
+    f"INSERT OR REPLACE INTO users (user_id, {', '.join(USER_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(USER_COLUMNS) + 1))})"
+)
+
+
+class UserRecord:
+    """Fixed-schema user record.
+
+    Slots instead of a per-user dict keep each record to a fraction of the
+    size; timestamps are integer epoch seconds, with 0 meaning "never".
+    """
+
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, username=None, first_name=None, joined_date=0, points=0,
+                 referrals=0, last_checkin=0, games_played=0, games_won=0,
+                 total_winnings=0, last_active=0):
+        self.username = username
+        self.first_name = first_name
+        self.joined_date = joined_date
+        self.points = points
+        self.referrals = referrals
+        self.last_checkin = last_checkin
+        self.games_played = games_played
+        self.games_won = games_won
+        self.total_winnings = total_winnings
+        self.last_active = last_active
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in USER_COLUMNS)
+        return f"UserRecord({fields})"
+
+
+class UserStore(WriteBehind):
+    """User records kept in memory and persisted to SQLite in the background.
+
+    Handlers read and mutate records in memory and call ``mark_dirty``.
+    A background task commits all dirty records in a single transaction
+    every ``flush_interval`` seconds, so no handler waits on disk I/O.
+    """
+
+    write_errors = (sqlite3.Error,)
+    description = 'users'
+
+    def __init__(self, path, flush_interval=0.25):
+        super().__init__(flush_interval)
+        self.path = path
+        self._users = {}
+        self._by_username = {}  # Lowercased username -> user id
+        self._dirty = set()
+        self._conn = None
+
+    # ---------- lifecycle ----------
+
+    def open(self):
+        """Open the database and load every user into memory."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        for name, definition in ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE users ADD COLUMN {name} {definition}")
+        self._conn.commit()
+
+        # Rows written before timestamps became NOT NULL may still hold NULL
+        cursor = self._conn.execute(
+            "SELECT user_id, username, first_name, IFNULL(joined_date, 0), points, referrals, "
+            "IFNULL(last_checkin, 0), games_played, games_won, total_winnings, last_active FROM users"
+        )
+        for row in cursor:
+            record = UserRecord(*row[1:])
+            self._users[row[0]] = record
+            if record.username:
+                self._by_username[record.username.lower()] = row[0]
+
+        logger.info(f"Loaded {len(self._users)} users from {self.path}")
+
+    async def close(self):
+        """Stop the flush task and write out anything still pending."""
+        await super().close()
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    # ---------- record access ----------
+
+    def get(self, user_id, default=None):
+        return self._users.get(user_id, default)
+
+    def create(self, user_id, record):
+        """Insert a new record and schedule it for writing."""
+        self._users[user_id] = record
+        if record.username:
+            self._by_username[record.username.lower()] = user_id
+        self._dirty.add(user_id)
+        return record
+
+    def update_identity(self, user_id, username, first_name):
+        """Record a user's current Telegram username and first name.
+
+        Usernames are unique on Telegram at any moment, so the most recent
+        user seen with a name owns it in the index; a stale record still
+        carrying the name from before a rename is never returned by
+        ``find_by_username``.
+        """
+        record = self._users[user_id]
+        if record.username != username:
+            if record.username:
+                old_key = record.username.lower()
+                if self._by_username.get(old_key) == user_id:
+                    del self._by_username[old_key]
+            if username:
+                self._by_username[username.lower()] = user_id
+            record.username = username
+        record.first_name = first_name
+        self._dirty.add(user_id)
+
+    def find_by_username(self, username):
+        """Return the id of the user currently holding a username, or None."""
+        key = username.lstrip('@').lower()
+        user_id = self._by_username.get(key)
+        if user_id is None:
+            return None
+        record = self._users[user_id]
+        if not record.username or record.username.lower() != key:
+            return None
+        return user_id
+
+    def mark_dirty(self, user_id):
+        """Schedule a record for the next batched commit."""
+        if user_id in self._users:
+            self._dirty.add(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def keys(self):
+        return self._users.keys()
+
+    def values(self):
+        return self._users.values()
+
+    def items(self):
+        return self._users.items()
+
+    # ---------- persistence ----------
+
+    def _has_pending(self):
+        return bool(self._dirty)
+
+    def _take_pending(self):
+        """Snapshot dirty records as rows and clear the dirty set.
+
+        Rows are built on the event loop so records are not read while a
+        handler is halfway through mutating them; only the commit itself
+        runs in a worker thread.
+        """
+        dirty, self._dirty = self._dirty, set()
+        users = self._users
+        rows = [(user_id, *_record_row(users[user_id])) for user_id in dirty]
+        return dirty, rows
+
+    def _restore_pending(self, pending):
+        self._dirty |= pending[0]
+
+    def _write(self, pending):
+        with self._conn:
+            self._conn.executemany(UPSERT_SQL, pending[1])
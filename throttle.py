@@ -0,0 +1,45 @@
+import time
+
+
+class Throttle:
+    """Token buckets keyed by user or chat id, for dropping bursts of taps.
+
+    Each key may act ``rate`` times per second on average, in bursts of up
+    to ``burst``. ``allow`` is O(1). Only the ``max_keys`` most recently
+    seen keys keep a bucket; a dropped key starts again with a full burst,
+    which is what its bucket would have refilled to anyway unless it was
+    active within the last ``burst / rate`` seconds.
+    """
+
+    def __init__(self, rate, burst, max_keys=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.dropped = 0
+        self._buckets = {}  # Key -> (tokens, updated), least recently seen first
+
+    def allow(self, key, now=None):
+        """Take a token for ``key``; returns False if its bucket is empty."""
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.burst
+            if len(self._buckets) >= self.max_keys:
+                # Dicts keep insertion order, so the first key is the stalest
+                del self._buckets[next(iter(self._buckets))]
+        else:
+            tokens, updated = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            return True
+        self._buckets[key] = (tokens, now)
+        self.dropped += 1
+        return False
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def in_thread(func, *args, on_error=None):
+    """Run a blocking ``func(*args)`` in a worker thread and return its result.
+
+    Unlike a bare ``asyncio.to_thread``, cancelling the caller does not
+    abandon the call: it is waited for before CancelledError goes on, so
+    close() never uses a connection or file a worker thread is still
+    committing to. A call that fails while the caller is being cancelled
+    is passed to ``on_error``, as nobody else gets to see its exception.
+    """
+    call = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(call)
+    except asyncio.CancelledError:
+        await asyncio.wait([call])
+        if on_error is not None and not call.cancelled() and call.exception() is not None:
+            on_error(call.exception())
+        raise
+
+
+class WriteBehind:
+    """Base for stores that change in memory and are written in the background.
+
+    Every ``flush_interval`` seconds a task takes the pending changes and
+    writes them in a worker thread; if that fails with one of
+    ``write_errors`` they are put back to be retried with the next batch.
+    Subclasses say what is pending with ``_has_pending``,
+    ``_take_pending`` and ``_restore_pending``, and write it with
+    ``_write``, which must not touch in-memory state.
+    """
+
+    write_errors = (OSError,)
+    description = 'changes'  # For log messages
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._flusher = None
+
+    def start(self):
+        """Start the background flush task on the running event loop."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self):
+        """Stop the flush task; subclasses then write out what is still
+        pending and close their file or connection."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # The subclass still writes out what is pending
+                logger.error(f"Background writes of {self.description} had stopped: {e!r}")
+            self._flusher = None
+
+    def flush(self):
+        """Synchronously write all pending changes."""
+        if not self._has_pending():
+            return
+        pending = self._take_pending()
+        try:
+            self._write(pending)
+        except self.write_errors:
+            self._restore_pending(pending)
+            raise
+
+    async def _flush_in_thread(self):
+        """Write the pending changes in a worker thread; returns whether
+        they were written."""
+        pending = self._take_pending()
+        try:
+            await in_thread(self._write, pending, on_error=lambda e: self._restore_pending(pending))
+        except self.write_errors as e:
+            logger.error(f"Failed to write {self.description}, will retry: {e}")
+            self._restore_pending(pending)
+            return False
+        return True
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._has_pending():
+                await self._flush_in_thread()